@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+# --- RUNTIME CONFIG ---
+# Server-side knobs (per-request settings live in schemas.py). Override with env vars.
+
+# Origins the browser app may call from (comma-separated; the Vite dev server by default).
+# The chunked uploads use PUT / JSON requests, which browsers preflight
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "http://localhost:5173").split(",") if o.strip()]
+
+# Where uploads are spooled to disk (None -> system temp dir)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR") or None
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# Max workbook bytes a single request may have in flight in the parser pool at once.
+# At least one file is always admitted, so peak memory follows the biggest file, not the batch.
+REQUEST_MEMORY_LIMIT_MB = int(os.environ.get("REQUEST_MEMORY_LIMIT_MB", 256))
+REQUEST_MEMORY_LIMIT = REQUEST_MEMORY_LIMIT_MB * 1024 * 1024
+
+# Shared parser pool (started/stopped with the app)
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", os.cpu_count() or 2))
+# How many requests may use the pool at the same time; the rest wait in line
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))
+
+# Streaming mode (streaming=true): rows of the restock master / shipment invoice read,
+# matched and written at a time
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", 50000))
+
+# Parsed-workbook cache (keyed by SHA-256 of the file + reader engine)
+PARSE_CACHE_MB = int(os.environ.get("PARSE_CACHE_MB", 512))
+# Optional second tier on local disk (None -> memory only)
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR") or None
+PARSE_CACHE_DISK_MB = int(os.environ.get("PARSE_CACHE_DISK_MB", 4096))
+
+# Background jobs (/api/jobs). Job records and results live in JOB_RESULT_DIR: with several
+# processes, give them the same one (and PROGRESS_BUS=file) so any of them serves any job
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))  # jobs running at the same time
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 50))  # jobs allowed to wait
+JOB_RESULT_DIR = os.environ.get("JOB_RESULT_DIR") or os.path.join(tempfile.gettempdir(), "convertion-jobs")
+JOB_RESULT_TTL_MINUTES = int(os.environ.get("JOB_RESULT_TTL_MINUTES", 24 * 60))
+
+# Incremental restock (incremental=true): per-supplier tables + price-war state from earlier runs
+RESTOCK_STATE_DIR = os.environ.get("RESTOCK_STATE_DIR") or os.path.join(tempfile.gettempdir(), "convertion-restock-state")
+RESTOCK_STATE_MB = int(os.environ.get("RESTOCK_STATE_MB", 2048))
+
+# Reference datasets (/api/datasets): parsed restock / order / master files kept between requests
+DATASET_DIR = os.environ.get("DATASET_DIR") or os.path.join(tempfile.gettempdir(), "convertion-datasets")
+
+# Content store for chunked uploads (/api/blobs): every file kept once under its SHA-256,
+# so the pipelines can take blob ids instead of re-uploaded files. Oldest blobs are
+# dropped past BLOB_STORE_MB; unfinished uploads are dropped after BLOB_PARTIAL_TTL_HOURS
+BLOB_DIR = os.environ.get("BLOB_DIR") or os.path.join(tempfile.gettempdir(), "convertion-blobs")
+BLOB_STORE_MB = int(os.environ.get("BLOB_STORE_MB", 4096))
+BLOB_CHUNK_MB = int(os.environ.get("BLOB_CHUNK_MB", 16))  # largest chunk one PUT may carry
+BLOB_PARTIAL_TTL_HOURS = float(os.environ.get("BLOB_PARTIAL_TTL_HOURS", 24))
+
+# Progress messages (/ws/{client_id}). "memory": one server process (default).
+# "file": several processes / containers on one host share PROGRESS_BUS_DIR, so a job's
+# progress reaches the client whichever process holds its WebSocket
+PROGRESS_BUS = os.environ.get("PROGRESS_BUS", "memory")
+PROGRESS_BUS_DIR = os.environ.get("PROGRESS_BUS_DIR") or os.path.join(tempfile.gettempdir(), "convertion-progress")
+# Heartbeat sent to every socket; a socket that hasn't answered (or sent anything) for
+# WS_STALE_SECONDS is closed
+WS_HEARTBEAT_SECONDS = float(os.environ.get("WS_HEARTBEAT_SECONDS", 20))
+WS_STALE_SECONDS = float(os.environ.get("WS_STALE_SECONDS", 60))
+# A client whose last socket closed (and didn't reconnect within this many seconds) has its
+# running direct requests cancelled; background jobs keep going. Negative: never cancel
+WS_DISCONNECT_CANCEL_SECONDS = float(os.environ.get("WS_DISCONNECT_CANCEL_SECONDS", 5))
+
+# Preview mode (preview=true): data rows sampled from the big inputs (Ham files, master, invoice)
+PREVIEW_ROWS = int(os.environ.get("PREVIEW_ROWS", 1000))
+PREVIEW_SAMPLE_OUTPUT = int(os.environ.get("PREVIEW_SAMPLE_OUTPUT", 10))  # output rows shown
+
+# Engine for the column-wide joins / set filters / group-bys (app/services/engines.py):
+# "pandas" (default) or "polars" (multi-threaded; pip install polars). Same outputs either way
+COMPUTE_ENGINE = os.environ.get("COMPUTE_ENGINE", "pandas")
+# How worker processes are started (fork | spawn | forkserver; empty: the platform default).
+# A child forked after polars' thread pool started can deadlock, so polars defaults to spawn
+WORKER_START_METHOD = os.environ.get("WORKER_START_METHOD") or ("spawn" if COMPUTE_ENGINE == "polars" else None)
@@ -0,0 +1,164 @@
+import hashlib
+import functools
+import pandas as pd
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, Tuple
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+from app.logic.processing import FileSource, excel_input
+
+try:
+    import python_calamine
+except ImportError:  # openpyxl (through pandas) is the fallback
+    python_calamine = None
+
+# --- COLUMN SPECS ---
+# A spec is one of the settings alias maps: {logical key: [header aliases]}
+# (RestockSettings.column_mappings, ShipmentSettings.invoice_columns, ...)
+ColumnSpec = Dict[str, List[str]]
+
+def spec_signature(spec: ColumnSpec) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """Hashable form of a spec (for the memo and the parse-cache key)."""
+    return tuple((key, tuple(aliases)) for key, aliases in spec.items())
+
+def spec_digest(spec: ColumnSpec, keep_all: bool = False) -> str:
+    text = repr((spec_signature(spec), keep_all))
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+def normalize_header(name) -> str:
+    return str(name).replace(" ", "").lower()
+
+@functools.lru_cache(maxsize=512)
+def plan_columns(header: Tuple, signature: Tuple) -> Tuple[int, ...]:
+    """
+    Header positions to load for a spec. Resolved once per header layout (suppliers send
+    the same layout every week, so this is nearly always a cache hit).
+    A column is kept if it matches ANY alias, exactly (after strip) or ignoring
+    spaces/case: a superset of what `find_column` / `find_col` can pick, so running
+    them on the projected frame gives the same answer as on the full sheet.
+    """
+    exact = {alias for _, aliases in signature for alias in aliases}
+    loose = {normalize_header(alias) for alias in exact}
+
+    positions = []
+    for i, name in enumerate(header):
+        if name is None or name == "" or name != name:  # blank / NaN header cell
+            continue
+        if str(name).strip() in exact or normalize_header(name) in loose:
+            positions.append(i)
+    return tuple(positions)
+
+# --- READERS ---
+def convert_cell(value):
+    """Same cell conversion pandas' calamine reader does (whole floats -> int, dates -> datetime)."""
+    if isinstance(value, float):
+        as_int = int(value)
+        return as_int if as_int == value else value
+    if isinstance(value, (datetime, timedelta, time)):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+def frame_from_rows(rows: List[List]) -> pd.DataFrame:
+    """
+    Header row + data rows (already projected) -> DataFrame, through the same parser
+    pd.read_excel uses, so dtypes come out exactly as before (numeric-looking text
+    like "0412" still becomes 412, which is what the UPC matching has always relied on).
+    """
+    try:
+        return TextParser(rows, header=0, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+def read_calamine(source: FileSource, spec: ColumnSpec) -> pd.DataFrame:
+    source = excel_input(source)
+    if isinstance(source, str):
+        workbook = python_calamine.CalamineWorkbook.from_path(source)
+    else:
+        workbook = python_calamine.CalamineWorkbook.from_filelike(source)
+    rows = workbook.get_sheet_by_index(0).to_python(skip_empty_area=False)
+    if not rows:
+        return pd.DataFrame()
+
+    header = tuple(convert_cell(cell) for cell in rows[0])
+    positions = plan_columns(header, spec_signature(spec))
+    # Only the wanted cells are ever converted to Python objects
+    return frame_from_rows([[convert_cell(row[i]) for i in positions] for row in rows])
+
+def read_openpyxl(source: FileSource, spec: ColumnSpec) -> pd.DataFrame:
+    # openpyxl streams rows, so the header alone is cheap to read first
+    header = pd.read_excel(excel_input(source), engine="openpyxl", nrows=1, header=None, dtype=object)
+    if header.empty:
+        return pd.DataFrame()
+    positions = plan_columns(tuple(header.iloc[0].tolist()), spec_signature(spec))
+    return pd.read_excel(excel_input(source), engine="openpyxl", usecols=list(positions))
+
+def is_blank_row(row: List) -> bool:
+    return all(cell is None or cell == "" for cell in row)
+
+def iter_column_chunks(source: FileSource, spec: ColumnSpec, keep_all: bool = False,
+                       chunk_rows: int = 50000) -> Iterator[pd.DataFrame]:
+    """
+    Streaming version of read_columns: the first sheet as DataFrames of up to
+    `chunk_rows` rows, all with the same columns. openpyxl's read-only mode parses the
+    sheet XML as it goes, so memory stays flat however long the sheet is (calamine
+    always loads the whole sheet). Always yields at least one (maybe empty) frame.
+    Types are inferred per chunk, so a column that mixes text and numbers can come out
+    differently from one chunk to the next; clean columns read the same as read_columns.
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(excel_input(source), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            yield pd.DataFrame()
+            return
+        header = [convert_cell(cell) for cell in header]
+        positions = range(len(header)) if keep_all else plan_columns(tuple(header), spec_signature(spec))
+        names = [header[i] for i in positions]
+
+        chunk, blanks, emitted = [], [], False
+        for row in rows:
+            values = [convert_cell(row[i]) if i < len(row) else None for i in positions]
+            if is_blank_row(values):
+                blanks.append(values)  # kept only if more data follows (pandas drops trailing blank rows)
+                continue
+            chunk.extend(blanks)
+            blanks = []
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                yield frame_from_rows([names] + chunk)
+                chunk, emitted = [], True
+        if chunk or not emitted:
+            yield frame_from_rows([names] + chunk)
+    finally:
+        workbook.close()
+
+def read_sample(source: FileSource, spec: ColumnSpec, rows: int, keep_all: bool = False) -> pd.DataFrame:
+    """
+    The header and first `rows` data rows of the first sheet (aliased columns only, unless
+    `keep_all`), without parsing the rest of the workbook.
+    """
+    chunks = iter_column_chunks(source, spec, keep_all, chunk_rows=rows)
+    try:
+        return next(chunks).head(rows)
+    finally:
+        chunks.close()
+
+def read_columns(source: FileSource, spec: ColumnSpec, keep_all: bool = False) -> pd.DataFrame:
+    """
+    Reads the first sheet, loading only the columns `spec` can resolve to
+    (every column if `keep_all`, e.g. the restock master that is written back out).
+    """
+    if python_calamine is not None:
+        try:
+            if keep_all:
+                return pd.read_excel(excel_input(source), engine="calamine")
+            return read_calamine(source, spec)
+        except Exception:
+            pass  # Fall back to openpyxl (slower, but reads what calamine can't)
+    if keep_all:
+        return pd.read_excel(excel_input(source), engine="openpyxl")
+    return read_openpyxl(source, spec)
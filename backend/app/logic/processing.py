@@ -0,0 +1,62 @@
+import io
+import os
+import pandas as pd
+import numpy as np
+from typing import Tuple, Union
+
+# --- FILE SOURCES ---
+# A workbook is either the raw bytes or the path of an upload spooled to disk
+FileSource = Union[bytes, str]
+
+def excel_input(source: FileSource):
+    """What pd.read_excel needs: paths are passed through, bytes get wrapped in a buffer."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+def source_size(source: FileSource) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    return os.path.getsize(source)
+
+
+# --- HELPERS: Column versions of the per-cell conversions used by the services ---
+def to_float(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column version of `float(x)`.
+    Returns (floats, ok) where `ok` is False wherever `float(x)` would have raised.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return values.astype(float), np.ones(len(values), dtype=bool)
+
+    series = pd.Series(values, dtype=object)
+    floats = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, copy=True)
+    # float('nan') is fine, float(None) / float('abc') are not
+    is_float = series.map(type).isin([float, np.float64]).to_numpy()
+    ok = ~np.isnan(floats) | is_float
+    # to_numeric gives up on text float() takes ('nan', 'inf', '1_000'): ask float() itself
+    for i in np.flatnonzero(~ok & series.notna().to_numpy()):
+        try:
+            floats[i] = float(values[i])
+            ok[i] = True
+        except (TypeError, ValueError):
+            pass
+    return floats, ok
+
+def parse_pk(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column version of `int(str(pk).upper().replace('PK', '').strip())`.
+    Returns (pk, ok) where `ok` is False wherever the int() would have raised.
+    """
+    # A PK column holds a handful of distinct values: parse each one once.
+    # Hashing merges 1, 1.0 and True, whose str() differ, so mixed number types go through str() first.
+    series = pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(series)
+    if len({type(u) for u in uniques if not isinstance(u, str)}) > 1:
+        codes, uniques = pd.factorize(series.map(str))
+    text = pd.Series(uniques, dtype=object).map(str).str.upper().str.replace('PK', '', regex=False).str.strip()
+    # Last slot: missing cells (code -1), where str() gives "None" / "nan"
+    ok = np.append(text.str.fullmatch(r'[+-]?\d+').to_numpy(dtype=bool), [False])
+    pks = np.append(pd.to_numeric(text.where(ok[:-1]), errors='coerce').astype(float).to_numpy(), [np.nan])
+    return pks[codes], ok[codes]
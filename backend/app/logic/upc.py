@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# --- CANONICAL UPC KEYS ---
+# Every UPC cell becomes one int64: the GTIN digits read as a number. Leading zeros
+# carry no information in that form, so "012345678905", 12345678905, 12345678905.0
+# and " 0-12345-67890-5 " all end up as the same key (and the same 12-digit text
+# via format_upc). Blank cells and junk get INVALID_UPC, which never matches anything.
+INVALID_UPC = -1
+MAX_UPC = 10 ** 14  # GTIN-14 is the longest code we accept
+SAMPLE_LIMIT = 10
+POWERS_OF_TEN = 10 ** np.arange(15, dtype=np.int64)
+
+class UpcReport:
+    """What normalize_upcs made of a column: counts plus a few of the rejected raw values."""
+    def __init__(self):
+        self.total = 0
+        self.valid = 0
+        self.blank = 0
+        self.invalid = 0
+        self.repaired = 0         # short codes completed with a check digit (repair=True only)
+        self.bad_check_digit = 0  # codes kept as-is despite a wrong check digit
+        self.samples: List[str] = []
+
+    def add(self, other: "UpcReport") -> "UpcReport":
+        for field in ("total", "valid", "blank", "invalid", "repaired", "bad_check_digit"):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.samples = (self.samples + other.samples)[:SAMPLE_LIMIT]
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "total": self.total,
+            "valid": self.valid,
+            "blank": self.blank,
+            "invalid": self.invalid,
+            "repaired": self.repaired,
+            "bad_check_digit": self.bad_check_digit,
+            "invalid_samples": self.samples,
+        }
+
+def check_digit(body: np.ndarray) -> np.ndarray:
+    """GTIN check digit of every number in `body` (weights 3,1,3,... from the right)."""
+    body = body.copy()
+    total = np.zeros(len(body), dtype=np.int64)
+    weight = 3
+    while body.any():
+        total += (body % 10) * weight
+        body //= 10
+        weight = 4 - weight
+    return (10 - total % 10) % 10
+
+def has_valid_check_digit(keys: np.ndarray) -> np.ndarray:
+    return check_digit(keys // 10) == keys % 10
+
+def digit_count(keys: np.ndarray) -> np.ndarray:
+    """Number of digits of each (positive) key."""
+    return np.searchsorted(POWERS_OF_TEN, keys, side='right')
+
+def parse_text(text: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Text cells -> (keys, widths), widths being how many digits the cell spelled out
+    (leading zeros included). Plain digit strings (the usual case) skip the regex clean-up.
+    """
+    text = pd.Series(text, dtype=object)
+    keys = np.full(len(text), INVALID_UPC, dtype=np.int64)
+    widths = text.str.len().to_numpy(dtype=np.int64).copy()
+    plain = (text.str.isdigit() & text.str.isascii() & (text.str.len() <= 14)).to_numpy(dtype=bool)
+    keys[plain] = text[plain].astype(np.int64).to_numpy()
+    if not plain.all():
+        digits = text[~plain].str.strip().str.replace(r'[\s\-]', '', regex=True).str.replace(r'\.0+$', '', regex=True)
+        ok = digits.str.fullmatch(r'\d{1,14}').to_numpy(dtype=bool)
+        rest = np.full(len(digits), INVALID_UPC, dtype=np.int64)
+        rest[ok] = digits[ok].astype(np.int64).to_numpy()
+        keys[~plain] = rest
+        widths[~plain] = digits.str.len().to_numpy(dtype=np.int64)
+    keys[keys == 0] = INVALID_UPC
+    return keys, widths
+
+def parse_cells(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Raw cells -> (keys, blank, widths). Keys are INVALID_UPC where the cell is not a UPC.
+    Numbers must be whole; text may carry spaces, dashes or a trailing ".0"
+    (a number that went through str() or a CSV), but nothing else.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if values.dtype.kind in 'iu':
+        keys = values.astype(np.int64)
+        keys = np.where((keys > 0) & (keys < MAX_UPC), keys, INVALID_UPC)
+        return keys, np.zeros(n, dtype=bool), digit_count(keys)
+    if values.dtype.kind == 'f':
+        ok = np.isfinite(values) & (values == np.floor(values)) & (values > 0) & (values < MAX_UPC)
+        keys = np.where(ok, values, 0).astype(np.int64)
+        keys = np.where(ok, keys, INVALID_UPC)
+        return keys, np.isnan(values), digit_count(keys)
+
+    series = pd.Series(values, dtype=object)
+    kinds = series.map(type)
+    is_text = kinds.isin([str, np.str_])
+    is_number = ~is_text & ~kinds.isin([bool, np.bool_]) & series.notna()
+    blank = series.isna().to_numpy().copy()
+
+    keys = np.full(n, INVALID_UPC, dtype=np.int64)
+    widths = np.zeros(n, dtype=np.int64)
+    if is_number.any():
+        numbers = pd.to_numeric(series[is_number], errors='coerce').astype(float).to_numpy()
+        rows = is_number.to_numpy()
+        keys[rows], _, widths[rows] = parse_cells(numbers)
+    if is_text.any():
+        text = series[is_text].astype(str)
+        rows = is_text.to_numpy()
+        keys[rows], widths[rows] = parse_text(text.to_numpy(dtype=object))
+        blank[rows] = (text.str.strip() == "").to_numpy()
+    return keys, blank, widths
+
+def normalize_upcs(values, repair: bool = False) -> Tuple[np.ndarray, UpcReport]:
+    """
+    Column of UPC cells (any mix of int / float / text) -> (int64 keys, report).
+    Keys are the digits only, leading zeros dropped, so "012345678906" and the numeric
+    cell 12345678906 are the same key. Codes whose last digit is not a valid check
+    digit are counted in the report (`bad_check_digit`), never rewritten.
+    Opt-in `repair`: a code written with at most 11 digits and a wrong check digit is
+    taken as a UPC that lost its check digit and gets one appended. That guess can
+    turn a zero-stripped code into a different one, so nothing in the pipelines uses it.
+    """
+    keys, blank, widths = parse_cells(values)
+    report = UpcReport()
+    report.total = len(keys)
+
+    valid = keys != INVALID_UPC
+    report.blank = int((blank & ~valid).sum())
+    rejected = ~valid & ~blank
+    report.invalid = int(rejected.sum())
+    if report.invalid:
+        raw = np.asarray(values, dtype=object)[rejected][:SAMPLE_LIMIT]
+        report.samples = [str(v) for v in raw]
+
+    if valid.any():
+        good_check = has_valid_check_digit(np.where(valid, keys, 0))
+        wrong = valid & ~good_check
+        short = wrong & (widths <= 11)
+        if repair and short.any():
+            keys[short] = keys[short] * 10 + check_digit(keys[short])
+            report.repaired = int(short.sum())
+        report.bad_check_digit = int((wrong & ~short).sum()) if repair else int(wrong.sum())
+    report.valid = int(valid.sum())
+    return keys, report
+
+def upc_keys(values, repair: bool = False) -> np.ndarray:
+    """normalize_upcs without the report."""
+    return normalize_upcs(values, repair)[0]
+
+def format_upc(keys: np.ndarray, width: int = 12) -> pd.Series:
+    """Keys back to zero-padded text (12-digit UPC-A unless the code is longer)."""
+    return pd.Series(keys, dtype=np.int64).astype(str).str.zfill(width)
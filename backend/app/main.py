@@ -1,99 +1,288 @@
 import json
 import asyncio
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import Response
-from typing import List, Dict
-from app.schemas import RestockSettings, ShipmentSettings
+import functools
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, JSONResponse
+from starlette.background import BackgroundTask
+from typing import List, Dict, Optional, Tuple
+from app.schemas import RestockSettings, ShipmentSettings, BlobCheck
 from app.services.restock import process_restock_logic
-from app.services.shipment import process_shipment_logic
+from app.services.shipment import process_shipment_logic, process_shipment_batch, check_bundle
+from app.services.uploads import SpooledUploads
+from app.services.pool import worker_pool
+from app.config import PREVIEW_ROWS, BLOB_CHUNK_MB, CORS_ORIGINS
+from app.services.export import ExportedFile, PreviewResult, check_format, check_streaming_format
+from app.services.jobs import job_scheduler, JobQueueFull, DONE
+from app.services.cancel import Cancelled, cancellations
+from app.services.progress import ProgressChannel
+from app.services.connections import manager
+from app.services.metrics import metrics, server_timing
+from app.services.cache import parse_cache
+from app.services.datasets import datasets, open_dataset, UnknownDataset
+from app.services.blobs import blob_store, parse_refs, UnknownBlob, ChunkOffsetError
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pre-warmed parser pool for the whole app instead of one per request
+    await asyncio.to_thread(worker_pool.start)
+    await manager.start()
+    await job_scheduler.start(notify=manager.send_log, bus=manager.bus)
+    yield
+    await job_scheduler.stop()
+    await manager.stop()
+    await asyncio.to_thread(worker_pool.shutdown)
 
-# --- WEBSOCKET MANAGER ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["Content-Disposition", "Server-Timing"])
 
-    async def connect(self, client_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-
-    async def send_log(self, client_id: str, message: str, percent: int):
-        if client_id in self.active_connections:
-            try:
-                await self.active_connections[client_id].send_json({
-                    "message": message,
-                    "percent": percent
-                })
-            except:
-                pass # Connection might be closed
-
-manager = ConnectionManager()
+async def cancel_message(client_id: str, text: str):
+    """
+    {"type": "cancel"} stops everything the client is running; with "job_id", just that job.
+    Either way the cancel goes over the progress bus, to whichever process runs the work.
+    """
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return
+    if not isinstance(message, dict) or message.get("type") != "cancel":
+        return
+    job = job_scheduler.get(str(message["job_id"])) if message.get("job_id") else None
+    if job is not None and job.client_id == client_id:
+        await job_scheduler.cancel(job.id)
+    elif not message.get("job_id"):
+        await job_scheduler.cancel_client(client_id)
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(client_id, websocket)
     try:
         while True:
-            await websocket.receive_text() # Keep alive
+            text = await websocket.receive_text() # Keep alive (heartbeat replies land here)
+            manager.seen(client_id, websocket)
+            await cancel_message(client_id, text)
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        manager.disconnect(client_id, websocket)
+
+def stream_result(result: ExportedFile, stem: str) -> StreamingResponse:
+    """Streams the output file back in chunks and deletes it once sent."""
+    headers = {"Content-Disposition": f"attachment; filename={result.filename(stem)}"}
+    timing = server_timing(result.stats)
+    if timing:
+        headers["Server-Timing"] = timing
+    return StreamingResponse(
+        result.iter_chunks(),
+        media_type=result.media_type,
+        headers=headers,
+        background=BackgroundTask(result.cleanup)
+    )
+
+def preview_response(result: PreviewResult) -> JSONResponse:
+    """A dry run's report (preview=true) as JSON, with the same Server-Timing header."""
+    timing = server_timing(result.stats)
+    return JSONResponse(result.to_dict(), headers={"Server-Timing": timing} if timing else None)
+
+# --- METRICS ---
+# Stage histograms are fed by the pipelines themselves (PipelineTimer); these are read at scrape time
+metrics.gauge("convertion_websocket_connections", "Open progress WebSockets", lambda: manager.connection_count)
+metrics.gauge("convertion_websocket_clients", "Client ids with at least one open WebSocket",
+              lambda: len(manager.active_connections))
+metrics.gauge("convertion_websocket_connects_total", "WebSocket connections accepted",
+              lambda: manager.total_connects, kind="counter")
+metrics.gauge("convertion_websocket_disconnects_total", "WebSocket disconnects",
+              lambda: manager.total_disconnects, kind="counter")
+metrics.gauge("convertion_websocket_stale_total", "WebSockets closed for missing heartbeats",
+              lambda: manager.total_stale, kind="counter")
+metrics.gauge("convertion_worker_pool_requests", "Requests holding / waiting for the parser pool",
+              lambda: {(("state", "active"),): worker_pool.active, (("state", "queued"),): worker_pool.queued})
+metrics.gauge("convertion_jobs_queued", "Background jobs waiting for a slot", lambda: job_scheduler.queued)
+metrics.gauge("convertion_parse_cache", "Parsed-workbook cache counters",
+              lambda: {(("stat", k),): v for k, v in parse_cache.stats().items()})
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- REQUEST PREP (shared by the direct and the background-job routes) ---
+# Each one spools the uploads and returns `run(callback) -> ExportedFile`.
+# Every file input comes either as uploads or as blob references (see /api/blobs)
+
+async def save_inputs(uploads: SpooledUploads, files, blobs: str, what: str,
+                      required: bool = True) -> Tuple[List[str], List[str]]:
+    """Paths + original names of one input, from its uploads or its blob references (not both)."""
+    refs = parse_refs(blobs, what)
+    files = files or []
+    if files and refs:
+        raise ValueError(f"Send either the {what} files or their blob ids, not both")
+    if required and not files and not refs:
+        raise ValueError(f"No {what} files (upload them or send their blob ids)")
+    if refs:
+        return await uploads.save_blobs(refs), [name for _, name in refs]
+    return await uploads.save_all(files), [f.filename for f in files]
+
+async def prepare_restock(uploads: SpooledUploads, ham_files, export_files, restock_file,
+                          settings_str: str, output_format: str, incremental: bool = False,
+                          streaming: bool = False, master_dataset: str = "", preview: bool = False,
+                          ham_blobs: str = "", export_blobs: str = "", restock_blob: str = ""):
+    settings_dict = json.loads(settings_str)
+    settings = RestockSettings(**settings_dict)
+    output_format = check_streaming_format(output_format) if streaming else check_format(output_format)
+
+    ham_paths, ham_names = await save_inputs(uploads, ham_files, ham_blobs, "Ham")
+    export_paths, export_names = await save_inputs(uploads, export_files, export_blobs, "export")
+
+    # The master comes either as an upload (file or blob) or as a registered reference dataset
+    master_sent = restock_file is not None or bool(restock_blob)
+    if master_dataset and master_sent:
+        raise ValueError("Send either a master file or a master dataset, not both")
+    open_dataset(master_dataset)  # unknown ids fail here, before anything runs
+    restock_paths, _ = await save_inputs(uploads, [restock_file] if restock_file is not None else [],
+                                         restock_blob, "master", required=False)
+    if len(restock_paths) > 1:
+        raise ValueError("Send a single master file")
+    restock_path = restock_paths[0] if restock_paths else None
+
+    # Workers get file paths, not the bytes
+    return functools.partial(
+        process_restock_logic,
+        ham_paths, ham_names,
+        export_paths, export_names,
+        restock_path,
+        settings,
+        output_format=output_format,
+        incremental=incremental,
+        streaming=streaming,
+        master_dataset=master_dataset or None,
+        preview_rows=PREVIEW_ROWS if preview else None
+    )
+
+async def save_references(uploads: SpooledUploads, restock_files, order_files,
+                          restock_dataset: str, order_dataset: str,
+                          restock_blobs: str = "", order_blobs: str = ""):
+    """Restock / order uploads (or blobs) to paths; a kind that names a reference dataset must not send files too."""
+    paths = []
+    for kind, files, blobs, dataset_id in (("restock", restock_files, restock_blobs, restock_dataset),
+                                           ("order", order_files, order_blobs, order_dataset)):
+        if dataset_id and (files or blobs):
+            raise ValueError(f"Send either the {kind} files or the {kind} dataset id, not both")
+        open_dataset(dataset_id)  # unknown ids fail here, before anything runs
+        kind_paths, _ = await save_inputs(uploads, files, blobs, kind, required=False)
+        paths.append(kind_paths)
+    return paths[0], paths[1]
+
+async def prepare_shipment(uploads: SpooledUploads, invoice_file, restock_files, order_files,
+                           dc_code: str, settings_str: str, output_format: str, streaming: bool = False,
+                           restock_dataset: str = "", order_dataset: str = "", preview: bool = False,
+                           invoice_blob: str = "", restock_blobs: str = "", order_blobs: str = ""):
+    settings_dict = json.loads(settings_str)
+    settings = ShipmentSettings(**settings_dict)
+    output_format = check_streaming_format(output_format) if streaming else check_format(output_format)
+
+    invoice_paths, _ = await save_inputs(uploads, [invoice_file] if invoice_file is not None else [],
+                                         invoice_blob, "invoice")
+    if len(invoice_paths) > 1:
+        raise ValueError("Send a single invoice (use /api/shipment/batch for several)")
+    invoice_path = invoice_paths[0]
+    restock_paths, order_paths = await save_references(uploads, restock_files, order_files,
+                                                       restock_dataset, order_dataset,
+                                                       restock_blobs, order_blobs)
+
+    return functools.partial(
+        process_shipment_logic,
+        invoice_path,
+        order_paths,
+        restock_paths,
+        dc_code,
+        settings,
+        output_format=output_format,
+        streaming=streaming,
+        restock_dataset=restock_dataset or None,
+        order_dataset=order_dataset or None,
+        preview_rows=PREVIEW_ROWS if preview else None
+    )
+
+async def prepare_shipment_batch(uploads: SpooledUploads, invoice_files, dc_codes: List[str], restock_files,
+                                 order_files, settings_str: str, output_format: str, bundle: str,
+                                 restock_dataset: str = "", order_dataset: str = "",
+                                 invoice_blobs: str = "", restock_blobs: str = "", order_blobs: str = ""):
+    settings_dict = json.loads(settings_str)
+    settings = ShipmentSettings(**settings_dict)
+    output_format = check_format(output_format)
+    bundle = check_bundle(bundle, output_format)
+
+    invoice_paths, _ = await save_inputs(uploads, invoice_files, invoice_blobs, "invoice")
+    if len(invoice_paths) != len(dc_codes):
+        raise ValueError(f"Got {len(invoice_paths)} invoices but {len(dc_codes)} DC codes (one per invoice)")
+    restock_paths, order_paths = await save_references(uploads, restock_files, order_files,
+                                                       restock_dataset, order_dataset,
+                                                       restock_blobs, order_blobs)
+
+    return functools.partial(
+        process_shipment_batch,
+        invoice_paths,
+        dc_codes,
+        order_paths,
+        restock_paths,
+        settings,
+        output_format=output_format,
+        bundle=bundle,
+        restock_dataset=restock_dataset or None,
+        order_dataset=order_dataset or None
+    )
 
 # --- ROUTES ---
 
+async def cancelled_error(client_id: str, e: Cancelled) -> HTTPException:
+    """A direct request stopped by its client (499: client closed request)."""
+    await manager.send_log(client_id, f"🛑 Cancelled ({e})", 0)
+    return HTTPException(status_code=499, detail=f"Cancelled: {e}")
+
 @app.post("/api/restock")
 async def run_restock(
-    ham_files: List[UploadFile] = File(...),
-    export_files: List[UploadFile] = File(...),
-    restock_file: UploadFile = File(...),
+    ham_files: Optional[List[UploadFile]] = File(None),
+    export_files: Optional[List[UploadFile]] = File(None),
+    restock_file: Optional[UploadFile] = File(None),
     settings_str: str = Form(...),
-    client_id: str = Form(...)  # <--- NEW: Client ID to know who to notify
+    client_id: str = Form(...),  # <--- NEW: Client ID to know who to notify
+    output_format: str = Form("xlsx"),  # xlsx | csv | parquet
+    incremental: bool = Form(False),  # reuse unchanged suppliers from earlier runs
+    streaming: bool = Form(False),  # stream the master in chunks (flat memory, xlsx/csv only)
+    master_dataset: str = Form(""),  # reference dataset id, instead of restock_file
+    preview: bool = Form(False),  # dry run on a sample of rows: JSON report, no file
+    ham_blobs: str = Form(""),  # blob references (JSON [{"id", "name"}]), instead of the files
+    export_blobs: str = Form(""),
+    restock_blob: str = Form("")  # one {"id", "name"}
 ):
     try:
-        settings_dict = json.loads(settings_str)
-        settings = RestockSettings(**settings_dict)
-        
-        # 1. Read Files (We announce this)
-        await manager.send_log(client_id, "🚀 Upload complete. Reading files into memory...", 5)
-        
-        ham_contents = [await f.read() for f in ham_files]
-        ham_names = [f.filename for f in ham_files]
-        
-        export_contents = [await f.read() for f in export_files]
-        export_names = [f.filename for f in export_files]
-        
-        restock_content = await restock_file.read()
-
-        # 2. Define a callback wrapper to bridge Sync -> Async
-        def progress_callback(msg, pct):
-            # We run the async send in the main event loop
-            asyncio.run_coroutine_threadsafe(
-                manager.send_log(client_id, msg, pct), 
-                asyncio.get_running_loop()
-            )
-
-        # 3. Run Logic (Modified to accept callback)
-        result_excel = await asyncio.to_thread(
-            process_restock_logic,
-            ham_contents, ham_names,
-            export_contents, export_names,
-            restock_content,
-            settings,
-            progress_callback # Pass the reporter
-        )
+        # 1. Spool Files to disk (We announce this)
+        await manager.send_log(client_id, "🚀 Upload complete. Spooling files to disk...", 5)
+
+        async with SpooledUploads() as uploads:
+            run = await prepare_restock(uploads, ham_files, export_files, restock_file,
+                                        settings_str, output_format, incremental, streaming, master_dataset,
+                                        preview, ham_blobs, export_blobs, restock_blob)
+
+            # 2. Bridge Sync -> Async (captures THIS loop; the worker thread has none)
+            progress = ProgressChannel(functools.partial(manager.send_log, client_id))
+
+            # 3. Run Logic (Modified to accept callback); stops early if the client goes away
+            try:
+                with cancellations.track(client_id) as token:
+                    result = await asyncio.to_thread(run, progress, cancel=token) # Pass the reporter
+            finally:
+                await progress.close()
 
+        if preview:
+            await manager.send_log(client_id, "✅ Preview ready", 100)
+            return preview_response(result)
         await manager.send_log(client_id, "✅ Process Complete! Downloading...", 100)
 
-        return Response(
-            content=result_excel,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=processed_restock.xlsx"}
-        )
+        return stream_result(result, "processed_restock")
 
+    except Cancelled as e:
+        raise await cancelled_error(client_id, e)
     except Exception as e:
         await manager.send_log(client_id, f"❌ Error: {str(e)}", 0)
         print(f"Error: {e}")
@@ -102,46 +291,297 @@ async def run_restock(
 
 @app.post("/api/shipment")
 async def run_shipment(
-    invoice_file: UploadFile = File(...),
-    restock_files: List[UploadFile] = File(...),
-    order_files: List[UploadFile] = File(...),
+    invoice_file: Optional[UploadFile] = File(None),
+    restock_files: Optional[List[UploadFile]] = File(None),
+    order_files: Optional[List[UploadFile]] = File(None),
     dc_code: str = Form(...),
     settings_str: str = Form(...),
-    client_id: str = Form(...) # <--- NEW
+    client_id: str = Form(...), # <--- NEW
+    output_format: str = Form("xlsx"),  # xlsx | csv | parquet
+    streaming: bool = Form(False),  # stream the invoice in chunks (flat memory, xlsx/csv only)
+    restock_dataset: str = Form(""),  # reference dataset ids, instead of restock_files / order_files
+    order_dataset: str = Form(""),
+    preview: bool = Form(False),  # dry run on a sample of invoice lines: JSON report, no file
+    invoice_blob: str = Form(""),  # blob references, instead of the files (see /api/restock)
+    restock_blobs: str = Form(""),
+    order_blobs: str = Form("")
 ):
     try:
-        settings_dict = json.loads(settings_str)
-        settings = ShipmentSettings(**settings_dict)
-        
-        await manager.send_log(client_id, "🚀 Upload complete. Reading files...", 5)
-
-        invoice_content = await invoice_file.read()
-        restock_contents = [await f.read() for f in restock_files]
-        order_contents = [await f.read() for f in order_files]
-
-        def progress_callback(msg, pct):
-            asyncio.run_coroutine_threadsafe(
-                manager.send_log(client_id, msg, pct), 
-                asyncio.get_running_loop()
-            )
-
-        result_excel = await asyncio.to_thread(
-            process_shipment_logic,
-            invoice_content, 
-            order_contents, 
-            restock_contents, 
-            dc_code, 
-            settings,
-            progress_callback
-        )
-        
+        await manager.send_log(client_id, "🚀 Upload complete. Spooling files to disk...", 5)
+
+        async with SpooledUploads() as uploads:
+            run = await prepare_shipment(uploads, invoice_file, restock_files, order_files,
+                                         dc_code, settings_str, output_format, streaming,
+                                         restock_dataset, order_dataset, preview,
+                                         invoice_blob, restock_blobs, order_blobs)
+
+            progress = ProgressChannel(functools.partial(manager.send_log, client_id))
+            try:
+                with cancellations.track(client_id) as token:
+                    result = await asyncio.to_thread(run, progress, cancel=token)
+            finally:
+                await progress.close()
+
+        if preview:
+            await manager.send_log(client_id, "✅ Preview ready", 100)
+            return preview_response(result)
+        await manager.send_log(client_id, "✅ Generation Complete!", 100)
+
+        return stream_result(result, "Shipment_Result")
+    except Cancelled as e:
+        raise await cancelled_error(client_id, e)
+    except Exception as e:
+        await manager.send_log(client_id, f"❌ Error: {str(e)}", 0)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/shipment/batch")
+async def run_shipment_batch(
+    invoice_files: Optional[List[UploadFile]] = File(None),  # one invoice per DC, same order as dc_codes
+    restock_files: Optional[List[UploadFile]] = File(None),
+    order_files: Optional[List[UploadFile]] = File(None),
+    dc_codes: List[str] = Form(...),
+    settings_str: str = Form(...),
+    client_id: str = Form(...),
+    output_format: str = Form("xlsx"),  # xlsx | csv | parquet
+    bundle: str = Form("sheets"),  # sheets (one xlsx, a sheet per DC) | zip (a file per DC)
+    restock_dataset: str = Form(""),
+    order_dataset: str = Form(""),
+    invoice_blobs: str = Form(""),
+    restock_blobs: str = Form(""),
+    order_blobs: str = Form("")
+):
+    try:
+        await manager.send_log(client_id, "🚀 Upload complete. Spooling files to disk...", 5)
+
+        async with SpooledUploads() as uploads:
+            run = await prepare_shipment_batch(uploads, invoice_files, dc_codes, restock_files, order_files,
+                                               settings_str, output_format, bundle,
+                                               restock_dataset, order_dataset,
+                                               invoice_blobs, restock_blobs, order_blobs)
+
+            progress = ProgressChannel(functools.partial(manager.send_log, client_id))
+            try:
+                with cancellations.track(client_id) as token:
+                    result = await asyncio.to_thread(run, progress, cancel=token)
+            finally:
+                await progress.close()
+
         await manager.send_log(client_id, "✅ Generation Complete!", 100)
 
-        return Response(
-            content=result_excel,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=Shipment_Result.xlsx"}
-        )
+        return stream_result(result, "Shipment_Batch_Result")
+    except Cancelled as e:
+        raise await cancelled_error(client_id, e)
     except Exception as e:
         await manager.send_log(client_id, f"❌ Error: {str(e)}", 0)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- BACKGROUND JOBS ---
+# POST returns a job id right away; poll GET /api/jobs/{id} (or watch the WebSocket)
+# and download from GET /api/jobs/{id}/result once it is done.
+
+async def submit_job(kind: str, client_id: str, stem: str, prepare):
+    uploads = SpooledUploads().open()
+    try:
+        run = await prepare(uploads)
+        job = job_scheduler.submit(kind, client_id, stem, run, cleanup=uploads.close)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        uploads.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+@app.post("/api/jobs/restock")
+async def submit_restock_job(
+    ham_files: Optional[List[UploadFile]] = File(None),
+    export_files: Optional[List[UploadFile]] = File(None),
+    restock_file: Optional[UploadFile] = File(None),
+    settings_str: str = Form(...),
+    client_id: str = Form(""),
+    output_format: str = Form("xlsx"),
+    incremental: bool = Form(False),
+    streaming: bool = Form(False),
+    master_dataset: str = Form(""),
+    ham_blobs: str = Form(""),
+    export_blobs: str = Form(""),
+    restock_blob: str = Form("")
+):
+    return await submit_job("restock", client_id, "processed_restock", lambda uploads: prepare_restock(
+        uploads, ham_files, export_files, restock_file, settings_str, output_format, incremental, streaming,
+        master_dataset, ham_blobs=ham_blobs, export_blobs=export_blobs, restock_blob=restock_blob
+    ))
+
+@app.post("/api/jobs/shipment")
+async def submit_shipment_job(
+    invoice_file: Optional[UploadFile] = File(None),
+    restock_files: Optional[List[UploadFile]] = File(None),
+    order_files: Optional[List[UploadFile]] = File(None),
+    dc_code: str = Form(...),
+    settings_str: str = Form(...),
+    client_id: str = Form(""),
+    output_format: str = Form("xlsx"),
+    streaming: bool = Form(False),
+    restock_dataset: str = Form(""),
+    order_dataset: str = Form(""),
+    invoice_blob: str = Form(""),
+    restock_blobs: str = Form(""),
+    order_blobs: str = Form("")
+):
+    return await submit_job("shipment", client_id, "Shipment_Result", lambda uploads: prepare_shipment(
+        uploads, invoice_file, restock_files, order_files, dc_code, settings_str, output_format, streaming,
+        restock_dataset, order_dataset, invoice_blob=invoice_blob, restock_blobs=restock_blobs,
+        order_blobs=order_blobs
+    ))
+
+@app.post("/api/jobs/shipment/batch")
+async def submit_shipment_batch_job(
+    invoice_files: Optional[List[UploadFile]] = File(None),
+    restock_files: Optional[List[UploadFile]] = File(None),
+    order_files: Optional[List[UploadFile]] = File(None),
+    dc_codes: List[str] = Form(...),
+    settings_str: str = Form(...),
+    client_id: str = Form(""),
+    output_format: str = Form("xlsx"),
+    bundle: str = Form("sheets"),
+    restock_dataset: str = Form(""),
+    order_dataset: str = Form(""),
+    invoice_blobs: str = Form(""),
+    restock_blobs: str = Form(""),
+    order_blobs: str = Form("")
+):
+    return await submit_job("shipment_batch", client_id, "Shipment_Batch_Result", lambda uploads: prepare_shipment_batch(
+        uploads, invoice_files, dc_codes, restock_files, order_files, settings_str, output_format, bundle,
+        restock_dataset, order_dataset, invoice_blobs, restock_blobs, order_blobs
+    ))
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job.to_dict()
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await job_scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if job.result is None or not job.result.exists():
+        raise HTTPException(status_code=410, detail="Result has expired")
+    return FileResponse(job.result.path, media_type=job.result.media_type, filename=job.download_name)
+
+# --- CHUNKED UPLOADS (content store) ---
+# 1. POST /api/blobs/check with the SHA-256 of every file: which the server already has
+# 2. PUT each missing file in chunks (resume from "received" after a failure)
+# 3. Send the pipeline request with blob references instead of the files
+
+def blob_error(e: Exception) -> HTTPException:
+    if isinstance(e, UnknownBlob):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, ChunkOffsetError):
+        return HTTPException(status_code=409, detail={"message": str(e), "received": e.received})
+    return HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/blobs/check")
+async def check_blobs(body: BlobCheck):
+    try:
+        return await asyncio.to_thread(blob_store.check, body.ids)
+    except ValueError as e:
+        raise blob_error(e)
+
+@app.get("/api/blobs/{blob_id}")
+async def get_blob(blob_id: str):
+    try:
+        return blob_store.status(blob_id)
+    except ValueError as e:
+        raise blob_error(e)
+
+@app.put("/api/blobs/{blob_id}")
+async def put_blob_chunk(
+    blob_id: str,
+    request: Request,
+    offset: int = Query(...),  # where this chunk starts in the file
+    size: int = Query(...)  # the whole file's size
+):
+    # Refused before the body is buffered: by its declared length, or as soon as the stream runs past
+    limit = BLOB_CHUNK_MB * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"Chunks are limited to {BLOB_CHUNK_MB} MB")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise too_large
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > limit:
+            raise too_large
+    data = bytes(data)
+    try:
+        return await asyncio.to_thread(blob_store.write_chunk, blob_id, offset, size, data)
+    except ValueError as e:
+        raise blob_error(e)
+
+# --- REFERENCE DATASETS ---
+# Restock masters / restock outputs / order forms registered once, then passed to the
+# pipelines by id (master_dataset, restock_dataset, order_dataset) instead of re-uploaded
+
+def dataset_error(e: Exception) -> HTTPException:
+    if isinstance(e, UnknownDataset):
+        return HTTPException(status_code=404, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/datasets")
+async def create_dataset(
+    files: List[UploadFile] = File(...),
+    name: str = Form("")
+):
+    try:
+        async with SpooledUploads() as uploads:
+            paths = await uploads.save_all(files)
+            dataset = await asyncio.to_thread(datasets.create, name, list(zip([f.filename for f in files], paths)))
+    except ValueError as e:
+        raise dataset_error(e)
+    return dataset.to_dict()
+
+@app.get("/api/datasets")
+async def list_datasets():
+    return await asyncio.to_thread(datasets.list)
+
+@app.get("/api/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str):
+    try:
+        return datasets.open(dataset_id).to_dict()
+    except ValueError as e:
+        raise dataset_error(e)
+
+@app.post("/api/datasets/{dataset_id}/files")
+async def update_dataset(
+    dataset_id: str,
+    files: List[UploadFile] = File(...),
+    mode: str = Form("append")  # append (new files at the end) | replace (same name swapped in)
+):
+    try:
+        datasets.open(dataset_id)
+        async with SpooledUploads() as uploads:
+            paths = await uploads.save_all(files)
+            dataset = await asyncio.to_thread(datasets.update, dataset_id,
+                                              list(zip([f.filename for f in files], paths)), mode)
+    except ValueError as e:
+        raise dataset_error(e)
+    return dataset.to_dict()
+
+@app.delete("/api/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    try:
+        await asyncio.to_thread(datasets.delete, dataset_id)
+    except ValueError as e:
+        raise dataset_error(e)
+    return {"id": dataset_id, "deleted": True}
@@ -52,4 +52,12 @@ class ShipmentSettings(BaseModel):
         'packsize': ['PackSize'],
         'brand': ['Brand'],
         'description': ['Description']
-    }
\ No newline at end of file
+    }
+    # How an invoice line found in the Order Forms is shipped:
+    # "proportional": spread over every order row with its UPC, by PCS (one output row each)
+    # "first": only the first order row, scaled by its share of the total PCS (old behaviour)
+    allocation: str = "proportional"
+
+class BlobCheck(BaseModel):
+    # SHA-256 (lowercase hex) of every file the client is about to use
+    ids: List[str]
@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from app.config import BLOB_DIR, BLOB_STORE_MB, BLOB_PARTIAL_TTL_HOURS
+from app.services.cache import source_digest
+
+# SHA-256 of zero bytes: an empty file has nothing to upload, so the store always has it
+EMPTY_BLOB = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+class UnknownBlob(ValueError):
+    pass
+
+class ChunkOffsetError(ValueError):
+    """A chunk that doesn't start where the upload stands; `received` is where to resume."""
+    def __init__(self, message: str, received: int):
+        super().__init__(message)
+        self.received = received
+
+class BlobStore:
+    """
+    Content store for uploads. Every file is kept once, named by its SHA-256 (the blob
+    id), so a client asks which of its files the server already has and only sends the
+    rest. Missing files come in chunks appended at `offset`; an interrupted upload
+    resumes from `received`. The last chunk is checked against the id before the blob
+    becomes visible. Oldest blobs go past `max_bytes`, abandoned partial uploads after
+    `partial_ttl` seconds.
+    """
+    def __init__(self, directory: str = BLOB_DIR, max_bytes: int = BLOB_STORE_MB * 1024 * 1024,
+                 partial_ttl: float = BLOB_PARTIAL_TTL_HOURS * 3600):
+        self.directory = directory
+        self.partial_dir = os.path.join(directory, "partial")
+        self.max_bytes = max_bytes
+        self.partial_ttl = partial_ttl
+        self._lock = threading.Lock()
+        self._uploads: Dict[str, list] = {}  # blob id -> [lock held while a chunk is written, users]
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def _path(self, blob_id: str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{64}", blob_id or ""):
+            raise UnknownBlob(f"'{blob_id}' is not a blob id (the file's SHA-256, lowercase hex)")
+        return os.path.join(self.directory, blob_id)
+
+    def _partial(self, blob_id: str) -> str:
+        return os.path.join(self.partial_dir, blob_id)
+
+    def _exists(self, blob_id: str) -> bool:
+        path = self._path(blob_id)
+        if blob_id == EMPTY_BLOB and not os.path.exists(path):
+            open(path, "ab").close()
+        return os.path.exists(path)
+
+    @contextmanager
+    def _upload_lock(self, blob_id: str):
+        """One chunk of a blob at a time; the entry goes once nobody holds or waits for it."""
+        with self._lock:
+            entry = self._uploads.setdefault(blob_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._uploads.pop(blob_id, None)
+
+    def has(self, blob_id: str) -> bool:
+        return self._exists(blob_id)
+
+    def status(self, blob_id: str) -> dict:
+        path = self._path(blob_id)
+        if self._exists(blob_id):
+            return {"id": blob_id, "complete": True, "received": os.path.getsize(path)}
+        partial = self._partial(blob_id)
+        return {"id": blob_id, "complete": False,
+                "received": os.path.getsize(partial) if os.path.exists(partial) else 0}
+
+    def check(self, blob_ids: List[str]) -> dict:
+        """Which ids the store has (touched, so trimming keeps them a while) and where the missing ones stand."""
+        have, missing = [], []
+        for blob_id in dict.fromkeys(blob_ids):
+            state = self.status(blob_id)
+            if state["complete"]:
+                self._touch(blob_id)
+                have.append(blob_id)
+            else:
+                missing.append({"id": blob_id, "received": state["received"]})
+        return {"have": have, "missing": missing}
+
+    def write_chunk(self, blob_id: str, offset: int, size: int, data: bytes) -> dict:
+        """
+        Appends `data` at `offset` to the upload of a `size`-byte blob. The chunk that
+        completes it is verified (SHA-256 == id) and moves the blob into the store.
+        A chunk for a blob the store already has is accepted and ignored.
+        """
+        path = self._path(blob_id)
+        if self._exists(blob_id):
+            return self.status(blob_id)
+        if size < 0 or offset < 0:
+            raise ValueError("offset and size can't be negative")
+        with self._upload_lock(blob_id):
+            if os.path.exists(path):  # a parallel upload of the same file finished first
+                return self.status(blob_id)
+            partial = self._partial(blob_id)
+            received = os.path.getsize(partial) if os.path.exists(partial) else 0
+            if offset != received:
+                raise ChunkOffsetError(f"Chunk starts at {offset} but {received} bytes were received", received)
+            if received + len(data) > size:
+                raise ValueError(f"Chunk runs past the declared size ({received + len(data)} > {size} bytes)")
+            with open(partial, "ab") as f:
+                f.write(data)
+            received += len(data)
+            if received == size:
+                if source_digest(partial) != blob_id:
+                    os.remove(partial)
+                    raise ValueError(f"Upload of blob {blob_id[:12]}... doesn't match its SHA-256; send it again")
+                os.replace(partial, path)
+        if received == size:
+            self.trim()
+        return self.status(blob_id)
+
+    def link(self, blob_id: str, path: str) -> str:
+        """
+        Puts blob `blob_id` at `path` (a hard link where possible, a copy otherwise), so a
+        request keeps its files even if the store drops them while it runs.
+        """
+        source = self._path(blob_id)
+        if not self._exists(blob_id):
+            raise UnknownBlob(f"Unknown blob {blob_id[:12]}... (upload it first)")
+        self._touch(blob_id)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        return path
+
+    def _touch(self, blob_id: str):
+        try:
+            os.utime(self._path(blob_id))
+        except OSError:
+            pass
+
+    def trim(self):
+        """Least recently used blobs out until the store fits `max_bytes`; stale partial uploads out."""
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.partial_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+        blobs = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                blobs.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+def parse_refs(text: str, what: str) -> List[Tuple[str, str]]:
+    """
+    Blob references sent with a pipeline request: a JSON list of {"id": <blob id>, "name":
+    <original file name>} (a single object for one-file inputs). Returns (id, name) pairs.
+    """
+    if not text:
+        return []
+    try:
+        refs = json.loads(text)
+    except ValueError:
+        raise ValueError(f"{what} blobs must be JSON ([{{\"id\": ..., \"name\": ...}}])")
+    if isinstance(refs, dict):
+        refs = [refs]
+    if not isinstance(refs, list) or not all(isinstance(ref, dict) and ref.get("id") for ref in refs):
+        raise ValueError(f"{what} blobs must be a list of {{\"id\": ..., \"name\": ...}}")
+    return [(str(ref["id"]), str(ref.get("name") or ref["id"])) for ref in refs]
+
+blob_store = BlobStore()
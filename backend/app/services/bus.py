@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+from app.config import PROGRESS_BUS, PROGRESS_BUS_DIR
+
+# deliver(client_id, payload): hands a message to this process's sockets for that client
+# (or, for the JOB_CONTROL channel, to the job scheduler)
+Deliver = Callable[[str, dict], Awaitable]
+JOB_CONTROL = "__jobs__"
+
+class MemoryBus:
+    """Default: a single server process, so messages go straight to its own subscribers."""
+    def __init__(self):
+        self._subscribers: List[Deliver] = []
+
+    def subscribe(self, deliver: Deliver):
+        if deliver not in self._subscribers:  # a restarted subscriber is still one
+            self._subscribers.append(deliver)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, client_id: str, payload: dict):
+        for deliver in list(self._subscribers):
+            await deliver(client_id, payload)
+
+class FileBus:
+    """
+    Broker for several server processes (uvicorn --workers N, or containers sharing a
+    volume) on one host. Every message is one JSON line appended to a shared segment
+    file (a new segment every `segment_seconds`); each process tails the segments and
+    delivers the lines meant for the sockets it holds. Old segments are deleted.
+    A process only sees messages published after it started.
+    """
+    def __init__(self, directory: str = PROGRESS_BUS_DIR, poll: float = 0.05, segment_seconds: int = 60,
+                 keep_segments: int = 3, grace: float = 2.0):
+        self.directory = directory
+        self.poll = poll
+        self.segment_seconds = segment_seconds
+        self.keep_segments = keep_segments
+        self.grace = grace  # how long a segment is still read after it stops being current
+        self._subscribers: List[Deliver] = []
+        self._task = None
+        self._offsets: Dict[int, int] = {}  # segment -> bytes already read
+        os.makedirs(directory, exist_ok=True)
+
+    def subscribe(self, deliver: Deliver):
+        if deliver not in self._subscribers:  # a restarted subscriber is still one
+            self._subscribers.append(deliver)
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"progress-{segment}.jsonl")
+
+    def _current(self) -> int:
+        return int(time.time() // self.segment_seconds)
+
+    async def publish(self, client_id: str, payload: dict):
+        line = (json.dumps(dict(payload, client_id=client_id)) + "\n").encode()
+        # File I/O runs off the event loop: a slow shared volume must not stall every socket
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: bytes):
+        # One O_APPEND write per message: lines from different processes never interleave
+        fd = os.open(self._path(self._current()), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    async def start(self):
+        # Start at the end of the live segment: old progress is nobody's business
+        segment = self._current()
+        try:
+            self._offsets = {segment: os.path.getsize(self._path(segment))}
+        except OSError:
+            self._offsets = {segment: 0}
+        self._task = asyncio.create_task(self._tail_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _tail_forever(self):
+        cleaned = None
+        while True:
+            await asyncio.sleep(self.poll)
+            for message in await asyncio.to_thread(self._read_new):
+                client_id = message.pop("client_id", None)
+                if client_id is None:
+                    continue
+                for deliver in list(self._subscribers):
+                    try:
+                        await deliver(client_id, message)
+                    except Exception:
+                        pass  # Progress must never stop the bus
+            if cleaned != self._current():
+                cleaned = self._current()
+                await asyncio.to_thread(self._remove_old)
+
+    def _read_new(self) -> List[dict]:
+        """Complete lines appended since the last call, across the segments still being written."""
+        now = time.time()
+        current = int(now // self.segment_seconds)
+        messages = []
+        for segment in range(min(self._offsets, default=current), current + 1):
+            offset = self._offsets.get(segment, 0)
+            try:
+                with open(self._path(segment), "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            except OSError:
+                data = b""
+            complete = data[:data.rfind(b"\n") + 1]  # a half-written line waits for the next poll
+            self._offsets[segment] = offset + len(complete)
+            for line in complete.splitlines():
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    continue
+            # A writer may still be finishing a line in a segment shortly after it rolls over
+            if now >= (segment + 1) * self.segment_seconds + self.grace:
+                del self._offsets[segment]
+        return messages
+
+    def _remove_old(self):
+        oldest = self._current() - self.keep_segments
+        for name in os.listdir(self.directory):
+            if name.startswith("progress-") and name.endswith(".jsonl"):
+                try:
+                    if int(name[len("progress-"):-len(".jsonl")]) < oldest:
+                        os.remove(os.path.join(self.directory, name))
+                except (ValueError, OSError):
+                    continue
+
+PROGRESS_BUSES: Dict[str, Callable] = {
+    "memory": MemoryBus,
+    "file": FileBus,
+}
+
+def make_bus(kind: str = PROGRESS_BUS):
+    if kind not in PROGRESS_BUSES:
+        raise ValueError(f"Unknown progress bus '{kind}' (Options: {list(PROGRESS_BUSES)})")
+    return PROGRESS_BUSES[kind]()
@@ -0,0 +1,184 @@
+import os
+import hashlib
+import threading
+import collections
+import pandas as pd
+from typing import Callable, Dict, Optional
+from app.config import PARSE_CACHE_MB, PARSE_CACHE_DIR, PARSE_CACHE_DISK_MB
+from app.logic.processing import FileSource
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def source_digest(source: FileSource) -> str:
+    """SHA-256 of the file contents (paths are hashed in chunks, never fully loaded)."""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def write_frame(df: pd.DataFrame, base: str) -> str:
+    """
+    Writes `df` atomically to `base`.parquet, or `base`.pkl where Parquet can't take it
+    (no pyarrow, or a column mixing types). Returns the path written.
+    """
+    parquet_path, pickle_path = base + ".parquet", base + ".pkl"
+    tmp = f".{os.getpid()}-{threading.get_ident()}.tmp"  # worker processes may write the same entry at once
+    try:
+        df.to_parquet(parquet_path + tmp)
+        os.replace(parquet_path + tmp, parquet_path)
+        return parquet_path
+    except Exception:
+        if os.path.exists(parquet_path + tmp):
+            os.remove(parquet_path + tmp)
+        df.to_pickle(pickle_path + tmp)
+        os.replace(pickle_path + tmp, pickle_path)
+        return pickle_path
+
+def read_frame(path: str) -> pd.DataFrame:
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_pickle(path)
+
+def frame_size(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class ParseCache:
+    """
+    Content-addressed cache of parsed workbooks: same bytes + same engine -> same DataFrame.
+    Memory tier is an LRU bounded by total DataFrame bytes. If `directory` is set, entries
+    are also written there (Parquet when pyarrow is installed, pickle otherwise) so they
+    survive restarts; that tier is trimmed oldest-first to `disk_bytes`.
+    Callers always get their own copy, so mutating a result never touches the cache.
+    """
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, disk_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._entries = collections.OrderedDict()  # key -> (df, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source: FileSource, engine: str) -> str:
+        return f"{engine}-{source_digest(source)}"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0].copy()
+
+        df = self._read_disk(key)
+        with self._lock:
+            if df is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, df)
+        return df.copy()
+
+    def put(self, key: str, df: pd.DataFrame):
+        df = df.copy()
+        self._remember(key, df)
+        self._write_disk(key, df)
+
+    def load(self, source: FileSource, engine: str, parse: Callable[[FileSource], pd.DataFrame]) -> pd.DataFrame:
+        """Get-or-parse helper: `parse(source)` only runs on a miss."""
+        key = self.key(source, engine)
+        df = self.get(key)
+        if df is None:
+            df = parse(source)
+            self.put(key, df)
+        return df
+
+    def persist(self, key: str, df: pd.DataFrame):
+        """
+        Disk tier only, for parses done in a worker process: the parent picks the entry up
+        from disk on its next lookup, and no worker keeps a memory tier of its own.
+        """
+        self._write_disk(key, df)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    # --- Memory tier ---
+    def _remember(self, key: str, df: pd.DataFrame):
+        size = frame_size(df)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    # --- Disk tier ---
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".parquet", base + ".pkl"
+
+    def _read_disk(self, key: str) -> Optional[pd.DataFrame]:
+        if not self.directory:
+            return None
+        for path in self._paths(key):
+            if os.path.exists(path):
+                try:
+                    df = read_frame(path)
+                except Exception:
+                    continue
+                os.utime(path)  # LRU on disk = last access time
+                return df
+        return None
+
+    def _write_disk(self, key: str, df: pd.DataFrame):
+        if not self.directory:
+            return
+        write_frame(df, os.path.join(self.directory, key))
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith((".parquet", ".pkl")):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # trimmed by another process meanwhile
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+parse_cache = ParseCache(PARSE_CACHE_MB * 1024 * 1024, PARSE_CACHE_DIR, PARSE_CACHE_DISK_MB * 1024 * 1024)
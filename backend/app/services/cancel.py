@@ -0,0 +1,112 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set
+
+class Cancelled(Exception):
+    """A run stopped because its client went away or asked to cancel."""
+
+class CancelToken:
+    """
+    Cooperative cancellation for one pipeline run. The server fires it (from any thread);
+    the pipeline calls `check()` between stages and inside long loops, which raises
+    Cancelled once it has fired. `on_cancel(fn)` hooks things that must react at once
+    (pending worker futures, a wait for a pool slot).
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable] = []
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "Cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                pass  # one hook failing must not stop the others
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def on_cancel(self, fn: Callable) -> Callable:
+        """Runs `fn()` when the token fires (right away if it already has). Returns an unsubscribe function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return lambda: self._forget(fn)
+        fn()
+        return lambda: None
+
+    def _forget(self, fn: Callable):
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+def checkpoint(cancel: Optional[CancelToken]):
+    """`cancel.check()` for code where the token is optional."""
+    if cancel is not None:
+        cancel.check()
+
+class CancelRegistry:
+    """
+    The tokens of this process's running requests and jobs, by client_id, so a
+    WebSocket event can reach them. Direct requests (the client waits for the response)
+    are cancelled when the client's last socket goes away; background jobs outlive the
+    socket and only stop on an explicit cancel.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Dict[CancelToken, bool]] = {}  # client_id -> {token: cancel on disconnect}
+
+    @contextmanager
+    def track(self, client_id: str, on_disconnect: bool = True):
+        """Yields a fresh token, reachable through `client_id` until the block ends."""
+        token = CancelToken()
+        if not client_id:
+            yield token
+            return
+        with self._lock:
+            self._tokens.setdefault(client_id, {})[token] = on_disconnect
+        try:
+            yield token
+        finally:
+            self.forget(client_id, token)
+
+    def add(self, client_id: str, token: CancelToken, on_disconnect: bool = True):
+        if client_id:
+            with self._lock:
+                self._tokens.setdefault(client_id, {})[token] = on_disconnect
+
+    def forget(self, client_id: str, token: CancelToken):
+        with self._lock:
+            tokens = self._tokens.get(client_id)
+            if tokens is not None:
+                tokens.pop(token, None)
+                if not tokens:
+                    del self._tokens[client_id]
+
+    def running(self, client_id: str) -> int:
+        with self._lock:
+            return len(self._tokens.get(client_id, ()))
+
+    def cancel(self, client_id: str, reason: str = "Cancelled by the client", disconnect: bool = False) -> int:
+        """Fires the client's tokens (with `disconnect`, only those of direct requests). Returns how many."""
+        with self._lock:
+            tokens: Set[CancelToken] = {token for token, on_disconnect in self._tokens.get(client_id, {}).items()
+                                        if on_disconnect or not disconnect}
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+cancellations = CancelRegistry()
@@ -0,0 +1,121 @@
+import time
+import asyncio
+from typing import Dict
+from fastapi import WebSocket
+from app.config import WS_HEARTBEAT_SECONDS, WS_STALE_SECONDS, WS_DISCONNECT_CANCEL_SECONDS
+from app.services.bus import make_bus
+from app.services.cancel import cancellations
+
+# --- WEBSOCKET MANAGER ---
+class ConnectionManager:
+    """
+    This process's progress WebSockets, any number per client_id (several tabs, a
+    reconnect racing the old socket). `send_log` publishes on the progress bus, so the
+    message reaches the client's sockets whichever server process holds them.
+    Every `heartbeat` seconds each socket gets {"type": "heartbeat"}; one that has not
+    sent anything back for `stale_after` seconds (or whose send fails) is dropped.
+    When a client's last socket goes and it doesn't reconnect within `cancel_after`
+    seconds, the direct requests it is waiting on are cancelled (see cancel.py).
+    """
+    def __init__(self, bus=None, heartbeat: float = WS_HEARTBEAT_SECONDS, stale_after: float = WS_STALE_SECONDS,
+                 cancel_after: float = WS_DISCONNECT_CANCEL_SECONDS):
+        self.bus = bus or make_bus()
+        self.bus.subscribe(self.deliver)
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.cancel_after = cancel_after
+        self.active_connections: Dict[str, Dict[WebSocket, float]] = {}  # client_id -> {socket: last heard from}
+        self.total_connects = 0
+        self.total_disconnects = 0
+        self.total_stale = 0
+        self._task = None
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(sockets) for sockets in self.active_connections.values())
+
+    async def start(self):
+        await self.bus.start()
+        self._task = asyncio.create_task(self._heartbeat_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.bus.stop()
+
+    async def connect(self, client_id: str, websocket: WebSocket):
+        await websocket.accept()
+        self.active_connections.setdefault(client_id, {})[websocket] = time.monotonic()
+        self.total_connects += 1
+
+    def seen(self, client_id: str, websocket: WebSocket):
+        """The client sent something (a heartbeat reply or anything else): it is alive."""
+        sockets = self.active_connections.get(client_id)
+        if sockets is not None and websocket in sockets:
+            sockets[websocket] = time.monotonic()
+
+    def disconnect(self, client_id: str, websocket: WebSocket) -> bool:
+        sockets = self.active_connections.get(client_id)
+        if sockets is None or websocket not in sockets:
+            return False
+        del sockets[websocket]
+        if not sockets:
+            del self.active_connections[client_id]
+            self._client_gone(client_id)
+        self.total_disconnects += 1
+        return True
+
+    def _client_gone(self, client_id: str):
+        """Last socket closed: cancel the client's direct requests unless it is back within `cancel_after`."""
+        if self.cancel_after < 0 or not cancellations.running(client_id):
+            return
+        try:
+            asyncio.get_running_loop().call_later(self.cancel_after, self._cancel_if_gone, client_id)
+        except RuntimeError:  # no loop (called from a script): nothing to wait on
+            self._cancel_if_gone(client_id)
+
+    def _cancel_if_gone(self, client_id: str):
+        if client_id not in self.active_connections:
+            cancellations.cancel(client_id, "Client disconnected", disconnect=True)
+
+    async def send_log(self, client_id: str, message: str, percent: int):
+        # sent_at (epoch seconds) lets clients / load tests measure delivery lag
+        await self.bus.publish(client_id, {"message": message, "percent": percent, "sent_at": time.time()})
+
+    async def deliver(self, client_id: str, payload: dict):
+        """Bus -> every socket this process holds for `client_id`."""
+        for websocket in list(self.active_connections.get(client_id, ())):
+            try:
+                await websocket.send_json(payload)
+            except Exception:
+                self.disconnect(client_id, websocket)  # Connection is gone
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await self.sweep()
+
+    async def sweep(self):
+        """Closes sockets not heard from in `stale_after` seconds and pings the rest."""
+        now = time.monotonic()
+        for client_id, sockets in list(self.active_connections.items()):
+            for websocket, last_seen in list(sockets.items()):
+                if now - last_seen > self.stale_after:
+                    if self.disconnect(client_id, websocket):
+                        self.total_stale += 1
+                    try:
+                        await websocket.close()
+                    except Exception:
+                        pass
+                    continue
+                try:
+                    await websocket.send_json({"type": "heartbeat"})
+                except Exception:
+                    self.disconnect(client_id, websocket)
+
+manager = ConnectionManager()
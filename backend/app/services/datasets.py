@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import uuid
+import pickle
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from app.config import DATASET_DIR
+from app.logic.processing import FileSource
+from app.logic.columns import read_columns
+from app.logic.upc import UpcReport, normalize_upcs
+from app.services.cache import read_frame, source_digest, write_frame
+
+# Bump when the stored files change shape; datasets written before must be registered again
+DATASET_FORMAT = 1
+UPDATE_MODES = ("append", "replace")
+# Bump when normalize_upcs gives different keys; stored UPC indexes from before are rebuilt
+UPC_INDEX_VERSION = 2
+
+class UnknownDataset(ValueError):
+    pass
+
+class Dataset:
+    """
+    One version of a registered dataset (a snapshot of its manifest). Reads as the
+    concatenation of its files, in order, with every column kept, exactly what
+    `read_columns(..., keep_all=True)` gave for each file when it was registered.
+    """
+    def __init__(self, directory: str, manifest: dict):
+        self.directory = directory
+        self.manifest = manifest
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def id(self) -> str:
+        return self.manifest["id"]
+
+    @property
+    def name(self) -> str:
+        return self.manifest["name"]
+
+    @property
+    def rows(self) -> int:
+        return sum(f["rows"] for f in self.manifest["files"])
+
+    def _frame(self, entry: dict) -> pd.DataFrame:
+        with self._lock:
+            df = self._frames.get(entry["stored"])
+            if df is None:
+                df = self._frames[entry["stored"]] = read_frame(os.path.join(self.directory, entry["stored"]))
+            return df
+
+    def frame(self) -> pd.DataFrame:
+        frames = [self._frame(entry) for entry in self.manifest["files"]]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].copy()
+
+    def upc_keys(self, column: str) -> Tuple[np.ndarray, UpcReport]:
+        """
+        normalize_upcs of `column` over the whole dataset, from the UPC index kept next to
+        each file. A file is only parsed for a column the first time someone asks for it.
+        """
+        keys, report = [], UpcReport()
+        for entry in self.manifest["files"]:
+            file_keys, file_report = self._file_upc_keys(entry, column)
+            keys.append(file_keys)
+            report.add(file_report)
+        return (np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)), report
+
+    def _file_upc_keys(self, entry: dict, column: str) -> Tuple[np.ndarray, UpcReport]:
+        path = os.path.join(self.directory, entry["stored"] + ".upc.pkl")
+        try:
+            with open(path, "rb") as f:
+                index = pickle.load(f)
+        except Exception:
+            index = {}
+        key = (UPC_INDEX_VERSION, column)
+        if key in index:
+            return index[key]
+
+        df = self._frame(entry)
+        # A file without the column is all blanks, like its NaN rows in the concatenated frame
+        values = df[column].to_numpy() if column in df.columns else np.full(len(df), np.nan)
+        # Indexes built by an older normalize_upcs are dropped on the way
+        index = {k: v for k, v in index.items() if isinstance(k, tuple) and k[0] == UPC_INDEX_VERSION}
+        index[key] = normalize_upcs(values)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return index[key]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "version": self.manifest["version"],
+            "rows": self.rows,
+            "created_at": self.manifest["created_at"],
+            "updated_at": self.manifest["updated_at"],
+            "files": [{key: value for key, value in entry.items() if key != "stored"}
+                      for entry in self.manifest["files"]],
+        }
+
+class DatasetRegistry:
+    """
+    Reference data (restock master, restock outputs, order forms) registered once and
+    then referred to by id instead of being uploaded and parsed with every request.
+    Each dataset is a directory: `manifest.json` plus every file parsed once and stored
+    as Parquet (pickle without pyarrow), with a per-column UPC key index beside it.
+    Updates append files or replace them by name and bump the version; identical file
+    contents are stored once.
+    """
+    def __init__(self, directory: str = DATASET_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, dataset_id: str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{32}", dataset_id or ""):
+            raise UnknownDataset(f"Unknown reference dataset '{dataset_id}'")
+        return os.path.join(self.directory, dataset_id)
+
+    def _read_manifest(self, dataset_id: str) -> dict:
+        try:
+            with open(os.path.join(self._path(dataset_id), "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            raise UnknownDataset(f"Unknown reference dataset '{dataset_id}'")
+        if manifest.get("format") != DATASET_FORMAT:
+            raise UnknownDataset(f"Reference dataset '{dataset_id}' was stored by an older version; register it again")
+        return manifest
+
+    def _write_manifest(self, manifest: dict):
+        path = os.path.join(self._path(manifest["id"]), "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _store(self, directory: str, name: str, source: FileSource) -> dict:
+        """Parses one file (every column) into the dataset directory; same contents -> same stored file."""
+        digest = source_digest(source)
+        base = os.path.join(directory, digest)
+        stored = next((base + ext for ext in (".parquet", ".pkl") if os.path.exists(base + ext)), None)
+        if stored is None:
+            df = read_columns(source, {}, keep_all=True)
+            stored = write_frame(df, base)
+        else:
+            df = read_frame(stored)
+        return {"name": name, "digest": digest, "rows": len(df), "columns": [str(c) for c in df.columns],
+                "stored": os.path.basename(stored), "added_at": time.time()}
+
+    def create(self, name: str, files: List[Tuple[str, FileSource]]) -> Dataset:
+        if not files:
+            raise ValueError("A reference dataset needs at least one file")
+        dataset_id = uuid.uuid4().hex
+        directory = self._path(dataset_id)
+        os.makedirs(directory)
+        try:
+            entries = [self._store(directory, file_name, source) for file_name, source in files]
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        now = time.time()
+        manifest = {"format": DATASET_FORMAT, "id": dataset_id, "name": name or dataset_id, "version": 1,
+                    "created_at": now, "updated_at": now, "files": entries}
+        self._write_manifest(manifest)
+        return Dataset(directory, manifest)
+
+    def update(self, dataset_id: str, files: List[Tuple[str, FileSource]], mode: str = "append") -> Dataset:
+        """
+        `append` adds the files at the end (a name already in the dataset is an error);
+        `replace` swaps each file in for the one with the same name (new names are appended).
+        """
+        mode = (mode or "append").lower()
+        if mode not in UPDATE_MODES:
+            raise ValueError(f"Unknown update mode '{mode}' (Options: {list(UPDATE_MODES)})")
+        directory = self._path(dataset_id)
+        # One update at a time: stored files not in the manifest yet must survive the clean-up
+        with self._lock:
+            manifest = self._read_manifest(dataset_id)
+            entries = [self._store(directory, file_name, source) for file_name, source in files]
+            current = {entry["name"]: i for i, entry in enumerate(manifest["files"])}
+            for entry in entries:
+                if entry["name"] not in current:
+                    current[entry["name"]] = len(manifest["files"])
+                    manifest["files"].append(entry)
+                elif mode == "replace":
+                    manifest["files"][current[entry["name"]]] = entry
+                else:
+                    raise ValueError(f"'{entry['name']}' is already in dataset '{manifest['name']}' (use mode=replace)")
+            manifest["version"] += 1
+            manifest["updated_at"] = time.time()
+            self._write_manifest(manifest)
+            self._remove_unused(directory, manifest)
+        return Dataset(directory, manifest)
+
+    def _remove_unused(self, directory: str, manifest: dict):
+        used = {entry["stored"] for entry in manifest["files"]}
+        for name in os.listdir(directory):
+            stored = name[:-len(".upc.pkl")] if name.endswith(".upc.pkl") else name
+            if stored.endswith((".parquet", ".pkl")) and stored not in used:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def open(self, dataset_id: str) -> Dataset:
+        return Dataset(self._path(dataset_id), self._read_manifest(dataset_id))
+
+    def list(self) -> List[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        datasets = []
+        for dataset_id in sorted(os.listdir(self.directory)):
+            try:
+                datasets.append(self.open(dataset_id).to_dict())
+            except UnknownDataset:
+                continue
+        return sorted(datasets, key=lambda d: d["created_at"])
+
+    def delete(self, dataset_id: str):
+        with self._lock:
+            self._read_manifest(dataset_id)
+            shutil.rmtree(self._path(dataset_id), ignore_errors=True)
+
+def open_dataset(dataset_id: Optional[str]) -> Optional[Dataset]:
+    """The dataset a pipeline request refers to (None when it sent files instead)."""
+    return datasets.open(dataset_id) if dataset_id else None
+
+datasets = DatasetRegistry()
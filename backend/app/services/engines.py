@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Optional, Tuple
+from app.config import COMPUTE_ENGINE
+from app.logic.processing import FileSource
+from app.logic.columns import ColumnSpec, read_columns
+from app.services.cancel import CancelToken
+from app.services.export import ExportedFile, export_frame
+
+try:
+    import polars as pl
+except ImportError:  # optional: only COMPUTE_ENGINE=polars needs it
+    pl = None
+
+# --- COMPUTE ENGINES ---
+# The handful of operations the pipelines run over whole columns, behind one interface
+# so the heavy ones can run on a multi-threaded columnar engine. Keys are the int64
+# canonical UPCs (app/logic/upc.py); results are numpy arrays, so the pipelines never
+# see which engine ran. Column resolution only looks at header names (find_column /
+# find_col) and is the same for every engine.
+class PandasEngine:
+    """Default: pandas / numpy, single-threaded. Reading is calamine, writing xlsxwriter."""
+    name = "pandas"
+
+    def read(self, source: FileSource, spec: ColumnSpec, keep_all: bool = False) -> pd.DataFrame:
+        return read_columns(source, spec, keep_all)
+
+    def write(self, df: pd.DataFrame, fmt: str, cancel: Optional[CancelToken] = None) -> ExportedFile:
+        return export_frame(df, fmt, cancel)
+
+    def is_in(self, values: np.ndarray, lookup: np.ndarray) -> np.ndarray:
+        """Filter-by-set: which `values` appear in `lookup` (bool mask)."""
+        return pd.Series(values).isin(lookup).to_numpy(dtype=bool)
+
+    def match(self, keys: np.ndarray, lookup: np.ndarray, keep: str = "first") -> np.ndarray:
+        """
+        First-match join: for every key, the position of the first (keep="last": last)
+        entry of `lookup` equal to it, or -1 if there is none.
+        """
+        if not len(lookup):
+            return np.full(len(keys), -1, dtype=np.intp)
+        column = pd.Series(lookup)
+        kept = column[~column.duplicated(keep=keep).to_numpy()]
+        hits = pd.Index(kept.to_numpy()).get_indexer(keys)
+        return np.where(hits >= 0, kept.index.to_numpy()[hits], -1)
+
+    def match_all(self, keys: np.ndarray, lookup: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Many-to-many join: (key positions, lookup positions) of every equal pair, ordered
+        by key position, then lookup position.
+        """
+        order = np.argsort(lookup, kind='stable')
+        sorted_lookup = lookup[order]
+        starts = np.searchsorted(sorted_lookup, keys, 'left')
+        counts = np.searchsorted(sorted_lookup, keys, 'right') - starts
+        key_pos = np.repeat(np.arange(len(keys)), counts)
+        offsets = np.arange(len(key_pos)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return key_pos, order[np.repeat(starts, counts) + offsets]
+
+    def group_min(self, groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Grouped min, broadcast back to every row (NaN skipped; NaN if a group has nothing else)."""
+        return pd.Series(values).groupby(groups).transform('min').to_numpy()
+
+class PolarsEngine(PandasEngine):
+    """
+    Polars (pip install polars) for the joins, set filters and group-bys: multi-threaded
+    and columnar, in-process, so no pickling. Reading and writing stay as in pandas.
+    """
+    name = "polars"
+
+    def __init__(self):
+        if pl is None:
+            raise ValueError("COMPUTE_ENGINE=polars needs the polars package (pip install polars)")
+
+    def is_in(self, values: np.ndarray, lookup: np.ndarray) -> np.ndarray:
+        return pl.Series(values).is_in(pl.Series(lookup).unique().implode()).to_numpy()
+
+    def match(self, keys: np.ndarray, lookup: np.ndarray, keep: str = "first") -> np.ndarray:
+        pick = pl.col("pos").min() if keep == "first" else pl.col("pos").max()
+        found = pl.DataFrame({"key": lookup}).with_row_index("pos").group_by("key").agg(pick)
+        joined = pl.DataFrame({"key": keys}).join(found, on="key", how="left", maintain_order="left")
+        return joined["pos"].cast(pl.Int64).fill_null(-1).to_numpy().astype(np.intp, copy=False)
+
+    def match_all(self, keys: np.ndarray, lookup: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        left = pl.DataFrame({"key": keys}).with_row_index("key_pos")
+        right = pl.DataFrame({"key": lookup}).with_row_index("lookup_pos")
+        pairs = left.join(right, on="key", how="inner").sort(["key_pos", "lookup_pos"])
+        return (pairs["key_pos"].cast(pl.Int64).to_numpy().astype(np.intp, copy=False),
+                pairs["lookup_pos"].cast(pl.Int64).to_numpy().astype(np.intp, copy=False))
+
+    def group_min(self, groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+        df = pl.DataFrame({"group": groups, "value": pl.Series(values, nan_to_null=True)})
+        return df.select(pl.col("value").min().over("group"))["value"].to_numpy()
+
+COMPUTE_ENGINES: Dict[str, Callable] = {
+    "pandas": PandasEngine,
+    "polars": PolarsEngine,
+}
+
+def make_engine(kind: str = COMPUTE_ENGINE):
+    if kind not in COMPUTE_ENGINES:
+        raise ValueError(f"Unknown compute engine '{kind}' (Options: {list(COMPUTE_ENGINES)})")
+    return COMPUTE_ENGINES[kind]()
+
+engine = make_engine()
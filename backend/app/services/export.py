@@ -0,0 +1,285 @@
+import os
+import json
+import zipfile
+import tempfile
+import pandas as pd
+from typing import Dict, Iterator, List, Optional
+from app.config import UPLOAD_DIR
+from app.services.cancel import CancelToken, checkpoint
+
+try:
+    import xlsxwriter
+except ImportError:  # openpyxl's write-only mode is the (slower) fallback
+    xlsxwriter = None
+
+# format -> (file extension, media type)
+EXPORT_FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+# Bundles of several outputs (batch runs); never a format of a single result
+ARCHIVE_FORMATS = {
+    "zip": (".zip", "application/zip"),
+}
+FILE_TYPES = {**EXPORT_FORMATS, **ARCHIVE_FORMATS}
+
+# Rows converted to Python objects at a time while writing xlsx
+WRITE_CHUNK_ROWS = 10000
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+class ExportedFile:
+    """A finished output on disk. Streamed back in chunks, then deleted with `cleanup()`."""
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.format = fmt
+        self.stats = None  # per-stage timings from the pipeline that made it (PipelineTimer)
+
+    @property
+    def media_type(self) -> str:
+        return FILE_TYPES[self.format][1]
+
+    def filename(self, stem: str) -> str:
+        return stem + FILE_TYPES[self.format][0]
+
+    def iter_chunks(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class PreviewResult:
+    """What a preview run returns instead of an ExportedFile: a JSON-ready report, nothing on disk."""
+    def __init__(self, report: dict):
+        self.report = report
+        self.stats = None  # per-stage timings, like ExportedFile
+
+    def to_dict(self) -> dict:
+        return dict(self.report, stats=self.stats)
+
+def frame_records(df: pd.DataFrame, limit: int) -> List[dict]:
+    """First `limit` rows as JSON-safe dicts (NaN -> null, numpy scalars -> numbers, dates -> ISO text)."""
+    df = df.head(limit)
+    df.columns = [str(c) for c in df.columns]
+    return json.loads(df.to_json(orient="records", date_format="iso", default_handler=str))
+
+def check_format(fmt: str) -> str:
+    fmt = (fmt or "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}' (Options: {list(EXPORT_FORMATS)})")
+    if fmt == "parquet" and not parquet_available():
+        # Fail before the whole pipeline runs, not at the very end
+        raise ValueError("Parquet output needs 'pyarrow' installed on the server")
+    return fmt
+
+def parquet_available() -> bool:
+    for module in ("pyarrow", "fastparquet"):
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            pass
+    return False
+
+# --- WRITERS ---
+def iter_rows(df: pd.DataFrame, cancel: Optional[CancelToken] = None):
+    """Rows as plain lists with blanks (NaN/NaT) as None, built a chunk at a time (`cancel` checked before each)."""
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        checkpoint(cancel)
+        chunk = df.iloc[start:start + WRITE_CHUNK_ROWS]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+class XlsxWorkbook:
+    """
+    An xlsx file whose sheets are written row by row: xlsxwriter in constant_memory
+    mode (openpyxl's write-only mode if xlsxwriter is missing). Sheets are filled one
+    after the other; rows can be appended a chunk at a time.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if xlsxwriter is None:
+            from openpyxl import Workbook
+            self.workbook = Workbook(write_only=True)
+            return
+
+        self.workbook = xlsxwriter.Workbook(path, {
+            "constant_memory": True,
+            "strings_to_urls": False,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        })
+        self.header_format = self.workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+    def add_sheet(self, headers: List[str], name: str = "Sheet1") -> "XlsxSheet":
+        return XlsxSheet(self, headers, name)
+
+    def close(self):
+        if xlsxwriter is None:
+            self.workbook.save(self.path)
+        else:
+            self.workbook.close()
+
+class XlsxSheet:
+    def __init__(self, book: XlsxWorkbook, headers: List[str], name: str):
+        self.next_row = 1
+        if xlsxwriter is None:
+            self.sheet = book.workbook.create_sheet(name)
+            self.sheet.append(headers)
+            return
+        self.sheet = book.workbook.add_worksheet(name)
+        self.sheet.write_row(0, 0, headers, book.header_format)
+
+    def append(self, df: pd.DataFrame, cancel: Optional[CancelToken] = None):
+        if xlsxwriter is None:
+            for row in iter_rows(df, cancel):
+                self.sheet.append(row)
+            return
+        for r, row in enumerate(iter_rows(df, cancel), start=self.next_row):
+            self.sheet.write_row(r, 0, row)
+        self.next_row += len(df)
+
+def write_xlsx(df: pd.DataFrame, path: str, cancel: Optional[CancelToken] = None):
+    """
+    Same sheet as `df.to_excel(index=False)` (bold bordered header, blank NaN cells),
+    but written row by row in xlsxwriter's constant_memory mode.
+    (pandas emits cells column by column, which constant_memory cannot take.)
+    """
+    write_sheets({"Sheet1": df}, path, cancel)
+
+def write_sheets(frames: Dict[str, pd.DataFrame], path: str, cancel: Optional[CancelToken] = None):
+    """One workbook, a write_xlsx-style sheet per entry (sheet name -> rows)."""
+    book = XlsxWorkbook(path)
+    for name, df in frames.items():
+        book.add_sheet([str(c) for c in df.columns], name).append(df, cancel)
+    book.close()
+
+def write_parquet(df: pd.DataFrame, path: str):
+    # Parquet wants one type per column; our "#YOK" placeholders mix text into numbers
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    df.columns = [str(c) for c in df.columns]
+    df.to_parquet(path, index=False)
+
+def result_path(fmt: str) -> str:
+    fd, path = tempfile.mkstemp(prefix="result-", suffix=FILE_TYPES[fmt][0], dir=UPLOAD_DIR)
+    os.close(fd)
+    return path
+
+def export_frame(df: pd.DataFrame, fmt: str = "xlsx", cancel: Optional[CancelToken] = None) -> ExportedFile:
+    """
+    Writes `df` to a temp file in the requested format (xlsx, csv or parquet).
+    A `cancel` token is checked before every WRITE_CHUNK_ROWS rows of xlsx.
+    """
+    fmt = check_format(fmt)
+    checkpoint(cancel)
+    path = result_path(fmt)
+    try:
+        if fmt == "xlsx":
+            write_xlsx(df, path, cancel)
+        elif fmt == "csv":
+            df.to_csv(path, index=False)
+        else:
+            write_parquet(df, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return ExportedFile(path, fmt)
+
+def export_sheets(frames: Dict[str, pd.DataFrame], cancel: Optional[CancelToken] = None) -> ExportedFile:
+    """One xlsx with a sheet per entry (sheet name -> rows)."""
+    path = result_path("xlsx")
+    try:
+        write_sheets(frames, path, cancel)
+    except Exception:
+        os.remove(path)
+        raise
+    return ExportedFile(path, "xlsx")
+
+def export_zip(frames: Dict[str, pd.DataFrame], fmt: str = "xlsx", cancel: Optional[CancelToken] = None) -> ExportedFile:
+    """A zip holding one `<name>.<fmt>` file per entry, each what export_frame writes."""
+    fmt = check_format(fmt)
+    path = result_path("zip")
+    try:
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, df in frames.items():
+                member = export_frame(df, fmt, cancel)
+                try:
+                    archive.write(member.path, member.filename(name))
+                finally:
+                    member.cleanup()
+    except Exception:
+        os.remove(path)
+        raise
+    return ExportedFile(path, "zip")
+
+class ChunkedExport:
+    """
+    An output written a DataFrame chunk at a time, for the streaming pipelines:
+
+        with ChunkedExport("xlsx") as out:
+            for chunk in chunks:
+                out.write(chunk)
+        result = out.result
+
+    Every chunk must have the same columns; the first one (even if empty) sets the
+    header. Same file as export_frame on the concatenated chunks. xlsx and csv only:
+    Parquet needs one type per column up front, which a chunk can't promise.
+    A `cancel` token is checked before every chunk (every WRITE_CHUNK_ROWS rows of xlsx).
+    """
+    def __init__(self, fmt: str = "xlsx", cancel: Optional[CancelToken] = None):
+        self.format = check_streaming_format(fmt)
+        self.cancel = cancel
+        self.path = result_path(self.format)
+        self.rows = 0
+        self.result = None
+        self._book = None
+        self._sheet = None
+        self._started = False
+
+    def write(self, df: pd.DataFrame):
+        if self.format == "xlsx":
+            if self._sheet is None:
+                self._book = XlsxWorkbook(self.path)
+                self._sheet = self._book.add_sheet([str(c) for c in df.columns])
+            self._sheet.append(df, self.cancel)
+        else:
+            checkpoint(self.cancel)
+            df.to_csv(self.path, index=False, mode="a" if self._started else "w", header=not self._started)
+        self._started = True
+        self.rows += len(df)
+
+    def close(self) -> ExportedFile:
+        if not self._started:
+            self.write(pd.DataFrame())
+        if self._sheet is not None:
+            self._book.close()
+        self.result = ExportedFile(self.path, self.format)
+        return self.result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        return False
+
+def check_streaming_format(fmt: str) -> str:
+    fmt = check_format(fmt)
+    if fmt not in ("xlsx", "csv"):
+        raise ValueError(f"Streaming mode writes xlsx or csv, not '{fmt}'")
+    return fmt
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import functools
+from typing import Callable, Dict, Optional
+from app.config import JOB_WORKERS, JOB_QUEUE_LIMIT, JOB_RESULT_DIR, JOB_RESULT_TTL_MINUTES
+from app.services.export import ExportedFile
+from app.services.bus import JOB_CONTROL
+from app.services.progress import ProgressChannel
+from app.services.cancel import CancelToken, Cancelled, cancellations
+
+# Job states
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind: str, client_id: str, stem: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.client_id = client_id
+        self.stem = stem  # download name without extension
+        self.status = QUEUED
+        self.message = "Queued"
+        self.percent = 0
+        self.error = None
+        self.result: Optional[ExportedFile] = None
+        self.stats = None  # per-stage timings of the finished run
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task = None
+        self.token = CancelToken()
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at + JOB_RESULT_TTL_MINUTES * 60
+
+    @property
+    def download_name(self) -> Optional[str]:
+        return self.result.filename(self.stem) if self.result else None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "client_id": self.client_id,
+            "status": self.status,
+            "message": self.message,
+            "percent": self.percent,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "stats": self.stats,
+            "result_url": f"/api/jobs/{self.id}/result" if self.status == DONE else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, result: Optional[ExportedFile]) -> "Job":
+        job = cls(data["kind"], data["client_id"], data.get("stem", data["kind"]))
+        for key in ("id", "status", "message", "percent", "error", "created_at", "finished_at"):
+            setattr(job, key, data[key])
+        job.stats = data.get("stats")
+        job.result = result
+        return job
+
+class JobScheduler:
+    """
+    Runs pipeline jobs in the background, at most `workers` at a time, with up to
+    `queue_limit` more waiting. Every job has a small JSON record in `result_dir`,
+    written when it is submitted, on every status change and with its (throttled)
+    progress; finished results are moved next to it and deleted after `ttl` seconds.
+    Progress goes to `notify(client_id, message, percent)` (the WebSocket manager),
+    throttled through a ProgressChannel.
+    `cancel(job_id)` (or a cancel message on the client's WebSocket) stops a job: a
+    queued one never starts, a running one stops at its next check and frees its slot.
+    With several server processes sharing `result_dir` and the progress bus, any of
+    them answers for any job: a job another process runs is read from its record, and
+    its cancel goes over the bus to the process running it.
+    """
+    def __init__(self, workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT,
+                 result_dir: str = JOB_RESULT_DIR, ttl: float = JOB_RESULT_TTL_MINUTES * 60):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.result_dir = result_dir
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self._slots = None
+        self._notify = None
+        self._bus = None
+        self._sweeper = None
+
+    async def start(self, notify=None, bus=None):
+        os.makedirs(self.result_dir, exist_ok=True)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._notify = notify
+        self._bus = bus
+        if bus is not None:
+            bus.subscribe(self._control)
+        self.sweep()
+        self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.token.cancel("Server shutting down")  # the pipeline thread too, not just the task
+                job.task.cancel()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def submit(self, kind: str, client_id: str, stem: str, run: Callable, cleanup: Callable = None) -> Job:
+        """
+        Queues `run(progress, cancel=token)` (a blocking pipeline call returning an
+        ExportedFile) and returns the Job right away. `cleanup()` runs when the job ends,
+        however it ends.
+        """
+        if self.queued >= self.queue_limit:
+            if cleanup: cleanup()
+            raise JobQueueFull(f"Too many jobs waiting ({self.queue_limit}), try again later")
+        job = Job(kind, client_id, stem)
+        self.jobs[job.id] = job
+        self._save(job)
+        job.task = asyncio.create_task(self._run(job, run, cleanup))
+        return job
+
+    async def cancel(self, job_id: str, reason: str = "Cancelled by the client") -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None or job.status not in (QUEUED, RUNNING):
+            return job
+        if job.task is not None:
+            job.token.cancel(reason)
+        elif self._bus is not None:
+            # Another process runs it: whoever holds the task fires its token
+            await self._bus.publish(JOB_CONTROL, {"type": "cancel", "job_id": job.id, "reason": reason})
+        return job
+
+    async def cancel_client(self, client_id: str, reason: str = "Cancelled by the client"):
+        """Everything `client_id` runs, in every process on the bus (just this one without a bus)."""
+        if self._bus is None:
+            cancellations.cancel(client_id, reason)
+        else:
+            await self._bus.publish(JOB_CONTROL, {"type": "cancel", "client_id": client_id, "reason": reason})
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """This process's jobs from memory; anyone else's (or from before a restart) from their record."""
+        job = self.jobs.get(job_id)
+        if job is not None and (job.task is not None or job.finished_at is not None):
+            return job
+        return self._load(job_id)
+
+    # --- Internals ---
+    async def _control(self, client_id: str, payload: dict):
+        """Cancels sent over the bus (by any process, this one included)."""
+        if client_id != JOB_CONTROL or payload.get("type") != "cancel":
+            return
+        reason = payload.get("reason") or "Cancelled by the client"
+        if payload.get("job_id"):
+            job = self.jobs.get(str(payload["job_id"]))
+            if job is not None and job.task is not None and job.status in (QUEUED, RUNNING):
+                job.token.cancel(reason)
+        elif payload.get("client_id"):
+            cancellations.cancel(str(payload["client_id"]), reason)
+
+    async def _send(self, job: Job, message: str, percent: int):
+        self._save(job)  # other processes poll the record
+        if self._notify and job.client_id:
+            await self._notify(job.client_id, message, percent)
+
+    async def _run(self, job: Job, run: Callable, cleanup: Callable):
+        channel = ProgressChannel(functools.partial(self._send, job))
+        loop = asyncio.get_running_loop()
+        cancellations.add(job.client_id, job.token, on_disconnect=False)  # jobs outlive the socket
+
+        def stop_waiting():
+            # Still waiting for a slot: nothing runs yet, so just drop out of the line
+            if job.status == QUEUED:
+                loop.call_soon_threadsafe(job.task.cancel)
+        unsubscribe = job.token.on_cancel(stop_waiting)
+
+        def progress(message: str, percent: int):
+            # The job record always has the latest state; the socket gets the throttled stream
+            job.message, job.percent = message, percent
+            channel(message, percent)
+
+        try:
+            progress(f"🕒 Job queued ({self.queued} waiting)", 0)
+            async with self._slots:
+                job.status = RUNNING
+                self._save(job)
+                progress("🚀 Job started", 5)
+                result = await asyncio.to_thread(run, progress, cancel=job.token)
+                job.stats = result.stats
+                job.result = self._keep(job, result)
+                job.status = DONE
+                progress("✅ Job complete! Result ready for download.", 100)
+        except asyncio.CancelledError:
+            job.status, job.error = CANCELLED, job.token.reason or "Cancelled"
+            if not job.token.cancelled:
+                raise
+            progress(f"🛑 Job cancelled ({job.error})", 0)
+        except Cancelled as e:
+            # The thread stopped at its next check; leaving `async with` hands the slot on right away
+            job.status, job.error = CANCELLED, str(e) or "Cancelled"
+            progress(f"🛑 Job cancelled ({job.error})", 0)
+        except Exception as e:
+            job.status, job.error = FAILED, str(e)
+            progress(f"❌ Error: {str(e)}", 0)
+        finally:
+            unsubscribe()
+            cancellations.forget(job.client_id, job.token)
+            job.finished_at = time.time()
+            self._save(job)
+            await channel.close()
+            if cleanup:
+                await asyncio.to_thread(cleanup)
+
+    def _keep(self, job: Job, result: ExportedFile) -> ExportedFile:
+        """Moves the output out of the scratch dir into the result store."""
+        path = os.path.join(self.result_dir, job.id + os.path.splitext(result.path)[1])
+        os.replace(result.path, path)
+        return ExportedFile(path, result.format)
+
+    def _record_path(self, job_id: str) -> str:
+        return os.path.join(self.result_dir, f"{job_id}.json")
+
+    def _save(self, job: Job):
+        record = dict(job.to_dict(), stem=job.stem)
+        if job.result:
+            record["result_path"], record["result_format"] = job.result.path, job.result.format
+        # Readers in other processes must never see half a record
+        path = self._record_path(job.id)
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        """A job straight from its JSON record; kept in memory once it has finished (it won't change)."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(job_id)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        result = None
+        if data.get("result_path") and os.path.exists(data["result_path"]):
+            result = ExportedFile(data["result_path"], data["result_format"])
+        job = Job.from_dict(data, result)
+        if job.finished_at is not None:
+            self.jobs[job.id] = job
+        return job
+
+    def sweep(self):
+        """Drops finished jobs (and their files) older than the TTL."""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl:
+                del self.jobs[job_id]
+        for name in os.listdir(self.result_dir):
+            path = os.path.join(self.result_dir, name)
+            if now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+
+    async def _sweep_forever(self, every: float = 60):
+        while True:
+            await asyncio.sleep(every)
+            await asyncio.to_thread(self.sweep)
+
+job_scheduler = JobScheduler()
@@ -0,0 +1,242 @@
+import sys
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from app.services.cancel import CancelToken, Cancelled
+
+# Histogram buckets (seconds): small test files up to the 30-supplier restock runs
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROWS_BUCKETS = (100, 1000, 10000, 50000, 100000, 500000, 1000000, 5000000)
+
+_PAGE_SIZE = resource.getpagesize()
+
+def current_rss() -> Optional[int]:
+    """Resident memory of this process right now, in bytes (None where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss() -> int:
+    """High-water mark of this process's resident memory, in bytes."""
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+# --- PROMETHEUS-STYLE REGISTRY ---
+Labels = Tuple[Tuple[str, str], ...]
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help, self.type = name, help, "counter"
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, "", value
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name, self.help, self.type = name, help, "histogram"
+        self.buckets = tuple(buckets)
+        self.values: Dict[Labels, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + "_bucket", labels, f'le="{bound}"', cumulative
+            yield self.name + "_bucket", labels, 'le="+Inf"', series[-1]
+            yield self.name + "_sum", labels, "", series[-2]
+            yield self.name + "_count", labels, "", series[-1]
+
+class Gauge:
+    """
+    Read at scrape time: `read()` returns a number, or {(("label", "value"), ...): number}.
+    `kind="counter"` for totals kept elsewhere (e.g. connections accepted so far).
+    """
+    def __init__(self, name: str, help: str, read: Callable, kind: str = "gauge"):
+        self.name, self.help, self.type = name, help, kind
+        self.read = read
+
+    def samples(self):
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            if value is not None:
+                yield self.name, tuple(labels), "", value
+
+class MetricsRegistry:
+    """Everything /metrics shows. In-process only: each server process has its own numbers."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets=SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable, kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(name, help, read, kind))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    @contextmanager
+    def locked(self):
+        """Pipelines run in worker threads; updates and scrapes take turns."""
+        with self._lock:
+            yield
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                samples = list(metric.samples())
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                for name, labels, extra, value in samples:
+                    lines.append(f"{name}{format_labels(labels, extra)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram("convertion_stage_seconds", "Wall time of each pipeline stage")
+STAGE_CPU_SECONDS = metrics.histogram("convertion_stage_cpu_seconds", "CPU time of each pipeline stage (pipeline thread only)")
+STAGE_ROWS_OUT = metrics.histogram("convertion_stage_rows_out", "Rows produced by each pipeline stage", ROWS_BUCKETS)
+RUN_SECONDS = metrics.histogram("convertion_pipeline_seconds", "Wall time of whole pipeline runs")
+RUNS = metrics.counter("convertion_pipeline_runs_total", "Pipeline runs by outcome")
+metrics.gauge("convertion_process_peak_rss_bytes", "Resident memory high-water mark of this process", peak_rss)
+
+# --- PER-RUN TIMER ---
+class StageRecord:
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_mb = None
+        self.peak_rss_mb = None
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "wall_s": round(self.wall, 4),
+            "cpu_s": round(self.cpu, 4),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rss_mb": self.rss_mb,
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+class PipelineTimer:
+    """
+    Records each numbered stage of one pipeline run:
+
+        timer = PipelineTimer("restock")
+        with timer.stage("match", rows_in=n) as stage:
+            ...
+            stage.rows_out = len(df)
+        return timer.finish(result)
+
+    `timer.reports[name] = {...}` adds data-quality notes to the summary.
+    `finish` feeds the /metrics histograms and attaches the summary to the
+    result (`result.stats`); a stage that raises records the run as failed
+    (or cancelled). With a `cancel` token, every stage starts with `cancel.check()`.
+    CPU time is the pipeline thread's own (process-pool workers are not included),
+    RSS is the whole server process (current and high-water mark, in MB).
+    """
+    def __init__(self, pipeline: str, cancel: Optional[CancelToken] = None):
+        self.pipeline = pipeline
+        self.cancel = cancel
+        self.stages: List[StageRecord] = []
+        self.reports: Dict[str, dict] = {}  # data-quality notes (e.g. UPC parsing) for the summary
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None):
+        record = StageRecord(name, rows_in)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            if self.cancel is not None:
+                self.cancel.check()
+            yield record
+        except BaseException as e:
+            self._close(record, wall, cpu)
+            self._record("cancelled" if isinstance(e, Cancelled) else "error")
+            raise
+        self._close(record, wall, cpu)
+
+    def _close(self, record: StageRecord, wall: float, cpu: float):
+        record.wall = time.perf_counter() - wall
+        record.cpu = time.thread_time() - cpu
+        rss = current_rss()
+        record.rss_mb = round(rss / 2 ** 20, 1) if rss is not None else None
+        record.peak_rss_mb = round(peak_rss() / 2 ** 20, 1)
+        self.stages.append(record)
+
+    def summary(self) -> dict:
+        return {
+            "pipeline": self.pipeline,
+            "wall_s": round(time.perf_counter() - self._started, 4),
+            "cpu_s": round(time.thread_time() - self._cpu_started, 4),
+            "stages": [s.to_dict() for s in self.stages],
+            "reports": self.reports,
+        }
+
+    def finish(self, result):
+        """Publishes the run and hands `result` back with `.stats` set."""
+        result.stats = self._record("ok")
+        return result
+
+    def _record(self, status: str) -> dict:
+        summary = self.summary()
+        if self._finished:
+            return summary
+        self._finished = True
+        with metrics.locked():
+            RUNS.inc(pipeline=self.pipeline, status=status)
+            RUN_SECONDS.observe(summary["wall_s"], pipeline=self.pipeline)
+            for s in self.stages:
+                STAGE_SECONDS.observe(s.wall, pipeline=self.pipeline, stage=s.name)
+                STAGE_CPU_SECONDS.observe(s.cpu, pipeline=self.pipeline, stage=s.name)
+                if s.rows_out is not None:
+                    STAGE_ROWS_OUT.observe(s.rows_out, pipeline=self.pipeline, stage=s.name)
+        return summary
+
+def server_timing(stats: Optional[dict]) -> Optional[str]:
+    """`Server-Timing` header value (shows up in the browser's network tab)."""
+    if not stats:
+        return None
+    return ", ".join(f"{s['stage']};dur={s['wall_s'] * 1000:.1f}" for s in stats["stages"])
@@ -0,0 +1,185 @@
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Optional
+from app.config import WORKER_POOL_SIZE, MAX_CONCURRENT_JOBS, WORKER_START_METHOD
+from app.services.cancel import CancelToken
+
+# --- HELPER: Worker warm-up (Must be outside for ProcessPool) ---
+def warm_worker():
+    """Runs once per worker process: pay the pandas/calamine import cost before the first request."""
+    import pandas  # noqa: F401
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        pass
+
+def ping(_=None) -> bool:
+    return True
+
+def start_context():
+    """multiprocessing context for worker processes (None: the platform default)."""
+    return multiprocessing.get_context(WORKER_START_METHOD) if WORKER_START_METHOD else None
+
+class WorkerPool:
+    """
+    One long-lived ProcessPoolExecutor shared by every request.
+    `start()`/`shutdown()` are tied to the app lifecycle; requests borrow it through
+    `session()`, which admits at most `max_active` requests at a time (FIFO) and
+    reports the queue position of the ones that have to wait.
+    """
+    def __init__(self, workers: int = WORKER_POOL_SIZE, max_active: int = MAX_CONCURRENT_JOBS):
+        self.workers = workers
+        self.max_active = max_active
+        self._executor = None
+        self._cond = threading.Condition()
+        self._waiting = collections.deque()
+        self._active = 0
+        self._tickets = 0
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=warm_worker, mp_context=start_context()
+        )
+        # Submit one task per worker so every process is spawned (and warmed) right now
+        list(self._executor.map(ping, range(self.workers)))
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def restart(self):
+        """A crashed worker breaks the whole executor; swap in a fresh one."""
+        old = self._executor
+        self.start()
+        if old:
+            old.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, log=None, cancel: Optional[CancelToken] = None):
+        """
+        Waits for a free slot and yields the shared executor.
+        `log(msg, pct)` gets a message every time our place in the queue changes.
+        A `cancel` token that fires while we wait takes us out of the line (Cancelled).
+        """
+        unsubscribe = cancel.on_cancel(self._wake) if cancel is not None else None
+        with self._cond:
+            self._tickets += 1
+            ticket = self._tickets
+            self._waiting.append(ticket)
+            position = None
+            try:
+                while self._active >= self.max_active or self._waiting[0] != ticket:
+                    if cancel is not None:
+                        cancel.check()
+                    current = self._waiting.index(ticket) + 1
+                    if log and current != position:
+                        log(f"⏳ Server busy, waiting for a worker slot (position {current} in queue)...", 8)
+                    position = current
+                    self._cond.wait()
+            except BaseException:
+                # Never leave a dead ticket at the head of the line
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                if unsubscribe: unsubscribe()
+                raise
+            self._waiting.popleft()
+            self._active += 1
+            self._cond.notify_all()
+
+        try:
+            yield self._executor
+        except BrokenProcessPool:
+            self.restart()
+            raise
+        finally:
+            if unsubscribe: unsubscribe()
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+worker_pool = WorkerPool()
+
+class CancellableExecutor:
+    """
+    The executor a cancellable run submits to: the moment its token fires, every future
+    still waiting for a worker is cancelled (tasks already running in a worker process
+    can't be interrupted; they finish and their results are dropped), and new submits
+    raise Cancelled.
+    """
+    def __init__(self, executor, cancel: CancelToken):
+        self._executor = executor
+        self._cancel = cancel
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def submit(self, fn, *args, **kwargs):
+        self._cancel.check()
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel_pending(self):
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def __getattr__(self, name):
+        return getattr(self._executor, name)
+
+@contextmanager
+def borrow_executor(log=None, cancel: Optional[CancelToken] = None):
+    """
+    The shared pool when the app has started it; otherwise (scripts, notebooks)
+    a private throwaway pool, like before. With a `cancel` token, pending tasks are
+    dropped as soon as it fires and the slot goes back to the next request.
+    """
+    if worker_pool.started:
+        with worker_pool.session(log, cancel) as executor, cancellable(executor, cancel) as wrapped:
+            yield wrapped
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=WORKER_POOL_SIZE, mp_context=start_context()) as executor, \
+                cancellable(executor, cancel) as wrapped:
+            yield wrapped
+
+@contextmanager
+def cancellable(executor, cancel: Optional[CancelToken]):
+    if cancel is None:
+        yield executor
+        return
+    wrapped = CancellableExecutor(executor, cancel)
+    unsubscribe = cancel.on_cancel(wrapped.cancel_pending)
+    try:
+        yield wrapped
+    except BaseException:
+        wrapped.cancel_pending()  # nobody will collect them now
+        raise
+    finally:
+        unsubscribe()
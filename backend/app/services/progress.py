@@ -0,0 +1,63 @@
+import asyncio
+from typing import Awaitable, Callable
+
+# Close to a UI refresh: fast enough to look live, slow enough not to flood the socket
+PROGRESS_MIN_INTERVAL = 0.25
+
+_CLOSE = object()
+
+class ProgressChannel:
+    """
+    Thread-safe bridge from a worker thread to an async sender (the WebSocket).
+
+    Create it ON the event loop (it captures the running loop), hand it to the
+    pipeline as `callback(msg, pct)`, and `await close()` when the work is done.
+    Messages are delivered in order, at most one every `min_interval` seconds:
+    a burst (e.g. thirty "Loaded X" lines) collapses into its latest message,
+    tagged with how many were folded in. The last message is never dropped.
+    """
+    def __init__(self, send: Callable[[str, int], Awaitable], min_interval: float = PROGRESS_MIN_INTERVAL):
+        self._send = send
+        self._min_interval = min_interval
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._last_sent = 0.0
+        self._pump = self._loop.create_task(self._run())
+
+    def __call__(self, message: str, percent: int):
+        """Safe from any thread (and from the loop itself)."""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (message, percent))
+
+    async def close(self):
+        """Flushes whatever is still queued, then stops."""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _CLOSE)
+        await self._pump
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _CLOSE:
+                return
+
+            # Rate limit: anything that arrives while we wait gets folded into the newest message
+            wait = self._min_interval - (self._loop.time() - self._last_sent)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            folded, closing = 0, False
+            while not self._queue.empty():
+                newer = self._queue.get_nowait()
+                if newer is _CLOSE:
+                    closing = True
+                    break
+                item, folded = newer, folded + 1
+
+            message, percent = item
+            if folded:
+                message = f"{message} (+{folded} more)"
+            try:
+                await self._send(message, percent)
+            except Exception:
+                pass # Progress must never break the job
+            self._last_sent = self._loop.time()
+            if closing:
+                return
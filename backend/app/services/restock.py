@@ -1,23 +1,34 @@
+import numpy as np
 import pandas as pd
-import io
 import concurrent.futures
-from typing import List, Dict, Tuple
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional, Tuple, Union
+from app.config import PREVIEW_SAMPLE_OUTPUT, REQUEST_MEMORY_LIMIT, STREAM_CHUNK_ROWS
 from app.schemas import RestockSettings
+from app.logic.processing import FileSource, parse_pk, source_size, to_float
+from app.logic.columns import ColumnSpec, iter_column_chunks, read_sample, spec_digest
+from app.logic.upc import INVALID_UPC, UpcReport, normalize_upcs
+from app.services.pool import borrow_executor
+from app.services.cancel import CancelToken, checkpoint
+from app.services.cache import frame_size, parse_cache, source_digest
+from app.services.state import restock_state, state_key
+from app.services.datasets import open_dataset
+from app.services.export import ChunkedExport, ExportedFile, PreviewResult, check_format, check_streaming_format, \
+    frame_records
+from app.services.metrics import PipelineTimer
+from app.services.engines import engine
 
-# --- HELPER: Read File Function (Must be outside for ProcessPool) ---
-def read_excel_bytes(file_data: bytes, filename: str) -> Tuple[str, pd.DataFrame]:
-    """
-    Reads an Excel file from bytes using the fast 'calamine' engine.
-    Returns (filename, DataFrame).
-    """
-    try:
-        # 'calamine' is 5x-10x faster than openpyxl
-        df = pd.read_excel(io.BytesIO(file_data), engine="calamine")
-        return filename, df
-    except Exception:
-        # Fallback if calamine fails or isn't installed
-        df = pd.read_excel(io.BytesIO(file_data), engine="openpyxl")
-        return filename, df
+# Cache key for what read_excel_file produces (calamine, openpyxl as fallback)
+READ_ENGINE = "calamine"
+
+# Canonical int64 UPC (app/logic/upc.py) added to every Ham frame; all joins use it
+UPC_KEY = "_upc_key"
+# Master rows keyed and matched between two cancel checks (MasterLookup.merge)
+MERGE_CHUNK_ROWS = 50000
+
+def cache_engine(columns: ColumnSpec, keep_all: bool = False) -> str:
+    """Parse-cache engine tag: another compute engine or projection is a different parse."""
+    return f"{engine.name}-{READ_ENGINE}-{spec_digest(columns, keep_all)}"
 
 # --- HELPER: Column Finder ---
 def find_column(df: pd.DataFrame, possible_names: List[str]) -> str:
@@ -35,243 +46,582 @@ def find_column(df: pd.DataFrame, possible_names: List[str]) -> str:
             return col
     return None
 
+def resolved_columns(df: pd.DataFrame, settings: RestockSettings) -> Dict[str, Optional[str]]:
+    """Which header each alias list landed on in `df` (None: not found). For previews."""
+    resolved = {}
+    for key, names in settings.column_mappings.items():
+        col = find_column(df, names)
+        resolved[key] = None if col is None else str(col)
+    return resolved
+
 def get_file_code(filename: str) -> str:
     return filename.split('-')[0]
 
+def add_upc_keys(df: pd.DataFrame, upc_col: str, report: UpcReport) -> pd.DataFrame:
+    """Adds the UPC_KEY column (canonical UPCs of `upc_col`) and tallies the parse into `report`."""
+    keys, parsed = normalize_upcs(df[upc_col].to_numpy())
+    report.add(parsed)
+    df[UPC_KEY] = keys
+    return df
+
+def exports_by_code(export_filenames: List[str]) -> Dict[str, str]:
+    """Supplier code -> its Export file (the first one when a code repeats)."""
+    exports = {}
+    for name in export_filenames:
+        exports.setdefault(get_file_code(name), name)
+    return exports
+
+def matching_export(ham_name: str, exports: Dict[str, str]) -> Optional[str]:
+    # Fuzzy match filename logic: same supplier code before the first '-'
+    return exports.get(get_file_code(ham_name))
+
+def match_ham_file(ham_df: pd.DataFrame, export_df: Optional[pd.DataFrame], settings: RestockSettings) -> Tuple[pd.DataFrame, UpcReport, UpcReport]:
+    """
+    Step 2 for one supplier: adds UPC keys to the Ham file, keeps the rows its Export file
+    has and brings over their quantities. A supplier without an Export file keeps every row.
+    Returns (ham_df, ham UPC report, export UPC report).
+    """
+    ham_upcs, export_upcs = UpcReport(), UpcReport()
+    h_upc_col = find_column(ham_df, settings.column_mappings['upc'])
+    if h_upc_col:
+        ham_df = add_upc_keys(ham_df, h_upc_col, ham_upcs)
+    if export_df is None:
+        return ham_df, ham_upcs, export_upcs
+
+    e_upc_col = find_column(export_df, settings.column_mappings['upc'])
+    e_qty_col = find_column(export_df, settings.column_mappings['quantity'])
+
+    if h_upc_col and e_upc_col and e_qty_col:
+        # Join on canonical UPCs, so 123, "123", "0123" and 123.0 are the same item
+        export_keys, export_upcs = normalize_upcs(export_df[e_upc_col].to_numpy())
+        in_export = export_keys != INVALID_UPC
+
+        # Map Quantities (a repeated UPC keeps its LAST row, like the old dict)
+        quantities = pd.Series(export_df[e_qty_col].to_numpy()[in_export])
+        pos = engine.match(ham_df[UPC_KEY].to_numpy(), export_keys[in_export], keep='last')
+
+        # Filter Ham
+        found = pos >= 0
+        ham_df = ham_df[found].copy()
+        ham_df['Qty on Hand'] = quantities.iloc[pos[found]].set_axis(ham_df.index).fillna(0)
+    return ham_df, ham_upcs, export_upcs
+
+# --- HELPER: Supplier Task (Must be outside for ProcessPool) ---
+# A supplier file as a task gets it: its source, or the frame the parent found in the parse cache
+SupplierFile = Union[FileSource, pd.DataFrame]
+
+def supplier_cache_key(source: FileSource, settings: RestockSettings) -> str:
+    return parse_cache.key(source, cache_engine(settings.column_mappings))
+
+def read_supplier_file(source: SupplierFile, settings: RestockSettings, role: str,
+                       parsed: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    A cached frame as is; otherwise the file is parsed and the parse handed to the cache:
+    straight to its disk tier when there is one (the parent finds it there next time),
+    else back to the parent in `parsed[role]` for its memory tier.
+    """
+    if isinstance(source, pd.DataFrame):
+        return source
+    df = engine.read(source, settings.column_mappings)
+    if parse_cache.directory:
+        parse_cache.persist(supplier_cache_key(source, settings), df)
+    elif frame_size(df) <= parse_cache.max_bytes:
+        parsed[role] = df
+    return df
+
+def match_supplier(ham_source: SupplierFile, ham_name: str, export_source: Optional[SupplierFile],
+                   settings: RestockSettings, sample_rows: Optional[int] = None
+                   ) -> Tuple[str, Tuple[pd.DataFrame, UpcReport, UpcReport], dict, Dict[str, pd.DataFrame]]:
+    """
+    One supplier from start to finish, in a worker: reads its Ham file and matching Export
+    file (aliased columns only), then runs Step 2 on them right there, so only the rows
+    we keep travel back to the parent. With `sample_rows` (preview) only that many Ham
+    rows are read; the Export is always read whole, so the match rate stays honest.
+    Returns (ham_name, match_ham_file result, {"ham"/"export": rows read + resolved columns},
+    {"ham"/"export": frames parsed here for the parent's parse cache}).
+    """
+    parsed = {}
+    if isinstance(ham_source, pd.DataFrame):
+        ham_df = ham_source.head(sample_rows) if sample_rows else ham_source
+    elif sample_rows:
+        ham_df = read_sample(ham_source, settings.column_mappings, sample_rows)
+    else:
+        ham_df = read_supplier_file(ham_source, settings, "ham", parsed)
+    export_df = read_supplier_file(export_source, settings, "export", parsed) if export_source is not None else None
+    files = {"ham": {"rows": len(ham_df), "columns": resolved_columns(ham_df, settings)}}
+    if export_df is not None:
+        files["export"] = {"rows": len(export_df), "columns": resolved_columns(export_df, settings)}
+    return ham_name, match_ham_file(ham_df, export_df, settings), files, parsed
+
+def matched_here(ham_df: pd.DataFrame, ham_name: str, export_df: Optional[pd.DataFrame], settings: RestockSettings,
+                 sample_rows: Optional[int]) -> concurrent.futures.Future:
+    """match_supplier on frames the parse cache already had, in this thread, as a finished future."""
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(match_supplier(ham_df, ham_name, export_df, settings, sample_rows))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def iter_supplier_tasks(executor, tasks: List[Tuple[str, FileSource, Optional[FileSource]]],
+                        settings: RestockSettings, memory_limit: int, sample_rows: Optional[int] = None):
+    """
+    Submits one match_supplier task per (ham_name, ham_source, export_source), keeping
+    the workbook bytes in flight under `memory_limit` (one task is always admitted,
+    however big). A supplier is matched as soon as its own two files are read, while
+    other suppliers are still loading. Yields (ham_name, future) as the tasks finish.
+    The parse cache is looked up here: a supplier whose files are all cached is matched
+    in this thread (no frame crosses to a worker), one with a cached file and a new one
+    sends the cached frame along, and frames parsed in a worker are cached on return.
+    """
+    pending = list(tasks)
+    running = {}
+    in_flight = 0
+    while pending or running:
+        while pending and (not running or in_flight + task_size(pending[0]) <= memory_limit):
+            task = pending.pop(0)
+            ham_name, ham_source, export_source = task
+            ham_df = parse_cache.get(supplier_cache_key(ham_source, settings))
+            export_df = parse_cache.get(supplier_cache_key(export_source, settings)) if export_source is not None else None
+            if ham_df is not None and (export_source is None or export_df is not None):
+                future = matched_here(ham_df, ham_name, export_df, settings, sample_rows)
+            else:
+                if ham_df is not None and sample_rows:
+                    ham_df = ham_df.head(sample_rows)  # only the sample crosses over
+                future = executor.submit(match_supplier, ham_source if ham_df is None else ham_df, ham_name,
+                                         export_source if export_df is None else export_df, settings, sample_rows)
+            running[future] = (task, task_size(task))
+            in_flight += task_size(task)
+
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            (ham_name, ham_source, export_source), size = running.pop(future)
+            in_flight -= size
+            if not future.cancelled() and future.exception() is None:
+                sources = {"ham": ham_source, "export": export_source}
+                for role, df in future.result()[3].items():
+                    parse_cache.put(supplier_cache_key(sources[role], settings), df)
+            yield ham_name, future
+
+def task_size(task: Tuple[str, FileSource, Optional[FileSource]]) -> int:
+    _, ham_source, export_source = task
+    return source_size(ham_source) + (source_size(export_source) if export_source is not None else 0)
+
+def supplier_state_keys(ham_files: List[FileSource], ham_filenames: List[str], export_files: List[FileSource],
+                        export_filenames: List[str], settings: RestockSettings) -> Dict[str, str]:
+    """State-store key of every supplier's step-2 result: its Ham + matching Export contents and the aliases."""
+    export_sources = dict(zip(export_filenames, export_files))
+    exports = exports_by_code(export_filenames)
+    spec = spec_digest(settings.column_mappings)
+    digests = {}
+    keys = {}
+    for source, name in zip(ham_files, ham_filenames):
+        export_name = matching_export(name, exports)
+        if export_name is not None and export_name not in digests:
+            digests[export_name] = source_digest(export_sources[export_name])
+        keys[name] = state_key("supplier", spec, source_digest(source), digests.get(export_name))
+    return keys
+
+def warn_invalid_upcs(log, report: UpcReport, what: str, pct: int):
+    if report.invalid:
+        log(f"⚠️ {report.invalid} unreadable UPCs in {what} skipped (e.g. {', '.join(report.samples[:3])})", pct)
+
+# --- HELPER: Price War (Birbirinden Dusme) ---
+PRICE_COLUMNS = {'file': 'int64', 'upc': 'int64', 'price': 'float64', 'keep': 'bool'}
+
+def price_rows(priority: int, df: pd.DataFrame, settings: RestockSettings) -> Optional[pd.DataFrame]:
+    """One Ham file's side of the price war: (file, upc, price) per UPC, None if it can't take part."""
+    price_col = find_column(df, settings.column_mappings['price'])
+    if UPC_KEY not in df.columns or not price_col: return None
+
+    upcs = df[UPC_KEY].to_numpy()
+    last_rows = ~pd.Series(upcs).duplicated(keep='last').to_numpy() & (upcs != INVALID_UPC)
+    prices, ok = to_float(df[price_col].to_numpy(dtype=object)[last_rows])
+    return pd.DataFrame({
+        'file': priority,
+        'upc': upcs[last_rows][ok],
+        'price': prices[ok]
+    })
+
+def settle_price_war(prices: pd.DataFrame) -> np.ndarray:
+    """Which (file, upc) rows survive; each UPC is settled on its own rows only."""
+    upcs = prices['upc'].to_numpy()
+    files = prices['file'].to_numpy()
+    price = prices['price'].to_numpy(dtype=float)
+    is_nan = np.isnan(price)
+    first_file = engine.group_min(upcs, files)
+    is_cheapest = price == engine.group_min(upcs, price)
+    first_cheapest = engine.group_min(upcs, np.where(is_cheapest, files, np.nan))
+    first_nan = engine.group_min(upcs, np.where(is_nan, files, np.nan))
+
+    # A NaN price ties with everything: it loses to every earlier file and beats every later one
+    keep = (is_nan & (files == first_file)) | ((files == first_cheapest) & ~(first_nan < files))
+    return keep.astype(bool)
+
+def price_war_table(ordered_dfs: List[Tuple[str, pd.DataFrame]], settings: RestockSettings,
+                    keys: Optional[List[str]] = None, previous: Optional[dict] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    Long-form table: one row per (UPC, file) with the file priority, its price and
+    whether it survives (`keep`). Returns (table, number of UPCs settled in this call).
+    With `previous` (the {"keys", "prices"} state of an earlier run over the same file
+    list) only files whose key changed are re-read, and only UPCs such a file had
+    or now has are settled again; every other row keeps its earlier verdict.
+    """
+    changed = set(range(len(ordered_dfs)))
+    old = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in PRICE_COLUMNS.items()})
+    if previous is not None and keys is not None and len(previous["keys"]) == len(keys):
+        changed = {i for i, (before, now) in enumerate(zip(previous["keys"], keys)) if before != now}
+        old = previous["prices"]
+
+    fresh = [price_rows(i, df, settings) for i, (_, df) in enumerate(ordered_dfs) if i in changed]
+    fresh = [part for part in fresh if part is not None]
+    gone = old['file'].isin(changed).to_numpy()
+    kept = old[~gone]
+
+    prices = pd.concat([kept[['file', 'upc', 'price']]] + fresh, ignore_index=True).astype(
+        {name: dtype for name, dtype in PRICE_COLUMNS.items() if name != 'keep'})
+    keep = np.zeros(len(prices), dtype=bool)
+    keep[:len(kept)] = kept['keep'].to_numpy(dtype=bool)
+
+    affected = pd.concat([old['upc'][gone]] + [part['upc'] for part in fresh]).unique()
+    redo = prices['upc'].isin(affected).to_numpy()
+    if redo.any():
+        keep[redo] = settle_price_war(prices[redo])
+    prices['keep'] = keep
+    return prices, len(affected)
+
+def losers_by_file(names: List[str], prices: pd.DataFrame) -> Dict[str, set]:
+    upcs_to_remove = {name: set() for name in names}
+    losers = prices[~prices['keep']]
+    for priority, upcs in losers.groupby('file')['upc']:
+        upcs_to_remove[names[priority]] = set(upcs)
+    return upcs_to_remove
+
+def resolve_price_war(ordered_dfs: List[Tuple[str, pd.DataFrame]], settings: RestockSettings) -> Dict[str, set]:
+    """
+    Resolves the price war for ALL Ham files in one grouped pass.
+    `ordered_dfs` is [(filename, df)] in priority order, each df carrying UPC_KEY
+    (rows with an unreadable UPC stay out of it). For every UPC the cheapest
+    file keeps it and every other file drops it; equal prices go to the earlier file.
+    Returns {filename: set of UPC keys to remove}.
+
+    Same outcome as comparing every (earlier, later) pair of files:
+      - earlier < later  -> later drops it
+      - earlier > later  -> earlier drops it
+      - otherwise (equal, or a NaN price on either side) -> later drops it
+    A file whose price for a UPC is not a number never takes part for that UPC,
+    and a repeated UPC inside one file is priced by its LAST row.
+    """
+    prices, _ = price_war_table(ordered_dfs, settings)
+    return losers_by_file([name for name, _ in ordered_dfs], prices)
+
+# --- HELPER: Master Merge ---
+class MasterLookup:
+    """
+    Step 4's lookup side: every final Ham row stacked in priority order, first row per
+    UPC wins (Step 3 already handled priority logic (Price War), so we just take the
+    first available). Built once; `merge` then works on the whole master or a chunk of it.
+    """
+    def __init__(self, final_dfs: Dict[str, pd.DataFrame], settings: RestockSettings):
+        self.settings = settings
+        parts = []
+        for name, df in final_dfs.items():
+            if UPC_KEY not in df.columns: continue
+            price_c = find_column(df, settings.column_mappings['price'])
+            case_c = find_column(df, settings.column_mappings['case'])
+            parts.append(pd.DataFrame({
+                'upc': df[UPC_KEY].to_numpy(),
+                'price': df[price_c].to_numpy(dtype=object),
+                'case': df[case_c].to_numpy(dtype=object) if case_c else "#YOK",
+                'qty': df['Qty on Hand'].to_numpy(dtype=object),
+                'supplier': get_file_code(name),
+            }))
+        lookup = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['upc', 'price', 'case', 'qty', 'supplier'])
+        lookup = lookup[lookup['upc'] != INVALID_UPC].drop_duplicates('upc', keep='first')
+        self.upcs = lookup['upc'].to_numpy(dtype='int64')
+
+        # Everything per lookup row up front (a few Ham rows); merge() only does takes.
+        # The extra last slot is what master rows without a match get (pos == -1)
+        self.columns = {key: np.append(lookup[key].to_numpy(dtype=object), ["#YOK"])
+                        for key in ('price', 'qty', 'case', 'supplier')}
+        price_num, price_ok = to_float(lookup['price'].to_numpy(dtype=object))
+        cost_of = {code: settings.supplier_costs.get(f"{code} cost", settings.supplier_costs.get(f"{code} standart", 0.78))
+                   for code in lookup['supplier'].unique()}
+        self.price_num = np.append(price_num, [np.nan])
+        self.price_ok = np.append(price_ok, [False])
+        self.m_add = np.append(lookup['supplier'].map(cost_of).to_numpy(dtype=float), [np.nan])
+        # Filter invalid (no match, or a Ham price that literally reads "#YOK")
+        self.no_price = np.append((lookup['price'] == "#YOK").to_numpy(dtype=bool), [True])
+
+    def merge(self, restock_df: pd.DataFrame, upc_lookup=None,
+              cancel: Optional[CancelToken] = None) -> Tuple[pd.DataFrame, UpcReport]:
+        """
+        Master rows (left join on the UPC key) with Price / Qty / Case / Supplier / Maliyet
+        added (to `restock_df` itself) and unmatched rows dropped. Returns (rows, UPC report).
+        `upc_lookup(column)` supplies the master's UPC keys if they are already known.
+        Rows are keyed and matched MERGE_CHUNK_ROWS at a time, `cancel` checked before each.
+        """
+        m_upc_col = find_column(restock_df, self.settings.column_mappings['upc'])
+        m_pk_col = find_column(restock_df, self.settings.column_mappings['pk'])
+        known = upc_lookup is not None and m_upc_col is not None
+        restock_upcs, report = upc_lookup(m_upc_col) if known else (None, UpcReport())
+        upc_values = None if known else restock_df[m_upc_col].to_numpy()
+        pk_values = restock_df[m_pk_col].fillna('0').to_numpy(dtype=object)
+
+        n = len(restock_df)
+        pos = np.empty(n, dtype=np.intp)
+        pk_num, pk_ok = np.empty(n, dtype=float), np.empty(n, dtype=bool)
+        for start in range(0, n, MERGE_CHUNK_ROWS):
+            checkpoint(cancel)
+            rows = slice(start, start + MERGE_CHUNK_ROWS)
+            if known:
+                keys = restock_upcs[rows]
+            else:
+                keys, chunk_report = normalize_upcs(upc_values[rows])
+                report.add(chunk_report)
+            pos[rows] = engine.match(keys, self.upcs)
+            pk_num[rows], pk_ok[rows] = parse_pk(pk_values[rows])
+        columns = {key: values[pos] for key, values in self.columns.items()}
+
+        # Maliyet = PK * price + supplier cost; the raw price wherever PK or price won't parse
+        computed = (pos >= 0) & pk_ok & self.price_ok[pos]
+        maliyets = columns['price'].copy()
+        maliyets[computed] = (pk_num[computed] * self.price_num[pos[computed]] + self.m_add[pos[computed]]).tolist()
+
+        restock_df['Price'] = columns['price']
+        restock_df['Qty on Hand'] = columns['qty']
+        restock_df['Case'] = columns['case']
+        restock_df['Supplier'] = columns['supplier']
+        restock_df['Maliyet'] = maliyets
+        return restock_df[~self.no_price[pos]], report
+
 # --- MAIN LOGIC ---
 def process_restock_logic(
-    ham_files: List[bytes], 
+    ham_files: List[FileSource], 
     ham_filenames: List[str],
-    export_files: List[bytes], 
+    export_files: List[FileSource], 
     export_filenames: List[str],
-    restock_file: bytes,
+    restock_file: Optional[FileSource],
     settings: RestockSettings,
-    callback=None
-) -> bytes:
+    callback=None,
+    memory_limit: int = REQUEST_MEMORY_LIMIT,
+    output_format: str = "xlsx",
+    incremental: bool = False,
+    streaming: bool = False,
+    master_dataset: Optional[str] = None,
+    preview_rows: Optional[int] = None,
+    cancel: Optional[CancelToken] = None
+) -> ExportedFile:
+    """
+    With `incremental`, suppliers whose Ham + Export files are byte-identical to an
+    earlier run are taken from the state store (not read or matched again), and the
+    price war only re-settles UPCs a changed supplier touches. Same output either way.
+    With `streaming`, the master is never loaded whole: it is read, merged and written
+    STREAM_CHUNK_ROWS rows at a time (xlsx / csv output), so its size doesn't move memory.
+    `master_dataset` (a reference dataset id) stands in for `restock_file`: the master
+    comes already parsed, UPC keys included.
+    With `preview_rows` (a dry run) only that many rows of each Ham file and of the master
+    go through the pipeline (Exports are read whole), nothing is written, and the result
+    is a PreviewResult: resolved columns per file, per-supplier match and price-war
+    counts, master matches and a few output rows. Counts only cover the sampled rows.
+    A `cancel` token is checked between stages and at every progress message (raising
+    Cancelled); when it fires, supplier tasks still waiting for a worker are dropped.
+    """
     def log(msg, pct):
+        checkpoint(cancel)
         if callback: callback(msg, pct)
+    output_format = check_streaming_format(output_format) if streaming else check_format(output_format)
+    if preview_rows:
+        incremental = streaming = False  # a sample must not land in the state store
+    timer = PipelineTimer("restock_preview" if preview_rows else "restock", cancel)
+    master = open_dataset(master_dataset)
+    if (master is None) == (restock_file is None):
+        raise ValueError("Send either a master file or a master dataset (exactly one)")
     
-    # 1. PARALLEL LOADING (The Speed Fix)
-    # We use ProcessPoolExecutor to max out your CPU cores reading files
-    log("Started parallel file reading...", 10)
-    ham_dfs = {}
-    export_dfs = {}
-
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        # Submit all reading jobs at once
-        ham_futures = [
-            executor.submit(read_excel_bytes, content, name) 
-            for content, name in zip(ham_files, ham_filenames)
-        ]
-        export_futures = [
-            executor.submit(read_excel_bytes, content, name) 
-            for content, name in zip(export_files, export_filenames)
-        ]
-        
-        # Track progress
-        total_files = len(ham_files) + len(export_files)
-        completed = 0
-        
-        # We iterate futures as they complete to update the bar
-        for future in concurrent.futures.as_completed(ham_futures):
-            name = ham_futures[future]
-            try:
-                _, df = future.result()
-                ham_dfs[name] = df
-                completed += 1
-                pct = 10 + int((completed / total_files) * 30) # 10% to 40%
-                log(f"Loaded {name}", pct)
-            except Exception as e:
-                log(f"Failed to load {name}: {e}", pct)
-
-        for future in concurrent.futures.as_completed(export_futures):
-            name = export_futures[future]
-            try:
-                _, df = future.result()
-                export_dfs[name] = df
-                completed += 1
-                pct = 10 + int((completed / total_files) * 30)
-                log(f"Loaded {name}", pct)
-            except Exception as e:
-                log(f"Failed to load {name}: {e}", pct)
-
-    # 2. LOGIC: EXPORT PROCESSING
-    log("Matching Ham files with Export data...", 45)
-    processed_ham_dfs = {} 
-    
-    # Note: Logic processing is usually fast in memory; reading files was the bottleneck.
-    # We keep this part sequential to avoid complex inter-process communication overhead.
-    
-    for ham_name, ham_df in ham_dfs.items():
-        ham_code = get_file_code(ham_name)
-        
-        # Fuzzy match filename logic
-        matching_export_name = next((name for name in export_filenames if get_file_code(name) == ham_code), None)
-        
-        if not matching_export_name:
-            processed_ham_dfs[ham_name] = ham_df
-            continue
+    # 1 + 2. PARALLEL LOADING AND MATCHING (one task per supplier)
+    # We use a process pool to max out your CPU cores: each worker reads one supplier's
+    # Ham + Export pair and matches it on the spot, so matching overlaps with the reading
+    # of other suppliers and only the kept rows come back over IPC
+    with timer.stage("read") as stage:
+        log("Started parallel file reading...", 10)
+        export_sources = dict(zip(export_filenames, export_files))
+        exports = exports_by_code(export_filenames)
+        matched, files, failed = {}, {}, {}
 
-        export_df = export_dfs[matching_export_name]
+        # Incremental: suppliers seen before (same file contents) skip reading and matching
+        supplier_keys, reused = {}, {}
+        if incremental:
+            log("Checking which supplier files changed...", 10)
+            supplier_keys = supplier_state_keys(ham_files, ham_filenames, export_files, export_filenames, settings)
+            for name, key in supplier_keys.items():
+                entry = restock_state.get(key)
+                if entry is not None:
+                    reused[name] = entry
+            log(f"♻️ {len(reused)} of {len(supplier_keys)} suppliers unchanged since the last run", 10)
 
-        h_upc_col = find_column(ham_df, settings.column_mappings['upc'])
-        e_upc_col = find_column(export_df, settings.column_mappings['upc'])
-        e_qty_col = find_column(export_df, settings.column_mappings['quantity'])
+        # Exports no Ham file asks for are never read
+        tasks = []
+        for source, name in zip(ham_files, ham_filenames):
+            if name in reused: continue
+            export_name = matching_export(name, exports)
+            tasks.append((name, source, export_sources[export_name] if export_name else None))
 
-        if h_upc_col and e_upc_col and e_qty_col:
-            # OPTIMIZATION: Vectorized filtering instead of loops
-            export_df[e_upc_col] = export_df[e_upc_col].astype(str).str.strip()
-            ham_df[h_upc_col] = ham_df[h_upc_col].astype(str).str.strip()
-            
-            # Filter Ham
-            valid_upcs = set(export_df[e_upc_col])
-            ham_df = ham_df[ham_df[h_upc_col].isin(valid_upcs)].copy()
+        # Shared, pre-warmed pool owned by the app (waits in line if the server is busy)
+        with borrow_executor(log, cancel) as executor:
+            # Track progress
+            total_tasks = max(len(tasks), 1)
+            completed = 0
 
-            # Map Quantities
-            qty_map = dict(zip(export_df[e_upc_col], export_df[e_qty_col]))
-            ham_df['Qty on Hand'] = ham_df[h_upc_col].map(qty_map).fillna(0)
-        
-        processed_ham_dfs[ham_name] = ham_df
+            # We iterate futures as they complete to update the bar
+            # Only the aliased columns are loaded (Ham files carry 60+, we use a handful)
+            for name, future in iter_supplier_tasks(executor, tasks, settings, memory_limit, preview_rows):
+                checkpoint(cancel)  # a cancelled task must not read as a failed supplier
+                completed += 1
+                pct = 10 + int((completed / total_tasks) * 30) # 10% to 40%
+                try:
+                    _, entry, files[name], _ = future.result()
+                    matched[name] = entry
+                    log(f"Loaded and matched {name}", pct)
+                except BrokenProcessPool:
+                    raise  # a dead worker is not a bad file: the pool restarts and the request fails
+                except Exception as e:
+                    failed[name] = str(e)
+                    log(f"Failed to load {name}: {e}", pct)
+
+        # The master is written back out, so it keeps every column (streamed later in streaming mode)
+        restock_df = pd.DataFrame()
+        if master is not None:
+            restock_df = master.frame()
+            log(f"Loaded master dataset '{master.name}' (v{master.manifest['version']}, {len(restock_df)} rows)", 40)
+            if preview_rows:
+                restock_df = restock_df.head(preview_rows).copy()
+        elif preview_rows:
+            restock_df = read_sample(restock_file, settings.column_mappings, preview_rows, keep_all=True)
+        elif not streaming:
+            restock_df = parse_cache.load(
+                restock_file, cache_engine(settings.column_mappings, keep_all=True),
+                lambda src: engine.read(src, settings.column_mappings, keep_all=True)
+            )
+        stage.rows_out = sum(len(entry[0]) for entry in matched.values()) + len(restock_df)
+
+    # 2. LOGIC: EXPORT PROCESSING (already done per supplier in the workers; collect it)
+    with timer.stage("match", rows_in=sum(len(entry[0]) for entry in matched.values())) as stage:
+        log("Matching Ham files with Export data...", 45)
+        processed_ham_dfs = {}
+        ham_upcs, export_upcs = UpcReport(), UpcReport()
+
+        if incremental:
+            for ham_name, entry in matched.items():
+                restock_state.put(supplier_keys[ham_name], entry)
+        for ham_name, (ham_df, ham_report, export_report) in {**matched, **reused}.items():
+            processed_ham_dfs[ham_name] = ham_df
+            ham_upcs.add(ham_report)
+            export_upcs.add(export_report)
+        stage.rows_out = sum(len(df) for df in processed_ham_dfs.values())
+        warn_invalid_upcs(log, ham_upcs, "Ham files", 45)
+        warn_invalid_upcs(log, export_upcs, "Export files", 45)
+        timer.reports["upc"] = {"ham": ham_upcs.to_dict(), "export": export_upcs.to_dict()}
 
     # 3. LOGIC: PRICE WAR (Birbirinden Dusme)
-    log("Running Price War (Birbirinden Düşme)...", 70)
-    # Using the ORDER defined by the user (the list order of ham_filenames)
-    # The file list passed from frontend is ALREADY ordered by the user
-    
-    # We create a "Blocklist" dictionary: {filename: {set of UPCs}}
-    upcs_to_remove = {name: set() for name in processed_ham_dfs.keys()}
-    
-    # Sort keys based on the input order (Priority)
-    ordered_keys = [k for k in ham_filenames if k in processed_ham_dfs]
-
-    for i in range(len(ordered_keys)):
-        current_name = ordered_keys[i]
-        current_df = processed_ham_dfs[current_name]
-        c_upc_col = find_column(current_df, settings.column_mappings['upc'])
-        c_price_col = find_column(current_df, settings.column_mappings['price'])
+    with timer.stage("price_war", rows_in=stage.rows_out) as stage:
+        log("Running Price War (Birbirinden Düşme)...", 70)
+        # Using the ORDER defined by the user (the list order of ham_filenames)
+        # The file list passed from frontend is ALREADY ordered by the user
         
-        if not c_upc_col or not c_price_col: continue
-
-        current_prices = dict(zip(current_df[c_upc_col], current_df[c_price_col]))
+        # Sort keys based on the input order (Priority)
+        ordered_keys = [k for k in ham_filenames if k in processed_ham_dfs]
 
-        for j in range(i + 1, len(ordered_keys)):
-            next_name = ordered_keys[j]
-            next_df = processed_ham_dfs[next_name]
-            n_upc_col = find_column(next_df, settings.column_mappings['upc'])
-            n_price_col = find_column(next_df, settings.column_mappings['price'])
-            
-            if not n_upc_col or not n_price_col: continue
-            
-            next_prices = dict(zip(next_df[n_upc_col], next_df[n_price_col]))
+        # We create a "Blocklist" dictionary: {filename: {set of UPCs}}
+        ordered_dfs = [(name, processed_ham_dfs[name]) for name in ordered_keys]
+        if incremental:
+            # Verdicts of the last run over this same file list; only changed suppliers' UPCs are redone
+            keys = [supplier_keys[name] for name in ordered_keys]
+            war_key = state_key("price_war", spec_digest(settings.column_mappings), tuple(ordered_keys))
+            prices, resettled = price_war_table(ordered_dfs, settings, keys, restock_state.get(war_key))
+            restock_state.put(war_key, {"keys": keys, "prices": prices})
+            timer.reports["incremental"] = {
+                "suppliers_reused": len(reused),
+                "suppliers_recomputed": len(supplier_keys) - len(reused),
+                "upcs_resettled": resettled,
+                "upcs_total": int(prices['upc'].nunique()),
+            }
+        else:
+            prices, _ = price_war_table(ordered_dfs, settings)
+        upcs_to_remove = losers_by_file(ordered_keys, prices)
 
-            # Compare Intersecting UPCs
-            common = set(current_prices.keys()) & set(next_prices.keys())
-            
-            for upc in common:
-                try:
-                    p1 = float(current_prices[upc])
-                    p2 = float(next_prices[upc])
-                    
-                    if p1 < p2:
-                        upcs_to_remove[next_name].add(upc) # Keep Current
-                    elif p1 > p2:
-                        upcs_to_remove[current_name].add(upc) # Keep Next
-                    else:
-                        # Equal price? Remove Next (because Current is higher priority in list)
-                        upcs_to_remove[next_name].add(upc)
-                except:
-                    pass
-
-    # Apply Removals
-    final_dfs = {}
-    for name in ordered_keys:
-        df = processed_ham_dfs[name]
-        col = find_column(df, settings.column_mappings['upc'])
-        to_drop = upcs_to_remove[name]
-        final_dfs[name] = df[~df[col].isin(to_drop)]
+        # Apply Removals
+        final_dfs = {}
+        for name in ordered_keys:
+            df = processed_ham_dfs[name]
+            to_drop = upcs_to_remove[name]
+            dropped = np.fromiter(to_drop, dtype=np.int64, count=len(to_drop))
+            final_dfs[name] = df[~engine.is_in(df[UPC_KEY].to_numpy(), dropped)] if to_drop else df
+        stage.rows_out = sum(len(df) for df in final_dfs.values())
 
     # 4. LOGIC: MASTER MERGE
-    log("Merging final data into Master Excel...", 85)
-    m_upc_col = find_column(restock_df, settings.column_mappings['upc'])
-    m_pk_col = find_column(restock_df, settings.column_mappings['pk'])
-    
-    # Build Master Lookup
-    master_lookup = {}
-    for name, df in final_dfs.items():
-        supplier_code = get_file_code(name)
-        upc_c = find_column(df, settings.column_mappings['upc'])
-        price_c = find_column(df, settings.column_mappings['price'])
-        case_c = find_column(df, settings.column_mappings['case'])
-        
-        # Vectorized dictionary creation is faster than iterrows
-        # Create a temp DF with normalized columns
-        temp_df = pd.DataFrame({
-            'upc': df[upc_c].astype(str).str.strip(),
-            'price': df[price_c],
-            'case': df[case_c] if case_c else "#YOK",
-            'qty': df['Qty on Hand']
-        })
-        
-        # Iterate efficiently
-        for row in temp_df.itertuples():
-            # If priority order matters, we only add if NOT exists, 
-            # BUT Step 3 already handled priority logic (Price War), 
-            # so we just aggregate or take first available.
-            if row.upc not in master_lookup:
-                master_lookup[row.upc] = {
-                    'price': row.price,
-                    'qty': row.qty,
-                    'case': row.case,
-                    'supplier': supplier_code
-                }
-
-    # Apply to Master
-    # Use map/apply optimized
-    def get_row_data(upc):
-        upc = str(upc).strip()
-        return master_lookup.get(upc, None)
-
-    # We extract data into new lists to assign as columns (Faster than apply(axis=1))
-    prices, qtys, cases, suppliers, maliyets = [], [], [], [], []
-    
-    restock_upcs = restock_df[m_upc_col].astype(str).str.strip()
-    restock_pks = restock_df[m_pk_col].fillna('0').astype(str)
-
-    for upc, pk_val in zip(restock_upcs, restock_pks):
-        data = master_lookup.get(upc)
-        if data:
-            prices.append(data['price'])
-            qtys.append(data['qty'])
-            cases.append(data['case'])
-            suppliers.append(data['supplier'])
-            
-            # Maliyet
-            try:
-                pk_clean = int(pk_val.upper().replace('PK', '').strip())
-                m_add = settings.supplier_costs.get(f"{data['supplier']} cost", 
-                        settings.supplier_costs.get(f"{data['supplier']} standart", 0.78))
-                maliyets.append((pk_clean * float(data['price'])) + m_add)
-            except:
-                maliyets.append(data['price'])
-        else:
-            prices.append("#YOK")
-            qtys.append("#YOK")
-            cases.append("#YOK")
-            suppliers.append("#YOK")
-            maliyets.append("#YOK")
+    if streaming:
+        # The master streams through in chunks, each merged and written out right away
+        with timer.stage("master_merge") as stage:
+            log("Streaming the Master Excel through the merge...", 85)
+            lookup = MasterLookup(final_dfs, settings)
+            master_upcs = UpcReport()
+            stage.rows_in = 0
+            with ChunkedExport(output_format, cancel) as out:
+                if master is not None:
+                    # Already parsed: only the merge and the output are chunked
+                    chunks = (restock_df[start:start + STREAM_CHUNK_ROWS].reset_index(drop=True)
+                              for start in range(0, max(len(restock_df), 1), STREAM_CHUNK_ROWS))
+                else:
+                    chunks = iter_column_chunks(restock_file, settings.column_mappings, keep_all=True, chunk_rows=STREAM_CHUNK_ROWS)
+                for i, chunk in enumerate(chunks):
+                    merged, report = lookup.merge(chunk, cancel=cancel)
+                    out.write(merged)
+                    master_upcs.add(report)
+                    stage.rows_in += len(chunk)
+                    log(f"Merged {stage.rows_in} master rows ({out.rows} kept)...", 85 + min(i, 9))
+            warn_invalid_upcs(log, master_upcs, "the master file", 94)
+            timer.reports["upc"]["master"] = master_upcs.to_dict()
+            stage.rows_out = out.rows
+        return timer.finish(out.result)
 
-    restock_df['Price'] = prices
-    restock_df['Qty on Hand'] = qtys
-    restock_df['Case'] = cases
-    restock_df['Supplier'] = suppliers
-    restock_df['Maliyet'] = maliyets
+    master_columns = resolved_columns(restock_df, settings)
+    with timer.stage("master_merge", rows_in=len(restock_df)) as stage:
+        log("Merging final data into Master Excel...", 85)
+        # A preview's master is a slice, so the dataset's whole-file UPC keys don't line up
+        restock_df, master_upcs = MasterLookup(final_dfs, settings).merge(
+            restock_df, master.upc_keys if master is not None and not preview_rows else None, cancel)
+        warn_invalid_upcs(log, master_upcs, "the master file", 85)
+        timer.reports["upc"]["master"] = master_upcs.to_dict()
+        stage.rows_out = len(restock_df)
 
-    # Filter invalid
-    restock_df = restock_df[restock_df['Price'] != "#YOK"]
+    if preview_rows:
+        suppliers = {}
+        for name in ham_filenames:
+            if name not in processed_ham_dfs: continue
+            export_name = matching_export(name, exports)
+            suppliers[name] = {
+                "export": export_name,
+                "ham_rows": files[name]["ham"]["rows"],
+                "matched_rows": len(processed_ham_dfs[name]),
+                "price_war_dropped_rows": len(processed_ham_dfs[name]) - len(final_dfs[name]),
+                "price_war_dropped_upcs": len(upcs_to_remove[name]),
+                "kept_rows": len(final_dfs[name]),
+                "columns": {kind: info["columns"] for kind, info in files[name].items()},
+            }
+        log("Preview ready", 100)
+        return timer.finish(PreviewResult({
+            "preview": True,
+            "sample_rows": preview_rows,
+            "suppliers": suppliers,
+            "failed": failed,
+            "master": {"rows": stage.rows_in, "matched_rows": len(restock_df), "columns": master_columns},
+            "upc": timer.reports["upc"],
+            "sample": frame_records(restock_df, PREVIEW_SAMPLE_OUTPUT),
+        }))
 
     # Export
-    log("Saving file...", 95)
-    output = io.BytesIO()
-    restock_df.to_excel(output, index=False, engine='xlsxwriter')
-    output.seek(0)
-    return output.read()
\ No newline at end of file
+    with timer.stage("write", rows_in=len(restock_df)) as stage:
+        log("Saving file...", 95)
+        result = engine.write(restock_df, output_format, cancel)
+        stage.rows_out = len(restock_df)
+    return timer.finish(result)
@@ -1,8 +1,21 @@
+import re
 import pandas as pd
-import io
-import math
-from typing import List, Dict
+import numpy as np
+import concurrent.futures
+from typing import Callable, Dict, List, Optional, Tuple
+from app.config import PREVIEW_SAMPLE_OUTPUT, STREAM_CHUNK_ROWS
 from app.schemas import ShipmentSettings
+from app.logic.processing import FileSource, to_float, parse_pk
+from app.logic.columns import ColumnSpec, iter_column_chunks, read_sample, spec_digest
+from app.logic.upc import INVALID_UPC, UpcReport, format_upc, normalize_upcs
+from app.services.cache import parse_cache
+from app.services.pool import borrow_executor
+from app.services.cancel import CancelToken, checkpoint
+from app.services.datasets import Dataset, open_dataset
+from app.services.export import ChunkedExport, ExportedFile, PreviewResult, check_format, check_streaming_format, \
+    export_sheets, export_zip, frame_records
+from app.services.metrics import PipelineTimer
+from app.services.engines import engine
 
 def find_col(df: pd.DataFrame, candidates: List[str]) -> str:
     """Helper to find the first matching column name."""
@@ -11,17 +24,98 @@ def find_col(df: pd.DataFrame, candidates: List[str]) -> str:
             return col
     return None
 
-def process_shipment_logic(
-    invoice_file: bytes,
-    order_files: List[bytes],
-    restock_files: List[bytes],
-    dc_code: str,
-    settings: ShipmentSettings
-) -> bytes:
-    
-    # --- 1. READ INVOICE (Master) ---
-    invoice_df = pd.read_excel(io.BytesIO(invoice_file))
-    
+def cache_engine(columns: ColumnSpec) -> str:
+    """Parse-cache engine tag: the compute engine that parsed it and the projection."""
+    return f"{engine.name}-columns-{spec_digest(columns)}"
+
+def read_workbook(source: FileSource, columns: ColumnSpec) -> pd.DataFrame:
+    """
+    Loads only the columns `columns` can resolve to, through the parse cache
+    (re-uploads load instantly).
+    """
+    return parse_cache.load(source, cache_engine(columns), lambda src: engine.read(src, columns))
+
+# --- HELPERS: Column-wise building blocks ---
+def column_upcs(df: pd.DataFrame, col: str) -> tuple:
+    """Canonical UPC keys of `df[col]` (all INVALID_UPC if the column is missing) + the parse report."""
+    if col is None or df.empty:
+        return np.full(len(df), INVALID_UPC, dtype=np.int64), UpcReport()
+    return normalize_upcs(df[col].to_numpy())
+
+def indexed_upcs(df: pd.DataFrame, col: str, lookup: Optional[Callable] = None) -> tuple:
+    """column_upcs, answered by `lookup(col)` when the keys are already known."""
+    if lookup is None or col is None or df.empty:
+        return column_upcs(df, col)
+    return lookup(col)
+
+def first_match_positions(df_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """
+    For every key, returns the position of the FIRST row whose UPC key equals it
+    (same row as `df[df[col] == key].iloc[0]`), or -1 if there is none.
+    """
+    # Unreadable UPCs only ever equal each other, so masking the keys is enough
+    return np.where(keys != INVALID_UPC, engine.match(keys, df_keys), -1)
+
+def take_values(df: pd.DataFrame, col: str, positions: np.ndarray, mask: np.ndarray, out: np.ndarray):
+    """Copies `df[col]` at `positions` into `out` wherever `mask` is set (no-op if `col` is missing)."""
+    if col is None or not mask.any():
+        return
+    values = df[col].to_numpy()
+    # list() keeps the numpy scalar types, exactly what `df.iloc[i][col]` used to hand back
+    out[mask] = list(values[positions[mask]])
+
+def object_column(n: int, default) -> np.ndarray:
+    """An object column of `n` copies of `default` (the per-row "#YOK" / 0 defaults)."""
+    out = np.empty(n, dtype=object)
+    out[:] = [default] * n
+    return out
+
+# --- THE INDEXES (restock + order side, resolved once) ---
+class ShipmentIndex:
+    """
+    Everything the invoice lines are matched against: the concatenated restock and order
+    tables, their resolved columns, canonical UPC keys and the Total PCS per UPC.
+    Built once, then used for the whole invoice or for it chunk by chunk.
+    `restock_upcs` / `order_upcs` (column -> (keys, report), e.g. Dataset.upc_keys) supply
+    UPC keys that were computed before, instead of parsing the column again.
+    """
+    def __init__(self, restock_df: pd.DataFrame, order_df: pd.DataFrame, settings: ShipmentSettings,
+                 restock_upcs: Optional[Callable] = None, order_upcs: Optional[Callable] = None):
+        self.restock_df = restock_df
+        self.order_df = order_df
+        self.settings = settings
+
+        # Resolve every column ONCE (the old loop re-ran find_col a dozen times per invoice row)
+        self.res_cols = {key: find_col(restock_df, candidates) for key, candidates in settings.restock_columns.items()}
+        self.ord_cols = {key: find_col(order_df, candidates) for key, candidates in settings.order_columns.items()
+                         if key not in ('asin', 'sku')}
+
+        # Canonical UPC keys (app/logic/upc.py): every join below is on these, so 123,
+        # "123", "0123" and 123.0 all match
+        self.res_keys, self.res_upcs = indexed_upcs(restock_df, self.res_cols.get('upc'), restock_upcs)
+        self.ord_keys, self.ord_upcs = indexed_upcs(order_df, self.ord_cols.get('upc'), order_upcs)
+
+        # [CRITICAL RESTORATION] Calculate 'Total PCS' for Ratio Math
+        # We need to know the total PCS for each UPC across ALL order files to calculate the ratio
+        self.total_pcs = pd.Series(dtype=object)
+        if not order_df.empty and self.ord_cols.get('upc') and self.ord_cols.get('pcs'):
+            # Group by UPC and sum the PCS
+            valid = self.ord_keys != INVALID_UPC
+            self.total_pcs = order_df[self.ord_cols['pcs']][valid].groupby(self.ord_keys[valid]).sum()
+
+        # Allocation weight of every order row: its PCS, 0 where that isn't a positive number
+        self.ord_weights = np.zeros(len(order_df))
+        if not order_df.empty and self.ord_cols.get('pcs'):
+            pcs_num, pcs_ok = to_float(order_df[self.ord_cols['pcs']].to_numpy(dtype=object))
+            usable = pcs_ok & (pcs_num > 0)
+            self.ord_weights[usable] = pcs_num[usable]
+
+    def warn_invalid_upcs(self, log, pct: int):
+        for what, report in (("Restock files", self.res_upcs), ("Order Forms", self.ord_upcs)):
+            if report.invalid:
+                log(f"⚠️ {report.invalid} unreadable UPCs in {what} (e.g. {', '.join(report.samples[:3])})", pct)
+
+def invoice_columns(invoice_df: pd.DataFrame, settings: ShipmentSettings) -> Dict[str, str]:
     # Map Invoice Columns
     inv_cols = {}
     for key, candidates in settings.invoice_columns.items():
@@ -29,150 +123,568 @@ def process_shipment_logic(
         if not found:
             raise ValueError(f"Invoice file missing column for '{key}' (Candidates: {candidates})")
         inv_cols[key] = found
+    return inv_cols
+
+def quiet(msg, pct):
+    pass
+
+# --- 3. THE MATCHING LOGIC (whole columns at once) ---
+def match_lines(invoice_df: pd.DataFrame, inv_cols: Dict[str, str], index: ShipmentIndex, log=quiet) -> dict:
+    """Finds every invoice line in Restock (first) or the Order Forms and picks up its fields."""
+    n = len(invoice_df)
+    restock_df, order_df = index.restock_df, index.order_df
+    res_cols, ord_cols = index.res_cols, index.ord_cols
+    log(f"Matching {n} invoice lines against Restock...", 50)
+    upcs = invoice_df[inv_cols['upc']].to_numpy(dtype=object)
+    inv_keys, inv_upcs = column_upcs(invoice_df, inv_cols['upc'])
+
+    # A. Search in Restock (first matching row wins)
+    res_pos = first_match_positions(index.res_keys, inv_keys)
+    in_restock = res_pos >= 0
+
+    # B. Search in Order Form (only if not found in Restock)
+    log(f"{int(in_restock.sum())} found in Restock, searching Order Forms...", 60)
+    ord_pos = first_match_positions(index.ord_keys, inv_keys)
+    in_order = ~in_restock & (ord_pos >= 0)
+
+    dosya = object_column(n, '#YOK')
+    dosya[in_restock] = 'Restock'
+    dosya[in_order] = 'Order Form'
+
+    suplier = object_column(n, '#YOK')
+    asin = object_column(n, '#YOK')
+    pcs = object_column(n, 0)
+    pk = object_column(n, '#YOK')
+    sku = object_column(n, '#YOK')
+    price_check = object_column(n, '#YOK')
+
+    take_values(restock_df, res_cols.get('suplier'), res_pos, in_restock, suplier)
+    take_values(restock_df, res_cols.get('asin'), res_pos, in_restock, asin)
+    take_values(restock_df, res_cols.get('pcs'), res_pos, in_restock, pcs)
+    take_values(restock_df, res_cols.get('pk'), res_pos, in_restock, pk)
+    take_values(restock_df, res_cols.get('price'), res_pos, in_restock, price_check)
+
+    fields = {'suplier': suplier, 'asin': asin, 'pcs': pcs, 'pk': pk, 'sku': sku, 'price_check': price_check}
+    take_order_fields(index, ord_pos, in_order, fields, log)
+
+    return {
+        'upcs': upcs, 'inv_keys': inv_keys, 'inv_upcs': inv_upcs, 'ord_pos': ord_pos,
+        'in_restock': in_restock, 'in_order': in_order, 'dosya': dosya, **fields,
+    }
+
+def take_order_fields(index: ShipmentIndex, ord_pos: np.ndarray, rows: np.ndarray, fields: Dict[str, np.ndarray], log=quiet):
+    """Fills `fields` (suplier / pcs / pk / price_check / asin / sku) from order row `ord_pos` wherever `rows` is set."""
+    order_df, ord_cols = index.order_df, index.ord_cols
+    take_values(order_df, ord_cols.get('suplier'), ord_pos, rows, fields['suplier'])
+    take_values(order_df, ord_cols.get('pcs'), ord_pos, rows, fields['pcs'])
+    take_values(order_df, ord_cols.get('pk'), ord_pos, rows, fields['pk'])
+    take_values(order_df, ord_cols.get('price'), ord_pos, rows, fields['price_check'])
+
+    # ASIN Priority: the first non-empty ASIN column wins, together with its SKU
+    pending = rows.copy()
+    sku_candidates = index.settings.order_columns['sku']
+    asin_candidates = index.settings.order_columns['asin']
+    for i, asin_col in enumerate(asin_candidates):
+        if not pending.any():
+            break
+        log(f"Picking ASINs from '{asin_col}' ({int(pending.sum())} lines left)...", 65 + int(i / len(asin_candidates) * 10))
+        col_name = find_col(order_df, [asin_col])
+        if not col_name:
+            continue
+        found = object_column(len(ord_pos), None)
+        take_values(order_df, col_name, ord_pos, pending, found)
+        hit = pending & ~pd.isna(found)
+        fields['asin'][hit] = found[hit]
+        if i < len(sku_candidates):
+            take_values(order_df, find_col(order_df, [sku_candidates[i]]), ord_pos, hit, fields['sku'])
+        pending &= ~hit
+
+# --- 3b. ALLOCATION (an Order Form line shipped over every order row with its UPC) ---
+ALLOCATION_MODES = ("proportional", "first")
+LINE_FIELDS = ('upcs', 'inv_keys', 'ord_pos', 'in_restock', 'in_order', 'dosya',
+               'suplier', 'asin', 'pcs', 'pk', 'sku', 'price_check')
+
+def check_allocation(allocation: str) -> str:
+    if allocation not in ALLOCATION_MODES:
+        raise ValueError(f"Unknown allocation '{allocation}' (Options: {list(ALLOCATION_MODES)})")
+    return allocation
+
+def largest_remainder(units: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Whole-unit shares of `units[g]` for every group g of consecutive rows (group g starts
+    at `starts[g]`), proportional to `weights` (each group's total must be > 0). Every
+    row gets the floor of its quota; the units left over go one each to the largest
+    remainders, ties to the earlier row, so every group adds up to its units exactly.
+    """
+    counts = np.diff(np.append(starts, len(weights)))
+    group = np.repeat(np.arange(len(starts)), counts)
+    totals = np.add.reduceat(weights, starts) if len(starts) else np.zeros(0)
+    quota = units[group] * weights / totals[group]
+    shares = np.floor(quota).astype(np.int64)
+    left_over = units - (np.add.reduceat(shares, starts) if len(starts) else np.zeros(0, dtype=np.int64))
+
+    # Rank inside each group: largest remainder first, then row order
+    order = np.lexsort((np.arange(len(quota)), -(quota - shares), group))
+    rank = np.empty(len(quota), dtype=np.int64)
+    rank[order] = np.arange(len(quota)) - np.repeat(starts, counts)
+    return shares + (rank < left_over[group])
+
+def allocate_lines(invoice_df: pd.DataFrame, inv_cols: Dict[str, str], matched: dict, index: ShipmentIndex,
+                   log=quiet) -> Tuple[pd.DataFrame, dict]:
+    """
+    allocation="proportional": every Order Form line becomes one line per order row with
+    its UPC (in file order), each with that row's supplier / PCS / PK / ASIN / SKU and a
+    whole share of the shipped units proportional to its PCS (largest remainder, so the
+    shares add up to ShipQuantity; a fractional ShipQuantity ships its whole units).
+    calculate_lines writes each share as the row's ShipQuantity, so totals don't double-count.
+    Lines whose order rows have no PCS to go by, or whose ShipQuantity isn't a number,
+    keep the first-row treatment. Returns (invoice_df, matched) for calculate_lines;
+    matched['allocated'] has the units of every allocated line (NaN elsewhere).
+    """
+    if check_allocation(index.settings.allocation) == "first":
+        return invoice_df, matched
+    n = len(invoice_df)
+    ship_num, ship_ok = to_float(invoice_df[inv_cols['shipquantity']].to_numpy(dtype=object))
+    candidates = np.flatnonzero(matched['in_order'] & ship_ok & np.isfinite(ship_num) & (ship_num >= 0))
+    lines, rows = engine.match_all(matched['inv_keys'][candidates], index.ord_keys)
+    lines = candidates[lines]
+
+    # Only lines with some PCS to share by
+    totals = np.bincount(lines, weights=index.ord_weights[rows], minlength=n)
+    shared = totals[lines] > 0
+    lines, rows = lines[shared], rows[shared]
+    allocated_line = np.zeros(n, dtype=bool)
+    allocated_line[lines] = True
+    if not allocated_line.any():
+        return invoice_df, dict(matched, allocated=np.full(n, np.nan))
+    log(f"Allocating {int(allocated_line.sum())} Order Form lines over {len(rows)} order rows...", 78)
+
+    starts = np.flatnonzero(np.r_[True, lines[1:] != lines[:-1]])
+    units = np.floor(ship_num[lines[starts]])
+    shares = largest_remainder(units, index.ord_weights[rows], starts)
+
+    # Every line stays in place; an allocated one is replaced by its order rows
+    counts = np.where(allocated_line, np.bincount(lines, minlength=n), 1)
+    source = np.repeat(np.arange(n), counts)
+    expanded = {key: matched[key][source] for key in LINE_FIELDS}
+    out_rows = allocated_line[source]
+    expanded['ord_pos'][out_rows] = rows
+    for key, default in (('suplier', '#YOK'), ('asin', '#YOK'), ('pcs', 0), ('pk', '#YOK'), ('sku', '#YOK'),
+                         ('price_check', '#YOK')):
+        expanded[key][out_rows] = object_column(int(out_rows.sum()), default)
+    take_order_fields(index, expanded['ord_pos'], out_rows, expanded)
+
+    allocated = np.full(len(source), np.nan)
+    allocated[out_rows] = shares
+    expanded.update(inv_upcs=matched['inv_upcs'], allocated=allocated)
+    return invoice_df.iloc[source].reset_index(drop=True), expanded
+
+# --- 4. CALCULATIONS (Restored Logic) ---
+def calculate_lines(invoice_df: pd.DataFrame, inv_cols: Dict[str, str], matched: dict, index: ShipmentIndex,
+                    dc_code: str, log=quiet) -> pd.DataFrame:
+    """SKU2 / Yeni Pcs / PK EACH / Kalan for the matched lines; returns the output rows."""
+    n = len(invoice_df)
+    upcs, inv_keys, pk, pcs = matched['upcs'], matched['inv_keys'], matched['pk'], matched['pcs']
+    in_order = matched['in_order']
+    log(f"{int(in_order.sum())} found in Order Forms. Calculating SKU2 / Yeni Pcs...", 80)
+    prices = invoice_df[inv_cols['price']].to_numpy(dtype=object)
+    ship_qtys = invoice_df[inv_cols['shipquantity']].to_numpy(dtype=object)
+
+    has_pk = pd.Series(pk, dtype=object).map(str).to_numpy() != '#YOK'
+    pk_num, pk_ok = parse_pk(pk)
+
+    # SKU2 Generation (DC_UPC_PK_COST)
+    sku2 = object_column(n, '#YOK')
+    price_num, price_ok = to_float(prices)
+    has_price = pd.Series(prices, dtype=object).map(str).to_numpy() != '#YOK'
+    sku2_rows = has_pk & has_price & pk_ok & price_ok
+    if sku2_rows.any():
+        # Format: 12-digit UPC, 2-decimal Cost (canonical digits; raw text if unreadable)
+        upc_str = pd.Series(upcs[sku2_rows], dtype=object).map(str).str.strip().str.zfill(12)
+        readable = inv_keys[sku2_rows] != INVALID_UPC
+        upc_str[readable] = format_upc(inv_keys[sku2_rows][readable]).to_numpy()
+        pk_str = pd.Series(pk[sku2_rows], dtype=object).map(str)
+        cost_str = pd.Series(pk_num[sku2_rows] * price_num[sku2_rows]).map("{:.2f}".format)
+        sku2[sku2_rows] = (f"{dc_code}_" + upc_str + "_" + pk_str + "_" + cost_str).to_numpy(dtype=object)
 
+    # Yeni Pcs (The Ratio Calculation)
+    pcs_num, pcs_ok = to_float(pcs)
+    ship_num, ship_ok = to_float(ship_qtys)
+
+    # Lines allocate_lines already gave their share of whole units
+    allocated = matched.get('allocated', np.full(n, np.nan))
+    alloc_rows = ~np.isnan(allocated)
+
+    # If we found it in Order Files, use the Ratio: (Row Pcs / Total Pcs for this UPC)
+    total_pcs = index.total_pcs
+    total_pos = engine.match(inv_keys, total_pcs.index.to_numpy())
+    use_ratio = in_order & (total_pos >= 0) & ~alloc_rows
+    total_num, total_ok = to_float(np.append(total_pcs.to_numpy(dtype=object), [0])[total_pos])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_qty = (pcs_num / total_num) * ship_num
+    use_ratio_floor = use_ratio & (total_num > 0)
+
+    # Rows where the old per-row try/except bailed out before setting 'Yeni Pcs'
+    yeni_ok = pcs_ok & ship_ok & ~(use_ratio & ~total_ok) & ~(use_ratio_floor & ~np.isfinite(ratio_qty))
+    yeni_ok |= alloc_rows
+
+    yeni = object_column(n, '#YOK')
+    # Restock, no match or empty total -> just take full quantity (as float)
+    plain_rows = yeni_ok & ~use_ratio_floor & ~alloc_rows
+    yeni[plain_rows] = ship_num[plain_rows].tolist()
+    # Whole units: the floored ratio, or the allocated share
+    ratio_rows = yeni_ok & (use_ratio_floor | alloc_rows)
+    yeni_floor = np.zeros(n, dtype=np.int64)
+    yeni_floor[ratio_rows & ~alloc_rows] = np.floor(ratio_qty[ratio_rows & ~alloc_rows]).astype(np.int64)
+    yeni_floor[alloc_rows] = allocated[alloc_rows].astype(np.int64)
+    yeni[ratio_rows] = yeni_floor[ratio_rows].tolist()
+
+    # PK EACH & Remainder
+    final_qty = np.where(ratio_rows, yeni_floor, ship_num).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        each = final_qty / pk_num
+    pk_each = object_column(n, '#YOK')
+    kalan = object_column(n, '#YOK')
+    each_rows = yeni_ok & has_pk & pk_ok & (pk_num > 0) & np.isfinite(each)
+    if each_rows.any():
+        pk_each[each_rows] = np.trunc(each[each_rows]).astype(np.int64).tolist()
+        float_rows = each_rows & ~ratio_rows
+        kalan[float_rows] = np.mod(final_qty[float_rows], pk_num[float_rows]).tolist()
+        int_rows = each_rows & ratio_rows
+        kalan[int_rows] = np.mod(yeni_floor[int_rows], pk_num[int_rows].astype(np.int64)).tolist()
+
+    # An allocated row ships its share, not the whole line: per-line sums stay the invoice's
+    ship_out = np.array(ship_qtys, dtype=object)
+    ship_out[alloc_rows] = allocated[alloc_rows].astype(np.int64).tolist()
+
+    return pd.DataFrame({
+        'UPC': upcs.tolist(),
+        'Price': prices.tolist(),
+        'ShipQuantity': ship_out.tolist(),
+        'PackSize': invoice_df[inv_cols['packsize']].to_numpy(dtype=object).tolist(),
+        'Brand': invoice_df[inv_cols['brand']].to_numpy(dtype=object).tolist(),
+        'Description': invoice_df[inv_cols['description']].to_numpy(dtype=object).tolist(),
+        'Suplier': matched['suplier'].tolist(),
+        'Asin': matched['asin'].tolist(),
+        'Pcs': pcs.tolist(),
+        'PK': pk.tolist(),
+        'SKU': matched['sku'].tolist(),
+        'Price Check': matched['price_check'].tolist(),
+        'DOSYA': matched['dosya'].tolist(),
+        'SKU2': sku2.tolist(),
+        'Yeni Pcs': yeni.tolist(),
+        'PK EACH': pk_each.tolist(),
+        'Kalan': kalan.tolist(),
+    })
+
+def read_indexes(restock_files: List[FileSource], order_files: List[FileSource], settings: ShipmentSettings,
+                 log=quiet, restock_dataset: Optional[str] = None, order_dataset: Optional[str] = None) -> ShipmentIndex:
+    """
+    Restock / order tables from the uploaded files, or from a registered reference dataset
+    (already parsed, UPC keys included) when its id is given instead.
+    """
     # --- 2. READ & MERGE FILES ---
-    restock_dfs = [pd.read_excel(io.BytesIO(f)) for f in restock_files]
-    restock_df = pd.concat(restock_dfs, ignore_index=True) if restock_dfs else pd.DataFrame()
-
-    order_dfs = [pd.read_excel(io.BytesIO(f)) for f in order_files]
-    order_df = pd.concat(order_dfs, ignore_index=True) if order_dfs else pd.DataFrame()
-
-    # [CRITICAL RESTORATION] Calculate 'Total PCS' for Ratio Math
-    # We need to know the total PCS for each UPC across ALL order files to calculate the ratio
-    total_pcs_map = {}
-    if not order_df.empty:
-        ord_upc = find_col(order_df, settings.order_columns['upc'])
-        ord_pcs = find_col(order_df, settings.order_columns['pcs'])
-        if ord_upc and ord_pcs:
-            # Group by UPC and sum the PCS
-            total_pcs_map = order_df.groupby(ord_upc)[ord_pcs].sum().to_dict()
-
-    # --- 3. THE MATCHING LOGIC ---
-    results = []
-
-    for _, inv_row in invoice_df.iterrows():
-        upc = inv_row[inv_cols['upc']]
-        
-        # Default Row Data
-        row_data = {
-            'UPC': upc,
-            'Price': inv_row[inv_cols['price']],
-            'ShipQuantity': inv_row[inv_cols['shipquantity']],
-            'PackSize': inv_row[inv_cols['packsize']],
-            'Brand': inv_row[inv_cols['brand']],
-            'Description': inv_row[inv_cols['description']],
-            'Suplier': '#YOK',
-            'Asin': '#YOK',
-            'Pcs': 0,     # Changed default to 0 for math
-            'PK': '#YOK',
-            'SKU': '#YOK',
-            'Price Check': '#YOK',
-            'DOSYA': '#YOK',
-            'SKU2': '#YOK',
-            'Yeni Pcs': '#YOK',
-            'PK EACH': '#YOK',
-            'Kalan': '#YOK'
-        }
-
-        found_match = False
-
-        # A. Search in Restock
-        res_upc_col = find_col(restock_df, settings.restock_columns['upc'])
-        if res_upc_col and not restock_df.empty and upc in restock_df[res_upc_col].values:
-            match = restock_df[restock_df[res_upc_col] == upc].iloc[0]
-            row_data.update({
-                'DOSYA': 'Restock',
-                'Suplier': match.get(find_col(restock_df, settings.restock_columns['suplier']), '#YOK'),
-                'Asin': match.get(find_col(restock_df, settings.restock_columns['asin']), '#YOK'),
-                'Pcs': match.get(find_col(restock_df, settings.restock_columns['pcs']), 0),
-                'PK': match.get(find_col(restock_df, settings.restock_columns['pk']), '#YOK'),
-                'Price Check': match.get(find_col(restock_df, settings.restock_columns['price']), '#YOK'),
-            })
-            found_match = True
-
-        # B. Search in Order Form (If not found in Restock)
-        elif not order_df.empty:
-            ord_upc_col = find_col(order_df, settings.order_columns['upc'])
-            if ord_upc_col and upc in order_df[ord_upc_col].values:
-                match = order_df[order_df[ord_upc_col] == upc].iloc[0]
-                
-                # ASIN Priority Loop
-                asin_val = '#YOK'
-                sku_val = '#YOK'
-                
-                for i, asin_col in enumerate(settings.order_columns['asin']):
-                    col_name = find_col(order_df, [asin_col])
-                    if col_name and not pd.isna(match[col_name]):
-                        asin_val = match[col_name]
-                        # Try to find matching SKU
-                        if i < len(settings.order_columns['sku']):
-                            sku_col_name = find_col(order_df, [settings.order_columns['sku'][i]])
-                            if sku_col_name:
-                                sku_val = match[sku_col_name]
-                        break 
-                
-                row_data.update({
-                    'DOSYA': 'Order Form',
-                    'Suplier': match.get(find_col(order_df, settings.order_columns['suplier']), '#YOK'),
-                    'Asin': asin_val,
-                    'SKU': sku_val,
-                    'PK': match.get(find_col(order_df, settings.order_columns['pk']), '#YOK'),
-                    'Price Check': match.get(find_col(order_df, settings.order_columns['price']), '#YOK'),
-                    'Pcs': match.get(find_col(order_df, settings.order_columns['pcs']), 0)
-                })
-                found_match = True
-
-        # --- 4. CALCULATIONS (Restored Logic) ---
-        
-        # SKU2 Generation (DC_UPC_PK_COST)
-        if str(row_data['PK']) != '#YOK' and str(row_data['Price']) != '#YOK':
-            try:
-                pk_clean = int(str(row_data['PK']).upper().replace('PK', '').strip())
-                price_clean = float(row_data['Price'])
-                cost_calc = pk_clean * price_clean
-                
-                # Format: 12-digit UPC, 2-decimal Cost
-                upc_str = str(upc).strip().zfill(12)
-                cost_str = "{:.2f}".format(cost_calc)
-                
-                row_data['SKU2'] = f"{dc_code}_{upc_str}_{row_data['PK']}_{cost_str}"
-            except:
-                pass
-
-        # Yeni Pcs (The Ratio Calculation)
-        try:
-            pcs_val = float(row_data['Pcs'])
-            ship_qty = float(row_data['ShipQuantity'])
-            
-            # If we found it in Order Files, use the Ratio: (Row Pcs / Total Pcs for this UPC)
-            if row_data['DOSYA'] == 'Order Form' and upc in total_pcs_map:
-                total_pcs = float(total_pcs_map[upc])
-                if total_pcs > 0:
-                    # The Magic Formula from your old app
-                    yeni_pcs = (pcs_val / total_pcs) * ship_qty
-                    row_data['Yeni Pcs'] = math.floor(yeni_pcs) # Usually floored or rounded
-                else:
-                    row_data['Yeni Pcs'] = ship_qty
-            else:
-                # If Restock or no match, just take full quantity
-                row_data['Yeni Pcs'] = ship_qty
-
-            # PK EACH & Remainder
-            if str(row_data['PK']) != '#YOK':
-                 pk_int = int(str(row_data['PK']).upper().replace('PK', '').strip())
-                 if pk_int > 0:
-                     final_qty = row_data['Yeni Pcs']
-                     row_data['PK EACH'] = int(final_qty / pk_int)
-                     row_data['Kalan'] = final_qty % pk_int
-
-        except Exception as e:
-            pass 
-
-        results.append(row_data)
+    references = {"restock": open_dataset(restock_dataset), "order": open_dataset(order_dataset)}
+    for kind, sources in (("restock", restock_files), ("order", order_files)):
+        if references[kind] is not None and sources:
+            raise ValueError(f"Send either the {kind} files or the {kind} dataset id, not both")
+
+    total_files = len(restock_files) + len(order_files)
+    loaded = 0
+    tables = {}
+    for kind, sources, columns in (("restock", restock_files, settings.restock_columns),
+                                   ("order", order_files, settings.order_columns)):
+        dataset: Optional[Dataset] = references[kind]
+        if dataset is not None:
+            tables[kind] = dataset.frame()
+            log(f"Loaded {kind} dataset '{dataset.name}' (v{dataset.manifest['version']}, {len(tables[kind])} rows)", 30)
+            continue
+        frames = []
+        for i, f in enumerate(sources):
+            frames.append(read_workbook(f, columns))
+            loaded += 1
+            log(f"Loaded {kind} file {i + 1}/{len(sources)}", 15 + int(loaded / total_files * 30)) # 15% to 45%
+        tables[kind] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    restock, order = references["restock"], references["order"]
+    return ShipmentIndex(tables["restock"], tables["order"], settings,
+                         restock_upcs=restock.upc_keys if restock else None,
+                         order_upcs=order.upc_keys if order else None)
+
+def process_shipment_logic(
+    invoice_file: FileSource,
+    order_files: List[FileSource],
+    restock_files: List[FileSource],
+    dc_code: str,
+    settings: ShipmentSettings,
+    callback=None,
+    output_format: str = "xlsx",
+    streaming: bool = False,
+    restock_dataset: Optional[str] = None,
+    order_dataset: Optional[str] = None,
+    preview_rows: Optional[int] = None,
+    cancel: Optional[CancelToken] = None
+) -> ExportedFile:
+    """
+    With `streaming`, the invoice is never loaded whole: it is read, matched against the
+    in-memory restock / order indexes and written STREAM_CHUNK_ROWS lines at a time
+    (xlsx / csv output), so its size doesn't move memory.
+    `restock_dataset` / `order_dataset` (reference dataset ids) stand in for the
+    restock / order files.
+    With `preview_rows` (a dry run) only that many invoice lines are read and matched
+    against the full indexes; nothing is written and the result is a PreviewResult
+    (see preview_shipment).
+    A `cancel` token is checked between stages, at every progress message and between
+    streamed chunks (raising Cancelled).
+    """
+    def log(msg, pct):
+        checkpoint(cancel)
+        if callback: callback(msg, pct)
+    output_format = check_streaming_format(output_format) if streaming else check_format(output_format)
+    check_allocation(settings.allocation)
+    timer = PipelineTimer("shipment_preview" if preview_rows else "shipment", cancel)
+
+    if preview_rows:
+        with timer.stage("read") as stage:
+            log("Reading invoice sample...", 10)
+            invoice_df = read_sample(invoice_file, settings.invoice_columns, preview_rows)
+            index = read_indexes(restock_files, order_files, settings, log, restock_dataset, order_dataset)
+            stage.rows_out = len(invoice_df) + len(index.restock_df) + len(index.order_df)
+        return preview_shipment(invoice_df, index, dc_code, timer, preview_rows, log)
+
+    if streaming:
+        return stream_shipment(invoice_file, order_files, restock_files, dc_code, settings, log, output_format, timer,
+                               restock_dataset, order_dataset)
+
+    # --- 1. READ INVOICE (Master) ---
+    with timer.stage("read") as stage:
+        log("Reading invoice...", 10)
+        invoice_df = read_workbook(invoice_file, settings.invoice_columns)
+        inv_cols = invoice_columns(invoice_df, settings)
+
+        index = read_indexes(restock_files, order_files, settings, log, restock_dataset, order_dataset)
+        index.warn_invalid_upcs(log, 45)
+        stage.rows_out = len(invoice_df) + len(index.restock_df) + len(index.order_df)
+
+    if invoice_df.empty:
+        # Nothing to match; keep the old "no rows -> no columns" output
+        return timer.finish(engine.write(pd.DataFrame([]), output_format, cancel))
+
+    with timer.stage("match", rows_in=len(invoice_df)) as stage:
+        matched = match_lines(invoice_df, inv_cols, index, log)
+        warn_invalid_invoice_upcs(log, matched['inv_upcs'], 60)
+        timer.reports["upc"] = upc_reports(matched['inv_upcs'], index)
+        stage.rows_out = int(matched['in_restock'].sum() + matched['in_order'].sum())
+
+    with timer.stage("allocate", rows_in=len(invoice_df)) as stage:
+        invoice_df, matched = allocate_lines(invoice_df, inv_cols, matched, index, log)
+        stage.rows_out = len(invoice_df)
+
+    n = len(invoice_df)
+    with timer.stage("calculate", rows_in=n) as stage:
+        final_df = calculate_lines(invoice_df, inv_cols, matched, index, dc_code, log)
+        stage.rows_out = n
 
     # --- 5. EXPORT ---
-    final_df = pd.DataFrame(results)
-    output = io.BytesIO()
-    final_df.to_excel(output, index=False)
-    output.seek(0)
-    return output.read()
\ No newline at end of file
+    with timer.stage("write", rows_in=n) as stage:
+        log("Saving file...", 95)
+        result = engine.write(final_df, output_format, cancel)
+        stage.rows_out = len(final_df)
+    return timer.finish(result)
+
+def preview_shipment(invoice_df: pd.DataFrame, index: ShipmentIndex, dc_code: str, timer: PipelineTimer,
+                     preview_rows: int, log=quiet) -> PreviewResult:
+    """
+    Match + calculate on the sampled invoice lines, reported instead of written: resolved
+    columns of every input, how many lines Restock and the Order Forms found (per
+    supplier) and a few output rows. Missing invoice columns are reported, not raised.
+    """
+    inv_cols = {key: find_col(invoice_df, candidates) for key, candidates in index.settings.invoice_columns.items()}
+    report = {
+        "preview": True,
+        "sample_rows": preview_rows,
+        "rows": {"invoice": len(invoice_df), "restock": len(index.restock_df), "order": len(index.order_df)},
+        "columns": {"invoice": inv_cols, "restock": index.res_cols, "order": index.ord_cols},
+        "missing_invoice_columns": [key for key, col in inv_cols.items() if col is None],
+        "matches": {"restock": 0, "order_form": 0, "unmatched": len(invoice_df), "by_supplier": {}},
+        "upc": upc_reports(UpcReport(), index),
+        "sample": [],
+    }
+    if report["missing_invoice_columns"] or invoice_df.empty:
+        return timer.finish(PreviewResult(report))
+
+    with timer.stage("match", rows_in=len(invoice_df)) as stage:
+        matched = match_lines(invoice_df, inv_cols, index, log)
+        in_restock, in_order = matched['in_restock'], matched['in_order']
+        found = in_restock | in_order
+        per_supplier = pd.DataFrame({
+            'supplier': [str(v) for v in matched['suplier'][found]],
+            'source': np.where(in_restock[found], 'restock', 'order_form'),
+        }).groupby(['supplier', 'source']).size()
+        by_supplier = {}
+        for (supplier, source), count in per_supplier.items():
+            by_supplier.setdefault(supplier, {"restock": 0, "order_form": 0})[source] = int(count)
+        report["matches"] = {"restock": int(in_restock.sum()), "order_form": int(in_order.sum()),
+                             "unmatched": int((~found).sum()), "by_supplier": by_supplier}
+        report["upc"] = upc_reports(matched['inv_upcs'], index)
+        stage.rows_out = int(found.sum())
+
+    with timer.stage("allocate", rows_in=len(invoice_df)) as stage:
+        invoice_df, matched = allocate_lines(invoice_df, inv_cols, matched, index, log)
+        allocated = matched.get('allocated', np.full(len(invoice_df), np.nan))
+        report["allocation"] = {"mode": index.settings.allocation, "output_rows": len(invoice_df),
+                                "allocated_rows": int((~np.isnan(allocated)).sum())}
+        stage.rows_out = len(invoice_df)
+
+    with timer.stage("calculate", rows_in=len(invoice_df)) as stage:
+        final_df = calculate_lines(invoice_df, inv_cols, matched, index, dc_code, log)
+        report["sample"] = frame_records(final_df, PREVIEW_SAMPLE_OUTPUT)
+        stage.rows_out = len(final_df)
+    log("Preview ready", 100)
+    return timer.finish(PreviewResult(report))
+
+def warn_invalid_invoice_upcs(log, report: UpcReport, pct: int):
+    if report.invalid:
+        log(f"⚠️ {report.invalid} unreadable UPCs in invoice (e.g. {', '.join(report.samples[:3])})", pct)
+
+def upc_reports(invoice: UpcReport, index: ShipmentIndex) -> dict:
+    return {"invoice": invoice.to_dict(), "restock": index.res_upcs.to_dict(), "order": index.ord_upcs.to_dict()}
+
+def stream_shipment(invoice_file: FileSource, order_files: List[FileSource], restock_files: List[FileSource],
+                    dc_code: str, settings: ShipmentSettings, log, output_format: str, timer: PipelineTimer,
+                    restock_dataset: Optional[str] = None, order_dataset: Optional[str] = None) -> ExportedFile:
+    """Streaming mode: indexes first, then the invoice a chunk at a time straight into the output."""
+    with timer.stage("read") as stage:
+        index = read_indexes(restock_files, order_files, settings, log, restock_dataset, order_dataset)
+        index.warn_invalid_upcs(log, 45)
+        stage.rows_out = len(index.restock_df) + len(index.order_df)
+
+    with timer.stage("match") as stage:
+        log("Streaming the invoice through the matching...", 50)
+        inv_upcs = UpcReport()
+        stage.rows_in = matched_rows = 0
+        # An invoice without rows writes nothing: the old "no rows -> no columns" output
+        with ChunkedExport(output_format, timer.cancel) as out:
+            chunks = iter_column_chunks(invoice_file, settings.invoice_columns, chunk_rows=STREAM_CHUNK_ROWS)
+            for i, chunk in enumerate(chunks):
+                inv_cols = invoice_columns(chunk, settings)
+                if chunk.empty:
+                    continue
+                matched = match_lines(chunk, inv_cols, index)
+                inv_upcs.add(matched['inv_upcs'])
+                stage.rows_in += len(chunk)
+                matched_rows += int(matched['in_restock'].sum() + matched['in_order'].sum())
+                chunk, matched = allocate_lines(chunk, inv_cols, matched, index)
+                out.write(calculate_lines(chunk, inv_cols, matched, index, dc_code))
+                log(f"Matched {stage.rows_in} invoice lines ({matched_rows} found)...", 50 + min(i * 5, 45))
+        warn_invalid_invoice_upcs(log, inv_upcs, 95)
+        timer.reports["upc"] = upc_reports(inv_upcs, index)
+        stage.rows_out = matched_rows
+    return timer.finish(out.result)
+
+# --- BATCH: many (invoice, DC) pairs against one set of indexes ---
+BATCH_BUNDLES = ("sheets", "zip")
+SHEET_NAME_LIMIT = 31  # Excel's limit
+
+def check_bundle(bundle: str, output_format: str) -> str:
+    bundle = (bundle or "sheets").lower()
+    if bundle not in BATCH_BUNDLES:
+        raise ValueError(f"Unknown batch bundle '{bundle}' (Options: {list(BATCH_BUNDLES)})")
+    if bundle == "sheets" and output_format != "xlsx":
+        raise ValueError(f"A sheet per DC needs xlsx output, not '{output_format}' (use the zip bundle)")
+    return bundle
+
+def output_names(dc_codes: List[str]) -> List[str]:
+    """One sheet / file name per DC: Excel-safe, at most 31 characters, repeats numbered (DC1, DC1_2, ...)."""
+    names, seen = [], set()
+    for code in dc_codes:
+        base = re.sub(r'[\[\]:*?/\\]', '_', str(code)).strip("' ")[:SHEET_NAME_LIMIT] or "DC"
+        name, n = base, 1
+        while name.lower() in seen:
+            n += 1
+            suffix = f"_{n}"
+            name = base[:SHEET_NAME_LIMIT - len(suffix)] + suffix
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+def process_shipment_batch(
+    invoice_files: List[FileSource],
+    dc_codes: List[str],
+    order_files: List[FileSource],
+    restock_files: List[FileSource],
+    settings: ShipmentSettings,
+    callback=None,
+    output_format: str = "xlsx",
+    bundle: str = "sheets",
+    restock_dataset: Optional[str] = None,
+    order_dataset: Optional[str] = None,
+    cancel: Optional[CancelToken] = None
+) -> ExportedFile:
+    """
+    process_shipment_logic for many (invoice, dc_code) pairs at once. The restock / order
+    files are read and indexed ONCE; the invoices are parsed in the worker pool while
+    that happens, then each is matched against the shared index (vectorized, so a few
+    ms per invoice). `bundle="sheets"` gives one xlsx with a sheet per DC, `"zip"` one
+    file per DC (in `output_format`) inside a zip. Each sheet / file is exactly what
+    the single-invoice run would have produced. Reference datasets and `cancel` work
+    as in process_shipment_logic; invoices still waiting for a worker are dropped on cancel.
+    """
+    def log(msg, pct):
+        checkpoint(cancel)
+        if callback: callback(msg, pct)
+    output_format = check_format(output_format)
+    bundle = check_bundle(bundle, output_format)
+    check_allocation(settings.allocation)
+    if len(invoice_files) != len(dc_codes):
+        raise ValueError(f"Got {len(invoice_files)} invoices but {len(dc_codes)} DC codes (one per invoice)")
+    if not invoice_files:
+        raise ValueError("No invoices to process")
+    names = output_names(dc_codes)
+    timer = PipelineTimer("shipment_batch", cancel)
+
+    with timer.stage("read") as stage:
+        log(f"Reading {len(invoice_files)} invoices...", 10)
+        tag = cache_engine(settings.invoice_columns)
+        invoice_dfs = [parse_cache.get(parse_cache.key(source, tag)) for source in invoice_files]
+        with borrow_executor(log, cancel) as executor:
+            # Invoices parse in the pool while this thread reads and indexes restock / orders
+            futures = {executor.submit(engine.read, source, settings.invoice_columns): i
+                       for i, source in enumerate(invoice_files) if invoice_dfs[i] is None}
+            index = read_indexes(restock_files, order_files, settings, log, restock_dataset, order_dataset)
+            index.warn_invalid_upcs(log, 45)
+            for future in concurrent.futures.as_completed(futures):
+                checkpoint(cancel)
+                i = futures[future]
+                invoice_dfs[i] = future.result()
+                parse_cache.put(parse_cache.key(invoice_files[i], tag), invoice_dfs[i])
+        stage.rows_out = sum(len(df) for df in invoice_dfs) + len(index.restock_df) + len(index.order_df)
+
+    outputs = {}
+    reports = {}
+    with timer.stage("match", rows_in=sum(len(df) for df in invoice_dfs)) as stage:
+        stage.rows_out = 0
+        for i, (name, dc_code, invoice_df) in enumerate(zip(names, dc_codes, invoice_dfs)):
+            pct = 50 + int(i / len(names) * 40)  # 50% to 90%
+            try:
+                inv_cols = invoice_columns(invoice_df, settings)
+            except ValueError as e:
+                raise ValueError(f"DC {dc_code}: {e}")
+            if invoice_df.empty:
+                # Nothing to match; keep the old "no rows -> no columns" output
+                outputs[name] = pd.DataFrame([])
+                continue
+            log(f"Matching invoice for DC {dc_code} ({len(invoice_df)} lines)...", pct)
+            matched = match_lines(invoice_df, inv_cols, index)
+            warn_invalid_invoice_upcs(log, matched['inv_upcs'], pct)
+            reports[name] = matched['inv_upcs'].to_dict()
+            stage.rows_out += int(matched['in_restock'].sum() + matched['in_order'].sum())
+            invoice_df, matched = allocate_lines(invoice_df, inv_cols, matched, index)
+            outputs[name] = calculate_lines(invoice_df, inv_cols, matched, index, dc_code)
+        timer.reports["upc"] = {"invoices": reports, "restock": index.res_upcs.to_dict(), "order": index.ord_upcs.to_dict()}
+
+    with timer.stage("write", rows_in=sum(len(df) for df in outputs.values())) as stage:
+        log("Saving file...", 95)
+        result = export_sheets(outputs, cancel) if bundle == "sheets" else export_zip(outputs, output_format, cancel)
+        stage.rows_out = sum(len(df) for df in outputs.values())
+    return timer.finish(result)
@@ -0,0 +1,79 @@
+import os
+import pickle
+import hashlib
+import threading
+from typing import Any, Optional
+from app.config import RESTOCK_STATE_DIR, RESTOCK_STATE_MB
+
+# Bump when what gets stored changes shape, so old entries are simply never found
+STATE_VERSION = 2
+
+def state_key(*parts) -> str:
+    """Store key from anything with a stable repr (content digests, names, spec digests)."""
+    return hashlib.sha256(repr((STATE_VERSION,) + parts).encode()).hexdigest()
+
+class StateStore:
+    """
+    Small on-disk key -> object store (pickled) for the intermediate tables of earlier runs.
+    Writes are atomic; unreadable entries count as missing. Trimmed oldest-first
+    (by last access) to `max_bytes`.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._trim()
+
+    def _trim(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+restock_state = StateStore(RESTOCK_STATE_DIR, RESTOCK_STATE_MB * 1024 * 1024)
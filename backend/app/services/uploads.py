@@ -0,0 +1,60 @@
+import os
+import shutil
+import asyncio
+import tempfile
+from typing import List, Tuple
+from fastapi import UploadFile
+from app.config import UPLOAD_DIR, UPLOAD_CHUNK_SIZE
+from app.services.blobs import blob_store
+
+class SpooledUploads:
+    """
+    Per-request scratch directory. Uploads are copied to disk in chunks
+    (never fully in RAM) and the services get file paths instead of bytes.
+    Use as `async with SpooledUploads() as uploads:` so the files are removed afterwards.
+    """
+    def __init__(self):
+        self.directory = None
+        self.count = 0
+
+    async def __aenter__(self):
+        return self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def open(self):
+        """For owners that outlive the request (background jobs): call `close()` when done."""
+        self.directory = tempfile.mkdtemp(prefix="upload-", dir=UPLOAD_DIR)
+        return self
+
+    def close(self):
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    async def save(self, upload: UploadFile) -> str:
+        """Copies one upload to the scratch dir and returns its path."""
+        self.count += 1
+        name = os.path.basename(upload.filename or "upload.xlsx")
+        path = os.path.join(self.directory, f"{self.count:03d}_{name}")
+        await asyncio.to_thread(self._copy, upload, path)
+        return path
+
+    async def save_all(self, uploads: List[UploadFile]) -> List[str]:
+        return [await self.save(f) for f in uploads]
+
+    async def save_blob(self, blob_id: str, name: str) -> str:
+        """A blob from the content store (uploaded earlier) into the scratch dir, as if uploaded now."""
+        self.count += 1
+        path = os.path.join(self.directory, f"{self.count:03d}_{os.path.basename(name) or 'upload.xlsx'}")
+        return await asyncio.to_thread(blob_store.link, blob_id, path)
+
+    async def save_blobs(self, refs: List[Tuple[str, str]]) -> List[str]:
+        return [await self.save_blob(blob_id, name) for blob_id, name in refs]
+
+    @staticmethod
+    def _copy(upload: UploadFile, path: str):
+        upload.file.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(upload.file, out, UPLOAD_CHUNK_SIZE)
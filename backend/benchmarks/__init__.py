@@ -0,0 +1 @@
+"""Synthetic-data benchmarks for the restock and shipment pipelines (see run.py)."""
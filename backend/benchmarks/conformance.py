@@ -0,0 +1,185 @@
+"""
+Conformance suite for the compute engines (app/services/engines.py): every engine must
+answer the raw operations exactly like pandas (edge cases included) and give the same
+restock and shipment outputs, byte for byte, on synthetic workbooks.
+
+    python -m benchmarks.conformance
+    python -m benchmarks.conformance --engines pandas polars --scale medium
+
+Each engine runs the pipelines in its own process (COMPUTE_ENGINE=<name>), exactly as
+the server would with that setting. Exits 1 on any difference.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.engines import COMPUTE_ENGINES
+from benchmarks.generate import generate_restock, generate_shipment
+from benchmarks.run import SCALES, cold_cache
+
+# (pipeline, output format, streaming): every path that goes through the engine
+RUNS = [
+    ("restock", "xlsx", False),
+    ("restock", "csv", False),
+    ("restock", "csv", True),
+    ("shipment", "xlsx", False),
+    ("shipment", "csv", False),
+    ("shipment", "csv", True),
+]
+
+def installed_engines() -> list:
+    names = []
+    for name, cls in COMPUTE_ENGINES.items():
+        try:
+            cls()
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+# --- OPERATIONS ---
+def op_cases(seed: int):
+    """(name, args) for every operation: random data plus the shapes that tend to break."""
+    rng = np.random.default_rng(seed)
+    empty = np.array([], dtype=np.int64)
+    keys = rng.integers(-1, 200, 5000)  # -1 is INVALID_UPC: repeated, like real unreadable cells
+    lookup = rng.integers(-1, 200, 3000)
+    for a, b in ((keys, lookup), (keys, empty), (empty, lookup), (empty, empty), (keys, keys[:1])):
+        yield "is_in", (a, b)
+        yield "match", (a, b, "first")
+        yield "match", (a, b, "last")
+        yield "match_all", (a, b)
+    groups = rng.integers(0, 300, 5000)
+    prices = np.round(rng.uniform(0, 10, 5000), 1)  # coarse, so ties happen
+    prices[rng.uniform(size=5000) < 0.2] = np.nan
+    all_nan = np.full(5000, np.nan)
+    for values in (prices, all_nan, rng.integers(0, 20, 5000), np.where(prices > 5, groups, np.nan)):
+        yield "group_min", (groups, values)
+    yield "group_min", (empty, np.array([], dtype=float))
+
+def same_array(a: np.ndarray, b: np.ndarray) -> bool:
+    if a.shape != b.shape or a.dtype.kind != b.dtype.kind:
+        return False
+    return bool(np.array_equal(a, b, equal_nan=a.dtype.kind == "f"))
+
+def check_operations(engines: list, seed: int) -> list:
+    reference = COMPUTE_ENGINES["pandas"]()
+    failures = []
+    for name in engines:
+        engine = COMPUTE_ENGINES[name]()
+        for i, (op, args) in enumerate(op_cases(seed)):
+            expected = getattr(reference, op)(*args)
+            got = getattr(engine, op)(*args)
+            if isinstance(expected, tuple):
+                same = len(expected) == len(got) and all(same_array(e, g) for e, g in zip(expected, got))
+            else:
+                same = same_array(np.asarray(expected), np.asarray(got))
+            if not same:
+                failures.append(f"{name}: {op} case {i} differs from pandas")
+    return failures
+
+# --- PIPELINES ---
+def run_pipelines(jobs: list):
+    """Worker side (COMPUTE_ENGINE already set): runs each job and keeps its output file."""
+    from app.services.restock import process_restock_logic
+    from app.services.shipment import process_shipment_logic
+    with cold_cache():
+        for job in jobs:
+            if job["pipeline"] == "restock":
+                result = process_restock_logic(settings=RestockSettings(), output_format=job["format"],
+                                               streaming=job["streaming"], **job["files"])
+            else:
+                result = process_shipment_logic(settings=ShipmentSettings(), output_format=job["format"],
+                                                streaming=job["streaming"], **job["files"])
+            shutil.move(result.path, job["out"])
+
+def read_output(path: str, fmt: str):
+    if fmt == "csv":
+        with open(path, "rb") as f:
+            return f.read()
+    return pd.read_excel(path)  # xlsx bytes carry a timestamp; compare the cells
+
+def check_pipelines(engines: list, args, workdir: str) -> list:
+    files = {
+        "restock": generate_restock(workdir, **dict(SCALES[args.scale]["restock"], vary_aliases=True, seed=args.seed)),
+        "shipment": generate_shipment(workdir, **dict(SCALES[args.scale]["shipment"], seed=args.seed)),
+    }
+    outputs = {}
+    for name in engines:
+        jobs = [{"pipeline": pipeline, "format": fmt, "streaming": streaming, "files": files[pipeline],
+                 "out": os.path.join(workdir, f"{name}-{pipeline}-{fmt}-{int(streaming)}.{fmt}")}
+                for pipeline, fmt, streaming in RUNS]
+        spec = os.path.join(workdir, f"{name}-jobs.json")
+        with open(spec, "w") as f:
+            json.dump(jobs, f)
+        env = dict(os.environ, COMPUTE_ENGINE=name)
+        subprocess.run([sys.executable, "-m", "benchmarks.conformance", "--worker", spec], env=env, check=True)
+        outputs[name] = [read_output(job["out"], job["format"]) for job in jobs]
+
+    failures = []
+    reference = outputs[engines[0]]
+    for name in engines[1:]:
+        for (pipeline, fmt, streaming), expected, got in zip(RUNS, reference, outputs[name]):
+            what = f"{pipeline} {fmt}{' streaming' if streaming else ''}"
+            if isinstance(expected, bytes):
+                same = expected == got
+            else:
+                try:
+                    pd.testing.assert_frame_equal(expected, got)
+                    same = True
+                except AssertionError:
+                    same = False
+            if not same:
+                failures.append(f"{name}: {what} output differs from {engines[0]}")
+    return failures
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks.conformance", description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--engines", nargs="+", help="engines to compare (default: every installed one)")
+    p.add_argument("--scale", choices=list(SCALES), default="small")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workdir", default=None, help="where to write the generated workbooks")
+    p.add_argument("--worker", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.worker:
+        with open(args.worker) as f:
+            run_pipelines(json.load(f))
+        return 0
+
+    engines = args.engines or installed_engines()
+    unknown = [name for name in engines if name not in COMPUTE_ENGINES]
+    if unknown:
+        print(f"Unknown engines: {unknown} (Options: {list(COMPUTE_ENGINES)})")
+        return 2
+    # pandas is the reference everything is held to
+    engines = ["pandas"] + [name for name in engines if name != "pandas"]
+    print(f"Engines: {', '.join(engines)}")
+
+    failures = check_operations(engines, args.seed)
+    print(f"Operations: {'OK' if not failures else f'{len(failures)} failures'}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="conformance-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        pipeline_failures = check_pipelines(engines, args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Pipelines ({len(RUNS)} runs per engine): {'OK' if not pipeline_failures else f'{len(pipeline_failures)} failures'}")
+
+    for failure in failures + pipeline_failures:
+        print(f"FAIL {failure}")
+    return 1 if failures or pipeline_failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Synthetic workbook generators for the restock and shipment pipelines.
+Everything is seeded, so the same parameters always give the same files.
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.export import write_xlsx
+
+UPC_BASE = 100000000000
+
+class Aliases:
+    """Picks a header for each logical column: the first alias, or a random one per file."""
+    def __init__(self, mappings: Dict[str, List[str]], rng: np.random.Generator, vary: bool):
+        self.mappings = mappings
+        self.rng = rng
+        self.vary = vary
+
+    def __call__(self, key: str) -> str:
+        options = self.mappings[key]
+        return options[self.rng.integers(len(options))] if self.vary else options[0]
+
+def save(df: pd.DataFrame, directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    write_xlsx(df, path)
+    return path
+
+def filler_columns(rng: np.random.Generator, rows: int, count: int) -> Dict[str, np.ndarray]:
+    """Columns nobody reads (real supplier files carry dozens of these)."""
+    return {f"Extra {i}": rng.integers(0, 1000, rows) for i in range(count)}
+
+def split_rows(df: pd.DataFrame, parts: int) -> List[pd.DataFrame]:
+    bounds = np.linspace(0, len(df), max(parts, 1) + 1).astype(int)
+    return [df.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+def pk_values(rng: np.random.Generator, rows: int) -> np.ndarray:
+    return rng.choice(np.array([1, 2, 3, 6, "2PK", "PK6", "12 PK"], dtype=object), rows)
+
+# --- RESTOCK ---
+def generate_restock(
+    directory: str,
+    suppliers: int = 5,
+    ham_rows: int = 5000,
+    export_ratio: float = 0.6,
+    overlap: float = 0.3,
+    master_rows: int = 20000,
+    master_hit_ratio: float = 0.5,
+    extra_columns: int = 10,
+    vary_aliases: bool = False,
+    seed: int = 0
+) -> dict:
+    """
+    Writes `suppliers` Ham/Export pairs and one restock master into `directory`.
+    - export_ratio: share of each Ham file's UPCs that have stock in its Export file
+    - overlap: share of each Ham file's UPCs drawn from a pool common to all suppliers
+      (these are what the price war fights over)
+    - master_hit_ratio: share of master rows whose UPC is carried by some supplier
+    Returns the keyword arguments for process_restock_logic (paths + names).
+    """
+    rng = np.random.default_rng(seed)
+    alias = Aliases(RestockSettings().column_mappings, rng, vary_aliases)
+    shared = UPC_BASE + np.arange(ham_rows)
+    next_upc = UPC_BASE + ham_rows
+
+    ham_files, ham_names, export_files, export_names = [], [], [], []
+    all_upcs = []
+    for s in range(suppliers):
+        code = f"{s + 1:02d}"
+        n_shared = int(ham_rows * overlap)
+        own = next_upc + np.arange(ham_rows - n_shared)
+        next_upc += len(own)
+        upcs = np.concatenate([rng.choice(shared, n_shared, replace=False), own])
+        rng.shuffle(upcs)
+        all_upcs.append(upcs)
+
+        ham = pd.DataFrame({
+            alias("upc"): upcs,
+            alias("brand"): rng.choice(["ACME", "GLOBEX", "INITECH", "UMBRELLA"], len(upcs)),
+            alias("price"): np.round(rng.uniform(0.5, 40, len(upcs)), 2),
+            alias("case"): rng.choice([1, 6, 12, 24], len(upcs)),
+            **filler_columns(rng, len(upcs), extra_columns),
+        })
+        in_stock = rng.choice(upcs, int(len(upcs) * export_ratio), replace=False)
+        export = pd.DataFrame({
+            alias("upc"): in_stock,
+            alias("quantity"): rng.integers(0, 500, len(in_stock)),
+        })
+        ham_names.append(f"{code}-ham.xlsx")
+        export_names.append(f"{code}-export.xlsx")
+        ham_files.append(save(ham, directory, ham_names[-1]))
+        export_files.append(save(export, directory, export_names[-1]))
+
+    carried = np.concatenate(all_upcs) if all_upcs else np.array([], dtype=np.int64)
+    hits = int(master_rows * master_hit_ratio) if len(carried) else 0
+    master_upcs = np.concatenate([
+        rng.choice(carried, hits) if hits else np.array([], dtype=np.int64),
+        next_upc + np.arange(master_rows - hits),
+    ])
+    rng.shuffle(master_upcs)
+    master = pd.DataFrame({
+        alias("upc"): master_upcs,
+        alias("pk"): pk_values(rng, master_rows),
+        "Title": [f"Item {i}" for i in range(master_rows)],
+        **filler_columns(rng, master_rows, extra_columns),
+    })
+
+    return {
+        "ham_files": ham_files, "ham_filenames": ham_names,
+        "export_files": export_files, "export_filenames": export_names,
+        "restock_file": save(master, directory, "restock-master.xlsx"),
+    }
+
+# --- SHIPMENT ---
+def generate_shipment(
+    directory: str,
+    invoice_rows: int = 5000,
+    restock_rows: int = 20000,
+    order_rows: int = 50000,
+    restock_files: int = 1,
+    order_files: int = 2,
+    restock_hit_ratio: float = 0.3,
+    order_hit_ratio: float = 0.5,
+    rows_per_order_upc: int = 2,
+    extra_columns: int = 10,
+    seed: int = 0
+) -> dict:
+    """
+    Writes an invoice, `restock_files` restock outputs and `order_files` order forms.
+    - restock_hit_ratio / order_hit_ratio: share of invoice UPCs found in each source
+    - rows_per_order_upc: how many order-form rows repeat each UPC (the PCS ratio math)
+    Returns the keyword arguments for process_shipment_logic (paths + dc_code).
+    """
+    rng = np.random.default_rng(seed)
+    settings = ShipmentSettings()
+    inv_cols = {k: v[0] for k, v in settings.invoice_columns.items()}
+    res_cols = {k: v[0] for k, v in settings.restock_columns.items()}
+    ord_cols = {k: v[0] for k, v in settings.order_columns.items() if k not in ("asin", "sku")}
+
+    invoice_upcs = UPC_BASE + rng.permutation(invoice_rows * 2)[:invoice_rows]
+    invoice = pd.DataFrame({
+        inv_cols["shipquantity"]: rng.integers(1, 200, invoice_rows),
+        inv_cols["upc"]: invoice_upcs,
+        inv_cols["price"]: np.round(rng.uniform(0.5, 40, invoice_rows), 2),
+        inv_cols["packsize"]: rng.choice(["1", "6", "12"], invoice_rows),
+        inv_cols["brand"]: rng.choice(["ACME", "GLOBEX", "INITECH"], invoice_rows),
+        inv_cols["description"]: [f"Item {i}" for i in range(invoice_rows)],
+    })
+
+    def pick_upcs(rows: int, hit_ratio: float) -> np.ndarray:
+        hits = min(int(rows * hit_ratio), invoice_rows)
+        misses = UPC_BASE + invoice_rows * 2 + rng.integers(0, 10 ** 6, rows - hits)
+        upcs = np.concatenate([rng.choice(invoice_upcs, hits, replace=False), misses])
+        rng.shuffle(upcs)
+        return upcs
+
+    restock_upcs = pick_upcs(restock_rows, restock_hit_ratio * invoice_rows / max(restock_rows, 1))
+    restock = pd.DataFrame({
+        res_cols["upc"]: restock_upcs,
+        res_cols["pcs"]: rng.integers(1, 50, restock_rows),
+        res_cols["asin"]: [f"B0{x:08d}" for x in rng.integers(0, 10 ** 8, restock_rows)],
+        res_cols["pk"]: pk_values(rng, restock_rows),
+        res_cols["price"]: np.round(rng.uniform(0.5, 40, restock_rows), 2),
+        res_cols["suplier"]: rng.choice(["41", "45", "27"], restock_rows),
+        **filler_columns(rng, restock_rows, extra_columns),
+    })
+
+    unique_rows = max(order_rows // max(rows_per_order_upc, 1), 1)
+    order_upcs = np.repeat(pick_upcs(unique_rows, order_hit_ratio * invoice_rows / unique_rows), rows_per_order_upc)[:order_rows]
+    n = len(order_upcs)
+    order = {ord_cols["upc"]: order_upcs, ord_cols["pcs"]: rng.integers(0, 20, n)}
+    for i, (asin_col, sku_col) in enumerate(zip(settings.order_columns["asin"], settings.order_columns["sku"])):
+        # Later ASIN columns are filled less often, so the priority pick has work to do
+        filled = rng.random(n) < 0.8 / (i + 1)
+        order[asin_col] = np.where(filled, [f"B{i}{x:08d}" for x in rng.integers(0, 10 ** 8, n)], None)
+        order[sku_col] = np.where(filled, [f"SKU-{i}-{x}" for x in rng.integers(0, 10 ** 6, n)], None)
+    order[ord_cols["pk"]] = pk_values(rng, n)
+    order[ord_cols["price"]] = np.round(rng.uniform(0.5, 40, n), 2)
+    order[ord_cols["suplier"]] = rng.choice(["41", "45", "27"], n)
+    order = pd.DataFrame({**order, **filler_columns(rng, n, extra_columns)})
+
+    return {
+        "invoice_file": save(invoice, directory, "invoice.xlsx"),
+        "restock_files": [save(part, directory, f"restock-{i}.xlsx")
+                          for i, part in enumerate(split_rows(restock, restock_files))],
+        "order_files": [save(part, directory, f"order-{i}.xlsx")
+                        for i, part in enumerate(split_rows(order, order_files))],
+        "dc_code": "DC1",
+    }
@@ -0,0 +1,333 @@
+"""
+Load test: concurrent /api/restock and /api/shipment calls on synthetic workbooks, each
+with its own progress WebSocket (client_id), against the app in this process or a
+running server.
+
+    python -m benchmarks.load --concurrency 1 4 8 --requests 16
+    uvicorn app.main:app &
+    python -m benchmarks.load --url http://127.0.0.1:8000 --server-pid $! --pipeline shipment
+
+For every concurrency level: request latency p50/p95/p99, throughput, progress message
+delivery lag (server `sent_at` -> socket, p50/p95/p99) and peak RSS of the server
+process plus its workers. In-process runs go through the app's lifespan (shared worker
+pool, job scheduler, heartbeats) on one event loop, like one uvicorn worker, with the
+parse cache off unless --warm-cache. Against a URL, sockets need the `websockets`
+package (requirements-dev.txt) and the memory figure needs --server-pid.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import tempfile
+import threading
+import concurrent.futures
+from contextlib import ExitStack
+import numpy as np
+from app.schemas import RestockSettings, ShipmentSettings
+from benchmarks.generate import generate_restock, generate_shipment
+from benchmarks.run import SCALES, cold_cache
+
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # only needed with --url
+    ws_connect = None
+
+# After the response, how long to wait for the closing progress message
+FINAL_MESSAGE_WAIT = 5.0
+
+# --- WORKLOAD ---
+class Job:
+    """One request: the route, its multipart files (bytes read once) and form fields."""
+    def __init__(self, pipeline: str, path: str, files: list, data: dict):
+        self.pipeline = pipeline
+        self.path = path
+        self.files = files
+        self.data = data
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def make_jobs(pipelines: list, scale: str, seed: int, workdir: str) -> list:
+    jobs = []
+    if "restock" in pipelines:
+        f = generate_restock(workdir, **dict(SCALES[scale]["restock"], seed=seed))
+        files = [("ham_files", (name, read_bytes(p))) for p, name in zip(f["ham_files"], f["ham_filenames"])]
+        files += [("export_files", (name, read_bytes(p))) for p, name in zip(f["export_files"], f["export_filenames"])]
+        files.append(("restock_file", ("restock-master.xlsx", read_bytes(f["restock_file"]))))
+        jobs.append(Job("restock", "/api/restock", files, {"settings_str": RestockSettings().model_dump_json()}))
+    if "shipment" in pipelines:
+        f = generate_shipment(workdir, **dict(SCALES[scale]["shipment"], seed=seed))
+        files = [("invoice_file", ("invoice.xlsx", read_bytes(f["invoice_file"])))]
+        files += [("restock_files", (os.path.basename(p), read_bytes(p))) for p in f["restock_files"]]
+        files += [("order_files", (os.path.basename(p), read_bytes(p))) for p in f["order_files"]]
+        jobs.append(Job("shipment", "/api/shipment", files,
+                        {"settings_str": ShipmentSettings().model_dump_json(), "dc_code": "DC1"}))
+    return jobs
+
+# --- DRIVERS ---
+class InProcess:
+    """The ASGI app in this process through Starlette's TestClient (lifespan included)."""
+    def __init__(self):
+        from fastapi.testclient import TestClient
+        from app.main import app
+        self.client = TestClient(app)
+        self.pid = os.getpid()
+
+    def __enter__(self):
+        self.client.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self.client.__exit__(*exc)
+
+    def post(self, path: str, files: list, data: dict) -> tuple:
+        response = self.client.post(path, files=files, data=data)
+        return response.status_code, len(response.content)
+
+    def socket(self, client_id: str):
+        return TestSocket(self.client.websocket_connect(f"/ws/{client_id}"))
+
+class TestSocket:
+    def __init__(self, session):
+        self.session = session.__enter__()
+
+    def receive(self) -> dict:
+        return self.session.receive_json()
+
+    def send(self, text: str):
+        self.session.send_text(text)
+
+    def close(self):
+        try:
+            self.session.__exit__(None, None, None)
+        except Exception:
+            pass
+
+class Remote:
+    """A running server (uvicorn app.main:app) over HTTP / WebSocket."""
+    def __init__(self, url: str, pid: int = None, timeout: float = 600):
+        import httpx
+        self.client = httpx.Client(base_url=url, timeout=timeout)
+        self.ws_url = "ws" + url[len("http"):] if url.startswith("http") else url
+        self.pid = pid
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.client.close()
+
+    def post(self, path: str, files: list, data: dict) -> tuple:
+        response = self.client.post(path, files=files, data=data)
+        return response.status_code, len(response.content)
+
+    def socket(self, client_id: str):
+        if ws_connect is None:
+            return None
+        return RemoteSocket(ws_connect(f"{self.ws_url.rstrip('/')}/ws/{client_id}"))
+
+class RemoteSocket:
+    def __init__(self, connect):
+        self.connect = connect
+        self.connection = connect.__enter__()
+
+    def receive(self) -> dict:
+        return json.loads(self.connection.recv())
+
+    def send(self, text: str):
+        self.connection.send(text)
+
+    def close(self):
+        self.connect.__exit__(None, None, None)
+
+# --- MEASURING ---
+def process_tree_rss(pid: int) -> int:
+    """RSS bytes of `pid` and all its descendants (Linux /proc); 0 if unreadable."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+class MemorySampler:
+    """Peak RSS of the server process tree, sampled every `interval` seconds while running."""
+    def __init__(self, pid: int = None, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.pid and os.path.isdir(f"/proc/{self.pid}"):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 2 ** 20, 1) if self._thread else None
+
+def one_request(driver, job: Job) -> dict:
+    """POSTs `job` with its own client_id socket open; answers heartbeats like the frontend."""
+    client_id = uuid.uuid4().hex
+    lags, messages = [], []
+    finished = threading.Event()
+    socket = driver.socket(client_id)
+
+    def read_progress():
+        try:
+            while True:
+                payload = socket.receive()
+                if payload.get("type") == "heartbeat":
+                    socket.send("pong")
+                    continue
+                if "sent_at" in payload:
+                    lags.append(time.time() - payload["sent_at"])
+                messages.append(payload.get("message", ""))
+                if str(payload.get("message", "")).startswith(("✅", "❌")):
+                    break
+        except Exception:
+            pass  # socket closed
+        finally:
+            finished.set()
+
+    if socket is not None:
+        threading.Thread(target=read_progress, daemon=True).start()
+    started = time.perf_counter()
+    try:
+        status, size = driver.post(job.path, job.files, dict(job.data, client_id=client_id))
+    except Exception as e:
+        status, size = f"{type(e).__name__}: {e}", 0
+    latency = time.perf_counter() - started
+    if socket is not None:
+        finished.wait(FINAL_MESSAGE_WAIT)
+        socket.close()
+    return {"pipeline": job.pipeline, "status": status, "bytes": size, "latency": latency,
+            "lags": lags, "messages": len(messages)}
+
+def percentiles(values: list, scale: float = 1.0) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * scale
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "max": round(float(max(values)) * scale, 3)}
+
+def run_level(driver, jobs: list, concurrency: int, requests: int) -> dict:
+    """`requests` calls (cycling through `jobs`) with `concurrency` of them in flight at a time."""
+    with MemorySampler(driver.pid) as memory:
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda i: one_request(driver, jobs[i % len(jobs)]), range(requests)))
+        wall = time.perf_counter() - started
+
+    ok = [r for r in results if r["status"] == 200]
+    lags = [lag for r in results for lag in r["lags"]]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(results) - len(ok),
+        "error_samples": sorted({str(r["status"]) for r in results if r["status"] != 200})[:3],
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "latency_s": percentiles([r["latency"] for r in ok]),
+        "latency_by_pipeline_s": {job.pipeline: percentiles([r["latency"] for r in ok if r["pipeline"] == job.pipeline])
+                                  for job in jobs},
+        "progress_messages": sum(r["messages"] for r in results),
+        "progress_lag_ms": percentiles(lags, 1000),
+        "peak_rss_mb": memory.peak_mb,
+    }
+
+def print_level(level: dict):
+    lat, lag = level["latency_s"], level["progress_lag_ms"]
+    print(f"concurrency {level['concurrency']:>3}: {level['requests']} requests, {level['errors']} errors, "
+          f"{level['throughput_rps']} req/s, peak RSS {level['peak_rss_mb']} MB")
+    print(f"  latency s      p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    for pipeline, by in level["latency_by_pipeline_s"].items():
+        print(f"    {pipeline:<10}   p50 {by['p50']}  p95 {by['p95']}  p99 {by['p99']}")
+    print(f"  progress lag ms  p50 {lag['p50']}  p95 {lag['p95']}  p99 {lag['p99']}  max {lag['max']}"
+          f"  ({level['progress_messages']} messages)")
+    for sample in level["error_samples"]:
+        print(f"  error: {sample}")
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks.load", description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--pipeline", choices=["restock", "shipment", "mixed"], default="mixed")
+    p.add_argument("--scale", choices=list(SCALES), default="small")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--requests", type=int, default=None, help="requests per level (default: 2 x concurrency)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--warm-cache", action="store_true", help="let repeated uploads hit the parse cache (in-process)")
+    p.add_argument("--url", help="test a running server instead of the app in this process")
+    p.add_argument("--server-pid", type=int, help="with --url: server pid, for peak memory")
+    p.add_argument("--timeout", type=float, default=600, help="with --url: per-request timeout (s)")
+    p.add_argument("--workdir", default=None, help="where to write the generated workbooks")
+    p.add_argument("--save", help="write the results as JSON")
+    return p.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    pipelines = ["restock", "shipment"] if args.pipeline == "mixed" else [args.pipeline]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="load-")
+    os.makedirs(workdir, exist_ok=True)
+    jobs = make_jobs(pipelines, args.scale, args.seed, workdir)
+
+    if args.url and ws_connect is None:
+        print("(websockets is not installed: no progress sockets, lag not measured)")
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "target": args.url or "in-process",
+            "pipelines": pipelines,
+            "scale": args.scale,
+            "warm_cache": args.warm_cache,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "levels": [],
+    }
+    with ExitStack() as stack:
+        if args.url:
+            driver = stack.enter_context(Remote(args.url, args.server_pid, args.timeout))
+        else:
+            if not args.warm_cache:
+                stack.enter_context(cold_cache())
+            driver = stack.enter_context(InProcess())
+        for concurrency in args.concurrency:
+            level = run_level(driver, jobs, concurrency, args.requests or 2 * concurrency)
+            report["levels"].append(level)
+            print_level(level)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {args.save}")
+    return 1 if any(level["errors"] for level in report["levels"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
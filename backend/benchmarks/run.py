@@ -0,0 +1,283 @@
+"""
+Times the restock and shipment pipelines stage by stage on synthetic workbooks.
+
+    python -m benchmarks --scale medium --save baseline.json
+    python -m benchmarks --scale medium --compare baseline.json
+
+Stage timings are the pipelines' own PipelineTimer records (the same numbers
+/metrics shows); the tracemalloc pass splits on their progress messages.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.restock import process_restock_logic
+from app.services.shipment import process_shipment_logic
+from app.services.cache import parse_cache
+from benchmarks.generate import generate_restock, generate_shipment
+
+# progress percent where each stage starts (same numbers the pipelines log), for the memory pass
+STAGES = {
+    "restock": [(0, "read"), (45, "match"), (70, "price_war"), (85, "master_merge"), (95, "write")],
+    "shipment": [(0, "read"), (50, "match"), (78, "allocate"), (80, "calculate"), (95, "write")],
+}
+
+SCALES = {
+    "small": {
+        "restock": {"suppliers": 3, "ham_rows": 2000, "master_rows": 5000},
+        "shipment": {"invoice_rows": 1000, "restock_rows": 5000, "order_rows": 10000},
+    },
+    "medium": {
+        "restock": {"suppliers": 10, "ham_rows": 10000, "master_rows": 50000},
+        "shipment": {"invoice_rows": 10000, "restock_rows": 50000, "order_rows": 100000},
+    },
+    "large": {
+        "restock": {"suppliers": 30, "ham_rows": 50000, "master_rows": 500000},
+        "shipment": {"invoice_rows": 20000, "restock_rows": 100000, "order_rows": 100000},
+    },
+}
+
+# Regressions smaller than this (seconds) are treated as noise
+NOISE_FLOOR = 0.05
+
+def stage_of(pipeline: str, percent: int) -> str:
+    name = STAGES[pipeline][0][1]
+    for start, stage in STAGES[pipeline]:
+        if percent >= start:
+            name = stage
+    return name
+
+@contextmanager
+def cold_cache():
+    """Every run parses from scratch unless --warm-cache is given."""
+    max_bytes, directory = parse_cache.max_bytes, parse_cache.directory
+    parse_cache.clear()
+    parse_cache.max_bytes, parse_cache.directory = 0, None
+    try:
+        yield
+    finally:
+        parse_cache.max_bytes, parse_cache.directory = max_bytes, directory
+
+class StageClock:
+    """The pipeline callback: resets the tracemalloc peak at every stage change."""
+    def __init__(self, pipeline: str, trace_memory: bool = False):
+        self.pipeline = pipeline
+        self.trace_memory = trace_memory
+        self.marks = []  # stages seen, in order
+        self.peaks = {}  # stage -> peak traced bytes
+
+    def __call__(self, message: str, percent: int):
+        stage = stage_of(self.pipeline, percent)
+        if self.marks and self.marks[-1] == stage:
+            return
+        self.close()
+        self.marks.append(stage)
+
+    def close(self):
+        if self.trace_memory and self.marks:
+            stage = self.marks[-1]
+            self.peaks[stage] = max(self.peaks.get(stage, 0), tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+def run_once(pipeline: str, files: dict, trace_memory: bool = False, streaming: bool = False) -> dict:
+    clock = StageClock(pipeline, trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    if pipeline == "restock":
+        result = process_restock_logic(settings=RestockSettings(), callback=clock, streaming=streaming, **files)
+    else:
+        result = process_shipment_logic(settings=ShipmentSettings(), callback=clock, streaming=streaming, **files)
+    finished = time.perf_counter()
+    cpu = time.process_time() - cpu_started
+    clock.close()
+    if trace_memory:
+        tracemalloc.stop()
+    output_bytes = os.path.getsize(result.path)
+    result.cleanup()
+    return {
+        "total": finished - started,
+        "cpu": cpu,
+        "stages": {s["stage"]: s["wall_s"] for s in result.stats["stages"]},
+        "rows_out": {s["stage"]: s["rows_out"] for s in result.stats["stages"]},
+        "peak_traced_mb": {k: round(v / 2 ** 20, 1) for k, v in clock.peaks.items()},
+        "output_bytes": output_bytes,
+    }
+
+def max_rss_mb() -> dict:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "parent": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20, 1),
+        "workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20, 1),
+    }
+
+def summarize(runs: list) -> dict:
+    stages = list(dict.fromkeys(s for r in runs for s in r["stages"]))  # pipeline order
+    summary = {
+        "total": {"median": statistics.median(r["total"] for r in runs), "min": min(r["total"] for r in runs)},
+        "cpu": {"median": statistics.median(r["cpu"] for r in runs)},
+        "stages": {},
+    }
+    for stage in stages:
+        values = [r["stages"].get(stage, 0.0) for r in runs]
+        summary["stages"][stage] = {"median": statistics.median(values), "min": min(values)}
+    return summary
+
+def bench(pipeline: str, params: dict, repeat: int, warm_cache: bool, memory: bool, workdir: str,
+          streaming: bool = False) -> dict:
+    directory = tempfile.mkdtemp(prefix=f"bench-{pipeline}-", dir=workdir)
+    try:
+        generate = generate_restock if pipeline == "restock" else generate_shipment
+        started = time.perf_counter()
+        files = generate(directory, **params)
+        generated_in = time.perf_counter() - started
+
+        runs = []
+        for _ in range(repeat):
+            if warm_cache:
+                runs.append(run_once(pipeline, files, streaming=streaming))
+            else:
+                with cold_cache():
+                    runs.append(run_once(pipeline, files, streaming=streaming))
+        result = {"params": params, "generate_seconds": generated_in, "runs": runs, **summarize(runs)}
+
+        if memory:
+            # Separate pass: tracemalloc slows Python code down too much to share with timing
+            with cold_cache():
+                result["peak_traced_mb"] = run_once(pipeline, files, trace_memory=True, streaming=streaming)["peak_traced_mb"]
+        result["max_rss_mb"] = max_rss_mb()
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Returns (pipeline, stage, baseline_s, current_s) rows that got slower than allowed."""
+    regressions = []
+    for pipeline, result in current["results"].items():
+        base = baseline.get("results", {}).get(pipeline)
+        if not base:
+            continue
+        pairs = [("total", base["total"]["median"], result["total"]["median"])]
+        for stage, timing in result["stages"].items():
+            if stage in base["stages"]:
+                pairs.append((stage, base["stages"][stage]["median"], timing["median"]))
+        for stage, old, new in pairs:
+            if new > old * (1 + threshold) and new - old > NOISE_FLOOR:
+                regressions.append((pipeline, stage, old, new))
+    return regressions
+
+def print_report(report: dict, baseline: dict = None):
+    for pipeline, result in report["results"].items():
+        base = (baseline or {}).get("results", {}).get(pipeline)
+        print(f"\n== {pipeline} ({', '.join(f'{k}={v}' for k, v in result['params'].items())})")
+        rows = [("total", result["total"]["median"], base and base["total"]["median"])]
+        rows += [(stage, t["median"], base and base["stages"].get(stage, {}).get("median"))
+                 for stage, t in result["stages"].items()]
+        for stage, seconds, old in rows:
+            line = f"  {stage:<14}{seconds:9.3f}s"
+            if old:
+                line += f"   baseline {old:8.3f}s  ({(seconds / old - 1) * 100:+.0f}%)"
+            peak = result.get("peak_traced_mb", {}).get(stage)
+            if peak is not None:
+                line += f"   peak {peak} MB"
+            print(line)
+        print(f"  max RSS: {result['max_rss_mb']}")
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--pipeline", choices=["restock", "shipment", "all"], default="all")
+    p.add_argument("--scale", choices=list(SCALES), default="small")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--warm-cache", action="store_true", help="let repeats hit the parse cache")
+    p.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    p.add_argument("--streaming", action="store_true", help="stream the master / invoice in chunks")
+    p.add_argument("--workdir", default=None, help="where to write the generated workbooks")
+    p.add_argument("--save", help="write the results as a JSON baseline")
+    p.add_argument("--compare", help="baseline JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+
+    restock = p.add_argument_group("restock data")
+    restock.add_argument("--suppliers", type=int)
+    restock.add_argument("--ham-rows", type=int)
+    restock.add_argument("--export-ratio", type=float)
+    restock.add_argument("--overlap", type=float)
+    restock.add_argument("--master-rows", type=int)
+    restock.add_argument("--master-hit-ratio", type=float)
+    restock.add_argument("--vary-aliases", action="store_true", default=None)
+
+    shipment = p.add_argument_group("shipment data")
+    shipment.add_argument("--invoice-rows", type=int)
+    shipment.add_argument("--restock-rows", type=int)
+    shipment.add_argument("--order-rows", type=int)
+    shipment.add_argument("--restock-files", type=int)
+    shipment.add_argument("--order-files", type=int)
+    shipment.add_argument("--restock-hit-ratio", type=float)
+    shipment.add_argument("--order-hit-ratio", type=float)
+    shipment.add_argument("--rows-per-order-upc", type=int)
+
+    p.add_argument("--extra-columns", type=int)
+    return p.parse_args(argv)
+
+def pipeline_params(args, pipeline: str) -> dict:
+    generate = generate_restock if pipeline == "restock" else generate_shipment
+    names = generate.__code__.co_varnames[1:generate.__code__.co_argcount]
+    params = dict(SCALES[args.scale][pipeline], seed=args.seed)
+    for name in names:
+        value = getattr(args, name, None)
+        if value is not None:
+            params[name] = value
+    return params
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    pipelines = ["restock", "shipment"] if args.pipeline == "all" else [args.pipeline]
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "warm_cache": args.warm_cache,
+            "streaming": args.streaming,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for pipeline in pipelines:
+        report["results"][pipeline] = bench(
+            pipeline, pipeline_params(args, pipeline), args.repeat,
+            args.warm_cache, not args.no_memory, args.workdir, args.streaming
+        )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {args.save}")
+
+    if baseline:
+        regressions = compare(report, baseline, args.threshold)
+        for pipeline, stage, old, new in regressions:
+            print(f"REGRESSION {pipeline}/{stage}: {old:.3f}s -> {new:.3f}s")
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+from app.schemas import ShipmentSettings
+from app.services.shipment import process_shipment_logic
+
+def write(tmp_path, name, df):
+    path = str(tmp_path / f"{name}.xlsx")
+    df.to_excel(path, index=False)
+    return path
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_allocated_rows_add_up_to_the_invoice_line(tmp_path, streaming):
+    invoice = pd.DataFrame({"ShipQuantity": [10, 7, 5, 4], "Upc": [111, 222, 333, 444], "NetEach2": [1.0] * 4,
+                            "PackSize": ["1"] * 4, "Brand": ["B"] * 4, "Description": ["D"] * 4})
+    # 111 over PCS 1 + 3, 222 over three equal rows, 333 over one row, 444 is in no order form
+    order = pd.DataFrame({"UPC": [111, 111, 222, 222, 222, 333], "PCS": [1, 3, 1, 1, 1, 2],
+                          "ASIN 1": ["A", "B", "C", "D", "E", "F"], "ASIN1_SKU": ["s1", "s2", "s3", "s4", "s5", "s6"],
+                          "PK": ["1"] * 6, "price": [1.0] * 6, "suplier": ["41"] * 6})
+    result = process_shipment_logic(write(tmp_path, "invoice", invoice), [write(tmp_path, "order", order)], [],
+                                    "DC1", ShipmentSettings(), output_format="csv", streaming=streaming)
+    try:
+        out = pd.read_csv(result.path)
+    finally:
+        result.cleanup()
+
+    assert len(out) == 7
+    shipped = out.groupby("UPC")["ShipQuantity"].sum()
+    assert shipped.to_dict() == {111: 10, 222: 7, 333: 5, 444: 4}
+    allocated = out[out["UPC"] != 444]
+    assert (allocated["ShipQuantity"] == allocated["Yeni Pcs"]).all()
+    assert out[out["UPC"] == 111]["ShipQuantity"].tolist() == [3, 7]  # 2.5 + 7.5: the tied remainder goes first
+    assert sorted(out[out["UPC"] == 222]["ShipQuantity"].tolist()) == [2, 2, 3]
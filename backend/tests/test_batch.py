@@ -0,0 +1,57 @@
+import io
+import zipfile
+import pandas as pd
+import pytest
+from app.schemas import ShipmentSettings
+from app.services.cache import parse_cache
+from app.services.shipment import process_shipment_batch, process_shipment_logic
+from benchmarks.generate import generate_shipment
+
+SETTINGS = ShipmentSettings()
+
+@pytest.fixture
+def batch(tmp_path):
+    parse_cache.clear()
+    files = generate_shipment(str(tmp_path), invoice_rows=200, restock_rows=150, order_rows=300, extra_columns=2, seed=8)
+    invoice = pd.read_excel(files["invoice_file"])
+    invoices = [files["invoice_file"]]
+    for i, frac in enumerate((0.5, 0.8)):  # other DCs ship a shuffled share of the lines
+        path = str(tmp_path / f"invoice-dc{i + 2}.xlsx")
+        invoice.sample(frac=frac, random_state=i).to_excel(path, index=False)
+        invoices.append(path)
+    yield files, invoices, ["DC1", "DC2", "DC1"], ["DC1", "DC2", "DC1_2"]
+    parse_cache.clear()
+
+def single(files, invoice, dc_code, fmt):
+    result = process_shipment_logic(invoice, files["order_files"], files["restock_files"], dc_code, SETTINGS,
+                                    output_format=fmt)
+    try:
+        with open(result.path, "rb") as f:
+            return f.read()
+    finally:
+        result.cleanup()
+
+def test_every_sheet_matches_a_single_dc_run(batch):
+    files, invoices, dc_codes, names = batch
+    result = process_shipment_batch(invoices, dc_codes, files["order_files"], files["restock_files"], SETTINGS)
+    try:
+        sheets = pd.read_excel(result.path, sheet_name=None)
+    finally:
+        result.cleanup()
+    assert list(sheets) == names
+    for name, invoice, dc_code in zip(names, invoices, dc_codes):
+        expected = pd.read_excel(io.BytesIO(single(files, invoice, dc_code, "xlsx")))
+        pd.testing.assert_frame_equal(sheets[name], expected)
+
+def test_every_zipped_file_matches_a_single_dc_run(batch):
+    files, invoices, dc_codes, names = batch
+    result = process_shipment_batch(invoices, dc_codes, files["order_files"], files["restock_files"], SETTINGS,
+                                    output_format="csv", bundle="zip")
+    try:
+        with zipfile.ZipFile(result.path) as archive:
+            members = {name: archive.read(name) for name in archive.namelist()}
+    finally:
+        result.cleanup()
+    assert sorted(members) == sorted(f"{name}.csv" for name in names)
+    for name, invoice, dc_code in zip(names, invoices, dc_codes):
+        assert members[f"{name}.csv"] == single(files, invoice, dc_code, "csv")
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+import pytest
+from fastapi.testclient import TestClient
+import app.main as main
+from app.services.blobs import EMPTY_BLOB, BlobStore, ChunkOffsetError
+
+def blob_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"), max_bytes=1 << 30)
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(main, "blob_store", store)
+    monkeypatch.setattr(main, "BLOB_CHUNK_MB", 1)
+    return TestClient(main.app)
+
+DATA = os.urandom(100_000)
+
+def test_an_interrupted_upload_resumes_where_it_stopped(store):
+    bid = blob_id(DATA)
+    assert store.check([bid]) == {"have": [], "missing": [{"id": bid, "received": 0}]}
+    state = store.write_chunk(bid, 0, len(DATA), DATA[:30_000])
+    assert state == {"id": bid, "complete": False, "received": 30_000}
+
+    # The client lost the response: it asks where the upload stands and goes on from there
+    assert store.check([bid])["missing"] == [{"id": bid, "received": 30_000}]
+    store.write_chunk(bid, 30_000, len(DATA), DATA[30_000:70_000])
+    state = store.write_chunk(bid, 70_000, len(DATA), DATA[70_000:])
+    assert state == {"id": bid, "complete": True, "received": len(DATA)}
+    assert store.check([bid]) == {"have": [bid], "missing": []}
+    with open(store.link(bid, str(store.directory) + "-copy"), "rb") as f:
+        assert f.read() == DATA
+    assert store._uploads == {}
+
+def test_a_chunk_at_the_wrong_offset_is_refused_with_where_to_resume(store):
+    bid = blob_id(DATA)
+    store.write_chunk(bid, 0, len(DATA), DATA[:10_000])
+    for offset in (0, 5_000, 20_000):  # a replayed chunk, an overlap, a gap
+        with pytest.raises(ChunkOffsetError) as error:
+            store.write_chunk(bid, offset, len(DATA), DATA[offset:offset + 10_000])
+        assert error.value.received == 10_000
+    assert store.status(bid)["received"] == 10_000
+    assert store._uploads == {}
+
+def test_a_file_that_does_not_match_its_id_is_dropped(store):
+    bid = blob_id(DATA)
+    store.write_chunk(bid, 0, len(DATA), DATA[:50_000])
+    with pytest.raises(ValueError, match="doesn't match its SHA-256"):
+        store.write_chunk(bid, 50_000, len(DATA), b"x" * 50_000)
+    assert store.status(bid) == {"id": bid, "complete": False, "received": 0}
+    assert not store.has(bid)
+    # Sent again, correctly, it goes through
+    assert store.write_chunk(bid, 0, len(DATA), DATA)["complete"]
+    assert store._uploads == {}
+
+def test_an_empty_file_is_always_there(store, tmp_path):
+    assert EMPTY_BLOB == blob_id(b"")
+    assert store.check([EMPTY_BLOB]) == {"have": [EMPTY_BLOB], "missing": []}
+    assert store.write_chunk(EMPTY_BLOB, 0, 0, b"") == {"id": EMPTY_BLOB, "complete": True, "received": 0}
+    os.remove(os.path.join(store.directory, EMPTY_BLOB))  # trimmed away: still there for the next request
+    with open(store.link(EMPTY_BLOB, str(tmp_path / "empty.xlsx")), "rb") as f:
+        assert f.read() == b""
+
+def test_parallel_chunks_of_one_blob_leave_no_lock_behind(store):
+    bid = blob_id(DATA)
+    errors = []
+
+    def send(offset):
+        try:
+            store.write_chunk(bid, offset, len(DATA), DATA[offset:offset + 25_000])
+        except ChunkOffsetError as e:
+            errors.append(e)
+
+    for _ in range(4):  # only the chunk at the current offset lands each round
+        threads = [threading.Thread(target=send, args=(store.status(bid)["received"],)) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert store.status(bid)["complete"]
+    # Losers of the last round find the finished blob, not an offset error
+    assert len(errors) == 3 * 7
+    assert store._uploads == {}
+
+def test_put_route_statuses(client, store):
+    bid = blob_id(DATA)
+    url = f"/api/blobs/{bid}"
+    response = client.put(url, params={"offset": 0, "size": len(DATA)}, content=DATA[:40_000])
+    assert response.status_code == 200 and response.json()["received"] == 40_000
+
+    response = client.put(url, params={"offset": 0, "size": len(DATA)}, content=DATA[:40_000])
+    assert response.status_code == 409
+    assert response.json()["detail"]["received"] == 40_000
+
+    response = client.put(url, params={"offset": 40_000, "size": len(DATA)}, content=b"y" * 60_000)
+    assert response.status_code == 400 and "SHA-256" in response.json()["detail"]
+
+    response = client.put(f"/api/blobs/{EMPTY_BLOB}", params={"offset": 0, "size": 0}, content=b"")
+    assert response.json() == {"id": EMPTY_BLOB, "complete": True, "received": 0}
+
+def test_oversized_chunks_are_refused_before_they_are_buffered(client, store):
+    big = b"z" * (1024 * 1024 + 1)
+    bid = blob_id(big)
+    response = client.put(f"/api/blobs/{bid}", params={"offset": 0, "size": len(big)}, content=big)
+    assert response.status_code == 413
+
+    # No Content-Length (chunked transfer): cut off once the stream passes the limit
+    def stream():
+        for start in range(0, len(big), 64 * 1024):
+            yield big[start:start + 64 * 1024]
+    response = client.put(f"/api/blobs/{bid}", params={"offset": 0, "size": len(big)}, content=stream())
+    assert response.status_code == 413
+    assert store.status(bid)["received"] == 0
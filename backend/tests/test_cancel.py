@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+import time
+import pandas as pd
+import pytest
+from app.logic.upc import UpcReport
+from app.schemas import RestockSettings
+from app.services import export, restock
+from app.services.cache import parse_cache
+from app.services.cancel import CancelToken, Cancelled
+from app.services.export import ChunkedExport, ExportedFile, export_frame
+from app.services.jobs import CANCELLED, DONE, QUEUED, RUNNING, JobScheduler
+from app.services.pool import ping, worker_pool
+from app.services.restock import MasterLookup, add_upc_keys, process_restock_logic
+from benchmarks.generate import generate_restock
+
+class CountdownToken(CancelToken):
+    """Fires on its `checks`+1-th check, so a test can tell how often a loop looked."""
+    def __init__(self, checks: int):
+        super().__init__()
+        self.checks = 0
+        self.limit = checks
+
+    def check(self):
+        self.checks += 1
+        if self.checks > self.limit:
+            self.cancel("Countdown")
+        super().check()
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    # Outputs land here, so a cancelled one can be seen to be gone
+    directory = tmp_path / "scratch"
+    directory.mkdir()
+    monkeypatch.setattr(export, "UPLOAD_DIR", str(directory))
+    return directory
+
+def outputs(scratch):
+    return os.listdir(scratch)
+
+FRAME = pd.DataFrame({"UPC": range(100), "Title": [f"t{i}" for i in range(100)]})
+
+def test_xlsx_writing_checks_once_per_chunk(scratch, monkeypatch):
+    monkeypatch.setattr(export, "WRITE_CHUNK_ROWS", 10)
+    token = CountdownToken(3)
+    with pytest.raises(Cancelled):
+        export_frame(FRAME, "xlsx", token)
+    assert token.checks == 4  # one before the file, then one per chunk until it fired
+    assert outputs(scratch) == []
+
+    token = CountdownToken(100)
+    export_frame(FRAME, "xlsx", token).cleanup()
+    assert token.checks == 1 + 10
+
+def test_chunked_export_checks_every_chunk(scratch, monkeypatch):
+    monkeypatch.setattr(export, "WRITE_CHUNK_ROWS", 10)
+    # xlsx looks every WRITE_CHUNK_ROWS rows (3 times for the first 25), csv once per chunk
+    for fmt, checks in (("xlsx", 4), ("csv", 1)):
+        token = CountdownToken(checks)
+        with pytest.raises(Cancelled):
+            with ChunkedExport(fmt, token) as out:
+                for start in range(0, 100, 25):
+                    out.write(FRAME[start:start + 25])
+        assert out.rows == 25 and token.checks == checks + 1
+        assert outputs(scratch) == []
+
+def test_master_merge_checks_once_per_chunk(monkeypatch):
+    monkeypatch.setattr(restock, "MERGE_CHUNK_ROWS", 10)
+    ham = add_upc_keys(pd.DataFrame({"UPC": range(1, 51), "Price": 1.0, "Case": 6, "Qty on Hand": 5}), "UPC", UpcReport())
+    master = pd.DataFrame({"UPC": range(1, 101), "PK": 2})
+    lookup = MasterLookup({"41-ham.xlsx": ham}, RestockSettings())
+    token = CountdownToken(3)
+    with pytest.raises(Cancelled):
+        lookup.merge(master.copy(), cancel=token)
+    assert token.checks == 4
+
+    token = CountdownToken(100)
+    merged, _ = lookup.merge(master.copy(), cancel=token)
+    assert len(merged) == 50 and token.checks == 10
+
+def test_cancelled_while_writing_leaves_no_output(tmp_path, scratch, monkeypatch):
+    monkeypatch.setattr(export, "WRITE_CHUNK_ROWS", 20)
+    files = generate_restock(str(tmp_path), suppliers=2, ham_rows=200, master_rows=600, master_hit_ratio=0.9,
+                             extra_columns=1, seed=30)
+    token = CancelToken()
+
+    def callback(message, percent):
+        if message.startswith("Saving"):
+            token.cancel("Client went away")
+    with pytest.raises(Cancelled, match="Client went away"):
+        process_restock_logic(**files, settings=RestockSettings(), callback=callback, cancel=token)
+    assert outputs(scratch) == []
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(worker_pool, "workers", 2)
+    monkeypatch.setattr(worker_pool, "max_active", 1)
+    worker_pool.start()
+    parse_cache.clear()
+    yield worker_pool
+    worker_pool.shutdown()
+    parse_cache.clear()
+
+def test_cancelling_a_run_hands_its_pool_slot_to_the_next_request(pool, tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=6, ham_rows=200, master_rows=200, extra_columns=1, seed=31)
+    token = CancelToken()
+    admitted = threading.Event()
+
+    def next_request():
+        with pool.session():
+            admitted.set()
+
+    def callback(message, percent):
+        # Inside the pool session: line up a second request behind us, then cancel
+        if message.startswith("Loaded and matched") and not token.cancelled:
+            threading.Thread(target=next_request, daemon=True).start()
+            deadline = time.time() + 10
+            while pool.queued < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            assert pool.queued == 1 and not admitted.is_set()
+            token.cancel("Cancelled by the client")
+
+    with pytest.raises(Cancelled):
+        process_restock_logic(**files, settings=RestockSettings(), callback=callback, cancel=token)
+    assert admitted.wait(10)
+    deadline = time.time() + 10
+    while pool.active and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.active == 0 and pool.queued == 0
+    with pool.session() as executor:
+        assert executor.submit(ping).result(timeout=30)
+
+def test_cancelling_a_job_hands_its_scheduler_slot_to_the_next_job(tmp_path):
+    def blocking(progress, cancel):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            cancel.check()
+            time.sleep(0.01)
+        raise AssertionError("never cancelled")
+
+    def quick(progress, cancel):
+        path = str(tmp_path / "out.csv")
+        FRAME.to_csv(path, index=False)
+        return ExportedFile(path, "csv")
+
+    async def scenario():
+        scheduler = JobScheduler(workers=1, queue_limit=5, result_dir=str(tmp_path / "jobs"), ttl=3600)
+        await scheduler.start()
+        try:
+            first = scheduler.submit("restock", "client-a", "first", blocking)
+            while first.status != RUNNING:
+                await asyncio.sleep(0.01)
+            second = scheduler.submit("restock", "client-b", "second", quick)
+            await asyncio.sleep(0.1)
+            assert second.status == QUEUED
+
+            await scheduler.cancel(first.id)
+            await asyncio.wait_for(asyncio.gather(first.task, second.task), 10)
+            assert first.status == CANCELLED and first.error == "Cancelled by the client"
+            assert second.status == DONE and second.result.exists()
+            assert not scheduler._slots.locked()
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,8 @@
+import pytest
+from benchmarks import conformance
+
+pytest.importorskip("polars")
+
+def test_polars_engine_matches_pandas(tmp_path):
+    # Operations and every pipeline run (restock / shipment, each output format) must agree with pandas
+    assert conformance.main(["--engines", "polars", "--workdir", str(tmp_path)]) == 0
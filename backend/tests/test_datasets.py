@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.cache import parse_cache
+from app.services.datasets import datasets
+from app.services.restock import process_restock_logic
+from app.services.shipment import process_shipment_logic
+from benchmarks.generate import generate_restock, generate_shipment
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(datasets, "directory", str(tmp_path / "datasets"))
+    parse_cache.clear()
+    yield datasets
+    parse_cache.clear()
+
+def csv_of(result):
+    try:
+        with open(result.path, "rb") as f:
+            return f.read()
+    finally:
+        result.cleanup()
+
+def named(paths):
+    return [(path.rsplit("/", 1)[-1], path) for path in paths]
+
+def shuffled_copy(path, out, seed):
+    # Same columns, other rows: a changed reference file
+    df = pd.read_excel(path)
+    df.sample(frac=0.7, random_state=seed).to_excel(out, index=False)
+    return out
+
+def test_shipment_from_datasets_matches_uploads(tmp_path):
+    files = generate_shipment(str(tmp_path), invoice_rows=200, restock_rows=150, order_rows=300, order_files=2,
+                              extra_columns=2, seed=9)
+    settings = ShipmentSettings()
+    restock = datasets.create("restock", named(files["restock_files"]))
+    orders = datasets.create("orders", named(files["order_files"]))
+
+    def uploaded(order_files):
+        return csv_of(process_shipment_logic(files["invoice_file"], order_files, files["restock_files"], "DC1",
+                                             settings, output_format="csv"))
+    def from_datasets():
+        return csv_of(process_shipment_logic(files["invoice_file"], [], [], "DC1", settings, output_format="csv",
+                                             restock_dataset=restock.id, order_dataset=orders.id))
+
+    assert from_datasets() == uploaded(files["order_files"])
+
+    # Replace one order form by name: the dataset (and its UPC index) must follow
+    changed = shuffled_copy(files["order_files"][0], str(tmp_path / "changed.xlsx"), seed=1)
+    updated = datasets.update(orders.id, [("order-0.xlsx", changed)], mode="replace")
+    assert updated.manifest["version"] == 2
+    assert [entry["name"] for entry in updated.manifest["files"]] == ["order-0.xlsx", "order-1.xlsx"]
+    assert from_datasets() == uploaded([changed, files["order_files"][1]])
+
+def test_restock_from_a_master_dataset_matches_uploads(tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=3, ham_rows=100, master_rows=300, extra_columns=2, seed=10)
+    settings = RestockSettings()
+    master = datasets.create("master", [("master.xlsx", files["restock_file"])])
+
+    def run(restock_file=None, master_dataset=None):
+        return csv_of(process_restock_logic(files["ham_files"], files["ham_filenames"], files["export_files"],
+                                            files["export_filenames"], restock_file, settings, output_format="csv",
+                                            master_dataset=master_dataset))
+
+    assert run(master_dataset=master.id) == run(restock_file=files["restock_file"])
+
+    changed = shuffled_copy(files["restock_file"], str(tmp_path / "master-2.xlsx"), seed=2)
+    datasets.update(master.id, [("master.xlsx", changed)], mode="replace")
+    assert run(master_dataset=master.id) == run(restock_file=changed)
@@ -0,0 +1,59 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from app.schemas import RestockSettings
+from app.services.cache import parse_cache
+from app.services.restock import find_column, process_restock_logic
+from app.services.state import restock_state
+from benchmarks.generate import generate_restock
+
+SETTINGS = RestockSettings()
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(restock_state, "directory", str(tmp_path / "state"))
+    parse_cache.clear()
+    yield
+    parse_cache.clear()
+
+def run(files, incremental):
+    result = process_restock_logic(files["ham_files"], files["ham_filenames"], files["export_files"],
+                                   files["export_filenames"], files["restock_file"], SETTINGS,
+                                   output_format="csv", incremental=incremental)
+    try:
+        return pd.read_csv(result.path, dtype=str)
+    finally:
+        result.cleanup()
+
+def changed_copy(rng, path, out, column):
+    """The workbook at `path` with some `column` values changed and a few rows dropped, written to `out`."""
+    df = pd.read_excel(path)
+    col = find_column(df, SETTINGS.column_mappings[column])
+    rows = rng.sample(range(len(df)), max(1, len(df) // 5))
+    df.loc[rows, col] = [round(rng.uniform(0.5, 40), 2) if column == "price" else rng.randint(0, 50) for _ in rows]
+    df = df.drop(index=rng.sample(range(len(df)), rng.randint(0, 3)))
+    df.to_excel(out, index=False)
+    return out
+
+@pytest.mark.parametrize("seed", range(4))
+def test_incremental_runs_match_full_runs(tmp_path, state_dir, seed):
+    rng = random.Random(seed)
+    hits = restock_state.hits
+    files = generate_restock(str(tmp_path), suppliers=5, ham_rows=60, master_rows=200, overlap=0.6,
+                             extra_columns=2, seed=seed)
+    pd.testing.assert_frame_equal(run(files, incremental=True), run(files, incremental=False))
+
+    for round_ in range(3):
+        # Some Ham prices and some Export quantities change; sometimes the priority order too
+        files = {key: list(value) if isinstance(value, list) else value for key, value in files.items()}
+        for kind, column in (("ham", "price"), ("export", "quantity")):
+            for i in rng.sample(range(len(files[f"{kind}_files"])), rng.randint(0, 2)):
+                out = str(tmp_path / f"r{round_}-{kind}{i}.xlsx")
+                files[f"{kind}_files"][i] = changed_copy(rng, files[f"{kind}_files"][i], out, column)
+        if rng.random() < 0.3:
+            i, j = rng.sample(range(len(files["ham_files"])), 2)
+            for key in ("ham_files", "ham_filenames"):
+                files[key][i], files[key][j] = files[key][j], files[key][i]
+        pd.testing.assert_frame_equal(run(files, incremental=True), run(files, incremental=False))
+    assert restock_state.hits > hits  # unchanged suppliers really came from the store
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+import app.main as main
+from app.schemas import ShipmentSettings
+from app.services.bus import FileBus
+from app.services.cache import parse_cache
+from app.services.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobScheduler, job_scheduler
+from app.services.pool import worker_pool
+from app.services.shipment import process_shipment_logic
+from benchmarks.generate import generate_shipment
+
+def blocking(progress, cancel):
+    """A job that runs until it is cancelled."""
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        cancel.check()
+        time.sleep(0.01)
+    raise AssertionError("never cancelled")
+
+async def until(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+@pytest.fixture
+def shared(tmp_path):
+    return {"result_dir": str(tmp_path / "jobs"), "bus_dir": str(tmp_path / "bus")}
+
+def test_another_process_sees_and_cancels_a_job(shared):
+    # Two server processes: same result dir, same file bus, a scheduler each
+    async def scenario():
+        buses = [FileBus(shared["bus_dir"], poll=0.01) for _ in range(2)]
+        owner, other = [JobScheduler(workers=1, queue_limit=5, result_dir=shared["result_dir"], ttl=3600)
+                        for _ in range(2)]
+        for bus in buses:
+            await bus.start()
+        await owner.start(bus=buses[0])
+        await other.start(bus=buses[1])
+        try:
+            job = owner.submit("restock", "client-a", "processed_restock", blocking)
+            seen = other.get(job.id)
+            assert seen is not None and seen is not job
+            assert seen.status in (QUEUED, RUNNING) and seen.client_id == "client-a"
+
+            await until(lambda: other.get(job.id).status == RUNNING)
+            assert other.get(job.id).percent == 5  # progress reaches the record too
+            assert job.id not in other.jobs  # an unfinished job is re-read, never cached
+
+            await other.cancel(job.id, "Cancelled from elsewhere")
+            await asyncio.wait_for(job.task, 10)
+            assert job.status == CANCELLED and job.error == "Cancelled from elsewhere"
+            assert other.get(job.id).status == CANCELLED
+            assert not owner._slots.locked()
+        finally:
+            await owner.stop()
+            await other.stop()
+            for bus in buses:
+                await bus.stop()
+
+    asyncio.run(scenario())
+
+# --- LIFECYCLE OVER HTTP ---
+# submit -> status -> cancel -> result through the /api/jobs routes. The pipeline is
+# the real one behind a gate, so a test decides when a job may finish.
+class Gate:
+    def __init__(self):
+        self.open = threading.Event()
+        self.entered = 0
+
+    def wrap(self, run):
+        def gated(*args, cancel=None, **kwargs):
+            self.entered += 1
+            while not self.open.wait(0.01):
+                cancel.check()
+            return run(*args, cancel=cancel, **kwargs)
+        return gated
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    gate = Gate()
+    monkeypatch.setattr(main, "process_shipment_logic", gate.wrap(process_shipment_logic))
+    monkeypatch.setattr(job_scheduler, "workers", 1)
+    monkeypatch.setattr(job_scheduler, "result_dir", str(tmp_path / "jobs"))
+    monkeypatch.setattr(job_scheduler, "jobs", {})
+    monkeypatch.setattr(worker_pool, "workers", 1)
+    files = generate_shipment(str(tmp_path), invoice_rows=80, restock_rows=60, order_rows=120, extra_columns=1, seed=40)
+    parse_cache.clear()
+    with TestClient(main.app) as client:
+        yield client, gate, files
+    parse_cache.clear()
+
+def submit(client, files) -> dict:
+    uploads = [("invoice_file", open(files["invoice_file"], "rb"))]
+    uploads += [("restock_files", open(path, "rb")) for path in files["restock_files"]]
+    uploads += [("order_files", open(path, "rb")) for path in files["order_files"]]
+    try:
+        response = client.post("/api/jobs/shipment", files=uploads, data={
+            "dc_code": files["dc_code"], "settings_str": ShipmentSettings().model_dump_json(),
+            "client_id": "client-a", "output_format": "csv"})
+    finally:
+        for _, f in uploads:
+            f.close()
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def status_of(client, job_id: str) -> dict:
+    response = client.get(f"/api/jobs/{job_id}")
+    assert response.status_code == 200
+    return response.json()
+
+def wait_for(client, job_id: str, *statuses) -> dict:
+    deadline = time.monotonic() + 30
+    while True:
+        job = status_of(client, job_id)
+        if job["status"] in statuses:
+            return job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.02)
+
+def test_job_lifecycle_submit_status_cancel_result(api):
+    client, gate, files = api
+    first = submit(client, files)
+    assert first["status"] in (QUEUED, RUNNING) and first["result_url"] is None
+    wait_for(client, first["id"], RUNNING)
+    response = client.get(f"/api/jobs/{first['id']}/result")
+    assert response.status_code == 409 and response.json()["detail"] == "Job is running"
+
+    # One slot: the second job waits, and a cancel takes it out of the line before it runs
+    second = submit(client, files)
+    assert status_of(client, second["id"])["status"] == QUEUED
+    assert client.post(f"/api/jobs/{second['id']}/cancel").status_code == 200
+    cancelled = wait_for(client, second["id"], CANCELLED)
+    assert cancelled["error"] == "Cancelled by the client" and gate.entered == 1
+
+    gate.open.set()
+    done = wait_for(client, first["id"], DONE)
+    assert done["result_url"] == f"/api/jobs/{first['id']}/result" and done["finished_at"] and done["stats"]
+    response = client.get(done["result_url"])
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith("filename=\"Shipment_Result.csv\"")
+    direct = process_shipment_logic(files["invoice_file"], files["order_files"], files["restock_files"],
+                                    files["dc_code"], ShipmentSettings(), output_format="csv")
+    try:
+        assert response.content == direct.read()
+    finally:
+        direct.cleanup()
+    # A finished job can't be cancelled any more
+    assert client.post(f"/api/jobs/{first['id']}/cancel").json()["status"] == DONE
+
+    # After a restart the job is read back from its record, result included
+    job_scheduler.jobs.clear()
+    assert status_of(client, first["id"])["status"] == DONE
+    assert client.get(done["result_url"]).content == response.content
+
+def test_cancelling_a_running_job(api):
+    client, gate, files = api
+    job = submit(client, files)
+    wait_for(client, job["id"], RUNNING)
+    assert client.post(f"/api/jobs/{job['id']}/cancel").status_code == 200
+    cancelled = wait_for(client, job["id"], CANCELLED)
+    assert cancelled["error"] == "Cancelled by the client" and cancelled["result_url"] is None
+    response = client.get(f"/api/jobs/{job['id']}/result")
+    assert response.status_code == 409 and response.json()["detail"] == "Job is cancelled"
+
+    # The slot is free again: the next job runs to the end
+    gate.open.set()
+    assert wait_for(client, submit(client, files)["id"], DONE, FAILED, CANCELLED)["status"] == DONE
+
+def test_unknown_jobs(api):
+    client, _, _ = api
+    job_id = "0123456789abcdef0123456789abcdef"
+    assert client.get(f"/api/jobs/{job_id}").status_code == 404
+    assert client.post(f"/api/jobs/{job_id}/cancel").status_code == 404
+    assert client.get(f"/api/jobs/{job_id}/result").status_code == 404
+    assert client.get("/api/jobs/..%2F..%2Fetc/result").status_code == 404
@@ -0,0 +1,115 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from app.logic.upc import UpcReport, normalize_upcs
+from app.schemas import RestockSettings
+from app.services import restock
+from app.services.restock import MasterLookup, add_upc_keys, get_file_code
+
+SETTINGS = RestockSettings(supplier_costs={"41 cost": 0.5, "27 standart": 1.1, "19 cost": 2.0, "19 standart": 9.0})
+
+def upc_key(value):
+    """A UPC's digits as an int (leading zeros dropped), as the pipeline keys them; None if unreadable."""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() and value >= 0 else None
+    try:
+        key = int(str(value).strip())
+    except ValueError:
+        return None
+    return key if key >= 0 else None
+
+def baseline_merge(final_dfs, restock_df, settings):
+    """
+    The original lookup walk and per-row master loop, verbatim apart from keying UPCs by
+    their digits (so "0123" and 123 are one item, as in the pipeline).
+    """
+    master_lookup = {}
+    for name, df in final_dfs.items():
+        supplier_code = get_file_code(name)
+        temp_df = pd.DataFrame({
+            'upc': df['UPC'].map(upc_key),
+            'price': df['Price'],
+            'case': df['Case'] if 'Case' in df.columns else "#YOK",
+            'qty': df['Qty on Hand']
+        })
+        for row in temp_df.itertuples():
+            if row.upc is not None and not pd.isna(row.upc) and row.upc not in master_lookup:
+                master_lookup[row.upc] = {'price': row.price, 'qty': row.qty, 'case': row.case,
+                                          'supplier': supplier_code}
+
+    prices, qtys, cases, suppliers, maliyets = [], [], [], [], []
+    restock_upcs = restock_df['UPC'].map(upc_key)
+    restock_pks = restock_df['PK'].fillna('0').astype(str)
+    for upc, pk_val in zip(restock_upcs, restock_pks):
+        data = master_lookup.get(upc)
+        if data:
+            prices.append(data['price'])
+            qtys.append(data['qty'])
+            cases.append(data['case'])
+            suppliers.append(data['supplier'])
+            try:
+                pk_clean = int(pk_val.upper().replace('PK', '').strip())
+                m_add = settings.supplier_costs.get(f"{data['supplier']} cost",
+                        settings.supplier_costs.get(f"{data['supplier']} standart", 0.78))
+                maliyets.append((pk_clean * float(data['price'])) + m_add)
+            except:
+                maliyets.append(data['price'])
+        else:
+            prices.append("#YOK")
+            qtys.append("#YOK")
+            cases.append("#YOK")
+            suppliers.append("#YOK")
+            maliyets.append("#YOK")
+
+    restock_df = restock_df.copy()
+    restock_df['Price'] = prices
+    restock_df['Qty on Hand'] = qtys
+    restock_df['Case'] = cases
+    restock_df['Supplier'] = suppliers
+    restock_df['Maliyet'] = maliyets
+    return restock_df[restock_df['Price'] != "#YOK"]
+
+def random_upc(rng, upc):
+    return rng.choice([upc, str(upc), str(upc).zfill(12)])
+
+def random_inputs(rng):
+    pool = [rng.randrange(10**9, 10**11) for _ in range(rng.randint(2, 30))]
+    final_dfs = {}
+    for n, code in enumerate(rng.sample(["41", "27", "19", "88", "NF"], rng.randint(1, 5))):
+        rows = rng.randint(0, 20)
+        df = pd.DataFrame({
+            'UPC': pd.Series([rng.choice([random_upc(rng, rng.choice(pool)), "junk"]) for _ in range(rows)], dtype=object),
+            'Price': pd.Series([rng.choice([1.5, 2.25, 10, "3.5", "n/a", "#YOK", np.nan]) for _ in range(rows)],
+                               dtype=object),
+            'Qty on Hand': pd.Series([rng.choice([0, 3, 12.0, "5"]) for _ in range(rows)], dtype=object),
+        })
+        if rng.random() < 0.7:
+            df['Case'] = pd.Series([rng.choice([6, "12", None]) for _ in range(rows)], dtype=object)
+        final_dfs[f"{code}-ham{n}.xlsx"] = add_upc_keys(df, 'UPC', UpcReport())
+    rows = rng.randint(0, 60)
+    restock_df = pd.DataFrame({
+        'UPC': pd.Series([rng.choice([random_upc(rng, rng.choice(pool)), rng.randrange(10**9), None])
+                          for _ in range(rows)], dtype=object),
+        'PK': pd.Series([rng.choice(["2", "PK3", "pk 4", " 5 ", 6, 2.0, "x", "", None]) for _ in range(rows)],
+                        dtype=object),
+        'Title': [f"t{i}" for i in range(rows)],
+    })
+    return final_dfs, restock_df
+
+def cells(column: pd.Series) -> list:
+    # As written to the workbook: None and NaN are both an empty cell
+    return [None if not isinstance(v, str) and pd.isna(v) else v for v in column]
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_the_row_loop(seed, monkeypatch):
+    if seed % 2:
+        monkeypatch.setattr(restock, "MERGE_CHUNK_ROWS", 7)  # several chunks per merge
+    rng = random.Random(seed)
+    final_dfs, restock_df = random_inputs(rng)
+    expected = baseline_merge(final_dfs, restock_df, SETTINGS)
+    merged, report = MasterLookup(final_dfs, SETTINGS).merge(restock_df.copy())
+    assert report.to_dict() == normalize_upcs(restock_df['UPC'].to_numpy())[1].to_dict()
+    assert merged.index.tolist() == expected.index.tolist()
+    for column in expected.columns:
+        assert cells(merged[column]) == cells(expected[column]), column
@@ -0,0 +1,67 @@
+import os
+import pandas as pd
+import pytest
+from app.schemas import RestockSettings
+from app.services.cache import parse_cache
+from app.services.restock import process_restock_logic
+from benchmarks.generate import generate_restock
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    directory = str(tmp_path / "parse-cache")
+    os.makedirs(directory)
+    monkeypatch.setenv("PARSE_CACHE_DIR", directory)  # spawned workers build their own parse_cache
+    monkeypatch.setattr(parse_cache, "directory", directory)
+    monkeypatch.setattr(parse_cache, "disk_bytes", 1 << 30)
+    parse_cache.clear()
+    yield directory
+    parse_cache.clear()
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    # The default config: no PARSE_CACHE_DIR, memory tier only
+    monkeypatch.delenv("PARSE_CACHE_DIR", raising=False)
+    monkeypatch.setattr(parse_cache, "directory", None)
+    parse_cache.clear()
+    yield parse_cache
+    parse_cache.clear()
+
+def run(files):
+    result = process_restock_logic(files["ham_files"], files["ham_filenames"], files["export_files"],
+                                   files["export_filenames"], files["restock_file"], RestockSettings(),
+                                   output_format="csv")
+    try:
+        return pd.read_csv(result.path)
+    finally:
+        result.cleanup()
+
+def test_supplier_reads_go_through_the_parse_cache(disk_cache, tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=4, ham_rows=200, master_rows=200, seed=3)
+    supplier_files = len(files["ham_files"]) + len(files["export_files"])
+
+    first = run(files)
+    # Workers parsed every supplier file and left it on the disk tier
+    assert len(os.listdir(disk_cache)) >= supplier_files
+
+    before = parse_cache.stats()
+    second = run(files)
+    after = parse_cache.stats()
+    assert after["disk_hits"] - before["disk_hits"] >= supplier_files
+    pd.testing.assert_frame_equal(first, second)
+
+    third = run(files)
+    assert parse_cache.stats()["hits"] - after["hits"] >= supplier_files
+    pd.testing.assert_frame_equal(first, third)
+
+def test_repeated_runs_hit_the_memory_tier_by_default(memory_cache, tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=4, ham_rows=200, master_rows=200, seed=4)
+    cached_files = len(files["ham_files"]) + len(files["export_files"]) + 1  # + the master
+
+    first = run(files)
+    for _ in range(2):
+        before = parse_cache.stats()
+        again = run(files)
+        after = parse_cache.stats()
+        assert after["misses"] == before["misses"]
+        assert after["hits"] - before["hits"] == cached_files
+        pd.testing.assert_frame_equal(first, again)
@@ -0,0 +1,99 @@
+import json
+import pandas as pd
+import pytest
+from app.config import PREVIEW_SAMPLE_OUTPUT
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.cache import parse_cache
+from app.services.export import PreviewResult
+from app.services.restock import process_restock_logic
+from app.services.shipment import process_shipment_logic
+from benchmarks.generate import generate_restock, generate_shipment
+
+PREVIEW = 40
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    parse_cache.clear()
+    yield
+    parse_cache.clear()
+
+def csv_frame(result) -> pd.DataFrame:
+    try:
+        return pd.read_csv(result.path, dtype=str, keep_default_na=False)
+    finally:
+        result.cleanup()
+
+def head_copy(path: str, rows: int) -> str:
+    # What a preview should see: the first `rows` rows, as a file of its own
+    out = path.replace(".xlsx", f"-head{rows}.xlsx")
+    pd.read_excel(path).head(rows).to_excel(out, index=False)
+    return out
+
+def as_json(result) -> dict:
+    assert isinstance(result, PreviewResult)
+    report = json.loads(json.dumps(result.to_dict()))  # what the route sends
+    assert report["preview"] is True and report["sample_rows"] == PREVIEW
+    assert {stage["stage"] for stage in report["stats"]["stages"]} >= {"read"}
+    return report
+
+def test_restock_preview_matches_a_run_over_the_first_rows(tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=3, ham_rows=150, master_rows=400, master_hit_ratio=0.8,
+                             extra_columns=2, seed=20)
+    settings = RestockSettings()
+    report = as_json(process_restock_logic(**files, settings=settings, preview_rows=PREVIEW))
+
+    assert set(report) == {"preview", "sample_rows", "suppliers", "failed", "master", "upc", "sample", "stats"}
+    assert list(report["suppliers"]) == files["ham_filenames"]
+    for ham_name, export_name in zip(files["ham_filenames"], files["export_filenames"]):
+        supplier = report["suppliers"][ham_name]
+        assert supplier["export"] == export_name
+        assert supplier["ham_rows"] == PREVIEW
+        assert supplier["matched_rows"] <= PREVIEW
+        assert supplier["kept_rows"] == supplier["matched_rows"] - supplier["price_war_dropped_rows"]
+        assert supplier["columns"]["ham"]["upc"] == "UPC"
+        assert supplier["columns"]["export"]["quantity"] == "Qty on Hand"
+    assert report["master"]["rows"] == PREVIEW
+    assert report["master"]["columns"]["upc"] == "UPC"
+    assert report["upc"]["master"]["total"] == PREVIEW
+
+    # Same counts and rows as a real run over the sampled Ham files and master (Exports whole)
+    full = csv_frame(process_restock_logic(
+        ham_files=[head_copy(path, PREVIEW) for path in files["ham_files"]], ham_filenames=files["ham_filenames"],
+        export_files=files["export_files"], export_filenames=files["export_filenames"],
+        restock_file=head_copy(files["restock_file"], PREVIEW), settings=settings, output_format="csv"))
+    assert report["master"]["matched_rows"] == len(full)
+    assert 0 < len(report["sample"]) == min(PREVIEW_SAMPLE_OUTPUT, len(full))
+    sample = pd.DataFrame(report["sample"])
+    assert list(sample.columns) == list(full.columns)
+    assert [str(v) for v in sample["UPC"]] == list(full["UPC"].head(len(sample)))
+
+def test_shipment_preview_matches_a_run_over_the_first_lines(tmp_path):
+    files = generate_shipment(str(tmp_path), invoice_rows=300, restock_rows=200, order_rows=400,
+                              restock_hit_ratio=0.3, order_hit_ratio=0.5, extra_columns=2, seed=21)
+    settings = ShipmentSettings()
+    report = as_json(process_shipment_logic(**files, settings=settings, preview_rows=PREVIEW))
+
+    assert report["rows"] == {"invoice": PREVIEW, "restock": 200, "order": 400}
+    assert report["missing_invoice_columns"] == []
+    assert report["columns"]["invoice"] == {key: aliases[0] for key, aliases in settings.invoice_columns.items()}
+    assert report["columns"]["restock"]["upc"] == "Upc"
+    matches = report["matches"]
+    assert matches["restock"] + matches["order_form"] + matches["unmatched"] == PREVIEW
+    assert sum(sum(counts.values()) for counts in matches["by_supplier"].values()) == PREVIEW - matches["unmatched"]
+    assert report["upc"]["invoice"]["total"] == PREVIEW
+
+    full = csv_frame(process_shipment_logic(head_copy(files["invoice_file"], PREVIEW), files["order_files"],
+                                            files["restock_files"], files["dc_code"], settings, output_format="csv"))
+    assert report["allocation"]["output_rows"] == len(full)
+    assert len(report["sample"]) == min(PREVIEW_SAMPLE_OUTPUT, len(full))
+    sample = pd.DataFrame(report["sample"]).astype(str)
+    assert list(sample.columns) == list(full.columns)
+    assert list(sample["SKU"]) == list(full["SKU"].head(len(sample)))
+
+def test_preview_reports_missing_invoice_columns(tmp_path):
+    files = generate_shipment(str(tmp_path), invoice_rows=50, restock_rows=50, order_rows=50, extra_columns=0, seed=22)
+    invoice = pd.read_excel(files["invoice_file"]).drop(columns=["NetEach2"])
+    invoice.to_excel(files["invoice_file"], index=False)
+    report = as_json(process_shipment_logic(**files, settings=ShipmentSettings(), preview_rows=PREVIEW))
+    assert report["missing_invoice_columns"] == ["price"]
+    assert report["sample"] == [] and report["matches"]["unmatched"] == PREVIEW
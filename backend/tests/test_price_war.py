@@ -0,0 +1,79 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from app.logic.upc import UpcReport
+from app.schemas import RestockSettings
+from app.services.restock import add_upc_keys, resolve_price_war, UPC_KEY
+
+SETTINGS = RestockSettings()
+
+def baseline_price_war(ordered_dfs):
+    """
+    The original pairwise loop, verbatim apart from keying UPCs by their digits (so "0123"
+    and 123 are one item, as in the pipeline). Returns {filename: set of UPCs to remove}.
+    """
+    upcs_to_remove = {name: set() for name, _ in ordered_dfs}
+    for i in range(len(ordered_dfs)):
+        current_name, current_df = ordered_dfs[i]
+        current_prices = dict(zip(current_df['UPC'].map(lambda upc: int(str(upc))), current_df['Price']))
+        for j in range(i + 1, len(ordered_dfs)):
+            next_name, next_df = ordered_dfs[j]
+            next_prices = dict(zip(next_df['UPC'].map(lambda upc: int(str(upc))), next_df['Price']))
+            common = set(current_prices.keys()) & set(next_prices.keys())
+            for upc in common:
+                try:
+                    p1 = float(current_prices[upc])
+                    p2 = float(next_prices[upc])
+                    if p1 < p2:
+                        upcs_to_remove[next_name].add(upc)
+                    elif p1 > p2:
+                        upcs_to_remove[current_name].add(upc)
+                    else:
+                        upcs_to_remove[next_name].add(upc)
+                except:
+                    pass
+    return upcs_to_remove
+
+PRICES = [1.0, 1.5, 2.0, 2.0, 3.25, np.nan, None, "abc", "", "1.5", " 2.0 ", "nan", "2,5", 2, True]
+
+def random_upc(rng, upc):
+    # The same item written as a number, as text, or as zero-padded text
+    return rng.choice([upc, str(upc), str(upc).zfill(12)])
+
+def random_files(rng, files, rows, upcs):
+    ordered = []
+    for n in range(files):
+        picked = [rng.randrange(1, upcs + 1) for _ in range(rows)]  # repeats: duplicate UPCs in a file
+        df = pd.DataFrame({
+            'UPC': pd.Series([random_upc(rng, upc) for upc in picked], dtype=object),
+            'Price': pd.Series([rng.choice(PRICES) for _ in picked], dtype=object),
+        })
+        ordered.append((f"S{n}-ham.xlsx", df))
+    return ordered
+
+def with_keys(ordered_dfs):
+    return [(name, add_upc_keys(df.copy(), 'UPC', UpcReport())) for name, df in ordered_dfs]
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_the_pairwise_loop(seed):
+    rng = random.Random(seed)
+    ordered = random_files(rng, files=rng.randint(1, 6), rows=rng.randint(1, 40), upcs=rng.randint(1, 15))
+    keyed = with_keys(ordered)
+    expected = baseline_price_war(ordered)
+    losers = resolve_price_war(keyed, SETTINGS)
+    assert losers == expected
+
+    # Winners: the rows each file still has once its losers are dropped
+    for name, df in keyed:
+        kept = df[~df[UPC_KEY].isin(losers[name])]
+        assert kept.index.tolist() == df[~df[UPC_KEY].isin(expected[name])].index.tolist()
+
+def test_numeric_columns_match_the_pairwise_loop():
+    rng = random.Random(99)
+    ordered = []
+    for n in range(5):
+        upcs = [rng.randrange(1, 30) for _ in range(60)]
+        prices = [rng.choice([1.0, 2.0, 2.5, np.nan]) for _ in upcs]
+        ordered.append((f"S{n}-ham.xlsx", pd.DataFrame({'UPC': upcs, 'Price': prices})))
+    assert resolve_price_war(with_keys(ordered), SETTINGS) == baseline_price_war(ordered)
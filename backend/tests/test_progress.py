@@ -0,0 +1,40 @@
+import asyncio
+import threading
+from app.services.progress import PROGRESS_MIN_INTERVAL, ProgressChannel
+
+def test_progress_is_ordered_throttled_and_folded_while_the_worker_runs():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        sent = []  # (message, percent, loop time)
+        first_sent, finish = threading.Event(), threading.Event()
+
+        async def send(message, percent):
+            sent.append((message, percent, loop.time()))
+            first_sent.set()
+
+        channel = ProgressChannel(send)
+
+        def worker():
+            channel("Started", 0)
+            first_sent.wait(5)
+            for i in range(10):  # a burst inside one interval
+                channel(f"Loaded {i}", 10 + i)
+            finish.wait(5)  # the test checks everything before letting the worker return
+            channel("Done", 100)
+
+        job = asyncio.ensure_future(asyncio.to_thread(worker))
+        while len(sent) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(PROGRESS_MIN_INTERVAL)  # nothing else may arrive
+
+        assert not job.done()
+        assert [(message, percent) for message, percent, _ in sent] == [("Started", 0), ("Loaded 9 (+9 more)", 19)]
+        assert sent[1][2] - sent[0][2] >= PROGRESS_MIN_INTERVAL - 0.01
+
+        finish.set()
+        await job
+        await channel.close()
+        assert [message for message, _, _ in sent] == ["Started", "Loaded 9 (+9 more)", "Done"]
+        assert sent[2][2] - sent[1][2] >= PROGRESS_MIN_INTERVAL - 0.01
+
+    asyncio.run(scenario())
@@ -0,0 +1,185 @@
+import math
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from app.schemas import ShipmentSettings
+from app.services.shipment import find_col, process_shipment_logic
+
+def upc_key(value):
+    """A UPC's digits as an int (leading zeros dropped), as the pipeline keys them; None if unreadable."""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() and value >= 0 else None
+    try:
+        key = int(str(value).strip())
+    except ValueError:
+        return None
+    return key if key >= 0 else None
+
+def baseline_shipment(invoice_df, order_df, restock_df, dc_code, settings):
+    """
+    The original per-row loop, verbatim apart from comparing UPCs by their key (so "0123"
+    and 123 are one item, as in the pipeline), writing SKU2 from the key's digits (a UPC
+    read as 123.0 still gives 000000000123) and taking frames the caller read.
+    """
+    inv_cols = {key: find_col(invoice_df, candidates) for key, candidates in settings.invoice_columns.items()}
+
+    total_pcs_map = {}
+    if not order_df.empty:
+        ord_upc = find_col(order_df, settings.order_columns['upc'])
+        ord_pcs = find_col(order_df, settings.order_columns['pcs'])
+        if ord_upc and ord_pcs:
+            total_pcs_map = order_df.groupby(order_df[ord_upc].map(upc_key))[ord_pcs].sum().to_dict()
+
+    res_upc_col = find_col(restock_df, settings.restock_columns['upc'])
+    restock_keys = restock_df[res_upc_col].map(upc_key) if res_upc_col else pd.Series(dtype=object)
+    ord_upc_col = find_col(order_df, settings.order_columns['upc'])
+    order_keys = order_df[ord_upc_col].map(upc_key) if ord_upc_col else pd.Series(dtype=object)
+
+    results = []
+    for _, inv_row in invoice_df.iterrows():
+        upc = inv_row[inv_cols['upc']]
+        key = upc_key(upc)
+        row_data = {
+            'UPC': upc,
+            'Price': inv_row[inv_cols['price']],
+            'ShipQuantity': inv_row[inv_cols['shipquantity']],
+            'PackSize': inv_row[inv_cols['packsize']],
+            'Brand': inv_row[inv_cols['brand']],
+            'Description': inv_row[inv_cols['description']],
+            'Suplier': '#YOK', 'Asin': '#YOK', 'Pcs': 0, 'PK': '#YOK', 'SKU': '#YOK', 'Price Check': '#YOK',
+            'DOSYA': '#YOK', 'SKU2': '#YOK', 'Yeni Pcs': '#YOK', 'PK EACH': '#YOK', 'Kalan': '#YOK'
+        }
+
+        if key is not None and res_upc_col and not restock_df.empty and (restock_keys == key).any():
+            match = restock_df[(restock_keys == key).to_numpy()].iloc[0]
+            row_data.update({
+                'DOSYA': 'Restock',
+                'Suplier': match.get(find_col(restock_df, settings.restock_columns['suplier']), '#YOK'),
+                'Asin': match.get(find_col(restock_df, settings.restock_columns['asin']), '#YOK'),
+                'Pcs': match.get(find_col(restock_df, settings.restock_columns['pcs']), 0),
+                'PK': match.get(find_col(restock_df, settings.restock_columns['pk']), '#YOK'),
+                'Price Check': match.get(find_col(restock_df, settings.restock_columns['price']), '#YOK'),
+            })
+        elif not order_df.empty:
+            if key is not None and ord_upc_col and (order_keys == key).any():
+                match = order_df[(order_keys == key).to_numpy()].iloc[0]
+                asin_val = '#YOK'
+                sku_val = '#YOK'
+                for i, asin_col in enumerate(settings.order_columns['asin']):
+                    col_name = find_col(order_df, [asin_col])
+                    if col_name and not pd.isna(match[col_name]):
+                        asin_val = match[col_name]
+                        if i < len(settings.order_columns['sku']):
+                            sku_col_name = find_col(order_df, [settings.order_columns['sku'][i]])
+                            if sku_col_name:
+                                sku_val = match[sku_col_name]
+                        break
+                row_data.update({
+                    'DOSYA': 'Order Form',
+                    'Suplier': match.get(find_col(order_df, settings.order_columns['suplier']), '#YOK'),
+                    'Asin': asin_val,
+                    'SKU': sku_val,
+                    'PK': match.get(find_col(order_df, settings.order_columns['pk']), '#YOK'),
+                    'Price Check': match.get(find_col(order_df, settings.order_columns['price']), '#YOK'),
+                    'Pcs': match.get(find_col(order_df, settings.order_columns['pcs']), 0)
+                })
+
+        if str(row_data['PK']) != '#YOK' and str(row_data['Price']) != '#YOK':
+            try:
+                pk_clean = int(str(row_data['PK']).upper().replace('PK', '').strip())
+                price_clean = float(row_data['Price'])
+                cost_calc = pk_clean * price_clean
+                upc_str = str(upc).strip().zfill(12) if key is None else str(key).zfill(12)
+                cost_str = "{:.2f}".format(cost_calc)
+                row_data['SKU2'] = f"{dc_code}_{upc_str}_{row_data['PK']}_{cost_str}"
+            except:
+                pass
+
+        try:
+            pcs_val = float(row_data['Pcs'])
+            ship_qty = float(row_data['ShipQuantity'])
+            if row_data['DOSYA'] == 'Order Form' and key in total_pcs_map:
+                total_pcs = float(total_pcs_map[key])
+                if total_pcs > 0:
+                    yeni_pcs = (pcs_val / total_pcs) * ship_qty
+                    row_data['Yeni Pcs'] = math.floor(yeni_pcs)
+                else:
+                    row_data['Yeni Pcs'] = ship_qty
+            else:
+                row_data['Yeni Pcs'] = ship_qty
+
+            if str(row_data['PK']) != '#YOK':
+                pk_int = int(str(row_data['PK']).upper().replace('PK', '').strip())
+                if pk_int > 0:
+                    final_qty = row_data['Yeni Pcs']
+                    row_data['PK EACH'] = int(final_qty / pk_int)
+                    row_data['Kalan'] = final_qty % pk_int
+        except Exception:
+            pass
+
+        results.append(row_data)
+    return pd.DataFrame(results)
+
+def random_upc(rng, upc):
+    # The same item written as a number, as text, or as zero-padded text
+    return rng.choice([upc, str(upc), str(upc).zfill(12)])
+
+def random_workbooks(rng, tmp_path):
+    pool = [rng.randrange(10**9, 10**11) for _ in range(rng.randint(3, 25))]
+    pick = lambda: random_upc(rng, rng.choice(pool))
+    n = rng.randint(1, 40)
+    invoice = pd.DataFrame({
+        "ShipQuantity": [rng.choice([1, 3, 7, 12, 40, 2.5, "abc", None]) for _ in range(n)],
+        "Upc": [rng.choice([pick(), pick(), pick(), "junk", None]) for _ in range(n)],
+        "NetEach2": [rng.choice([1.25, 3.1, 10, "n/a", None]) for _ in range(n)],
+        "PackSize": [rng.choice(["1", "6", "12"]) for _ in range(n)],
+        "Brand": [rng.choice(["B1", "B2"]) for _ in range(n)],
+        "Description": [f"item {i}" for i in range(n)],
+    })
+    m = rng.randint(0, 15)
+    restock = pd.DataFrame({
+        "Upc": [pick() for _ in range(m)],
+        "PCS": [rng.choice([1, 2, 6, None]) for _ in range(m)],
+        "ASIN": [f"R{i}" for i in range(m)],
+        "PK": [rng.choice(["2", "PK3", "pk 4", "0", "x", None, 6]) for _ in range(m)],
+        "Price": [rng.choice([1.5, 2.0, None]) for _ in range(m)],
+        "suplier": [rng.choice(["41", "55"]) for _ in range(m)],
+    })
+    k = rng.randint(0, 25)
+    order = pd.DataFrame({
+        "UPC": [pick() for _ in range(k)],
+        "PCS": [rng.choice([0, 1, 2, 5, 10]) for _ in range(k)],
+        "ASIN 1": [rng.choice([f"A{i}", None]) for i in range(k)],
+        "ASIN 2": [rng.choice([f"B{i}", None]) for i in range(k)],
+        "ASIN 3": [rng.choice([f"C{i}", None]) for i in range(k)],
+        "ASIN1_SKU": [f"s1-{i}" for i in range(k)],
+        "ASIN2_SKU": [f"s2-{i}" for i in range(k)],
+        "PK": [rng.choice(["1", "2", "PK5", "bad", None]) for _ in range(k)],
+        "price": [rng.choice([2.5, 4.0, None]) for _ in range(k)],
+        "suplier": [rng.choice(["41", "77"]) for _ in range(k)],
+    })
+    paths = {}
+    for name, df in (("invoice", invoice), ("restock", restock), ("order", order)):
+        paths[name] = str(tmp_path / f"{name}.xlsx")
+        df.to_excel(paths[name], index=False)
+    return paths
+
+def read(path):
+    return pd.read_excel(path, engine="calamine")
+
+@pytest.mark.parametrize("seed", range(25))
+def test_matches_the_row_loop(tmp_path, seed):
+    rng = random.Random(seed)
+    paths = random_workbooks(rng, tmp_path)
+    settings = ShipmentSettings(allocation="first")  # the row loop only knew the first order row
+
+    expected = baseline_shipment(read(paths["invoice"]), read(paths["order"]), read(paths["restock"]), "DC1", settings)
+    expected_path = str(tmp_path / "expected.xlsx")
+    expected.to_excel(expected_path, index=False)
+
+    result = process_shipment_logic(paths["invoice"], [paths["order"]], [paths["restock"]], "DC1", settings)
+    try:
+        pd.testing.assert_frame_equal(read(result.path), read(expected_path))
+    finally:
+        result.cleanup()
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services import restock, shipment
+from app.services.cache import parse_cache
+from benchmarks.generate import generate_restock, generate_shipment
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Many chunks (a short last one included) out of a small file
+    monkeypatch.setattr(restock, "STREAM_CHUNK_ROWS", 37)
+    monkeypatch.setattr(shipment, "STREAM_CHUNK_ROWS", 37)
+    parse_cache.clear()
+    yield
+    parse_cache.clear()
+
+def output(result, fmt):
+    try:
+        if fmt == "csv":
+            with open(result.path, "rb") as f:
+                return f.read()
+        return pd.read_excel(result.path)
+    finally:
+        result.cleanup()
+
+def same(a, b):
+    if isinstance(a, bytes):
+        assert a == b
+    else:
+        pd.testing.assert_frame_equal(a, b)
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_restock_streaming_matches_whole_file(tmp_path, fmt):
+    files = generate_restock(str(tmp_path), suppliers=3, ham_rows=150, master_rows=400, extra_columns=2, seed=5)
+    def run(streaming):
+        return output(restock.process_restock_logic(files["ham_files"], files["ham_filenames"], files["export_files"],
+                                                    files["export_filenames"], files["restock_file"], RestockSettings(),
+                                                    output_format=fmt, streaming=streaming), fmt)
+    same(run(True), run(False))
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+@pytest.mark.parametrize("allocation", ["proportional", "first"])
+def test_shipment_streaming_matches_whole_file(tmp_path, fmt, allocation):
+    files = generate_shipment(str(tmp_path), invoice_rows=300, restock_rows=200, order_rows=400, extra_columns=2, seed=6)
+    settings = ShipmentSettings(allocation=allocation)
+    def run(streaming):
+        return output(shipment.process_shipment_logic(files["invoice_file"], files["order_files"], files["restock_files"],
+                                                      files["dc_code"], settings, output_format=fmt,
+                                                      streaming=streaming), fmt)
+    same(run(True), run(False))
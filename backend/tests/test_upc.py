@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from app.logic.upc import INVALID_UPC, format_upc, normalize_upcs
+from app.schemas import ShipmentSettings
+from app.services.shipment import process_shipment_logic
+
+def test_leading_zero_text_and_number_share_a_key():
+    keys, report = normalize_upcs(np.array(["012345678906", 12345678906, 12345678906.0, " 0-12345-67890-6 "], dtype=object))
+    assert keys.tolist() == [12345678906] * 4
+    assert report.valid == 4
+    assert report.repaired == 0
+
+def test_bad_check_digits_are_reported_not_rewritten():
+    keys, report = normalize_upcs(np.array([22, "000000000022", 12345678900, 12345678905], dtype=object))
+    assert keys.tolist() == [22, 22, 12345678900, 12345678905]
+    assert report.bad_check_digit == 3
+    assert report.repaired == 0
+
+def test_repair_is_opt_in():
+    keys, report = normalize_upcs(np.array([1234567890], dtype=object), repair=True)
+    assert keys.tolist() == [12345678905]
+    assert report.repaired == 1
+
+def test_blank_and_junk():
+    keys, report = normalize_upcs(np.array([None, "", "abc", 1.5, -3], dtype=object))
+    assert (keys == INVALID_UPC).all()
+    assert report.blank == 2
+    assert report.invalid == 3
+
+def test_sku2_uses_the_digits_as_written(tmp_path):
+    invoice = pd.DataFrame({"ShipQuantity": [4], "Upc": [22], "NetEach2": [1.5], "PackSize": ["1"],
+                            "Brand": ["B"], "Description": ["D"]})
+    restock = pd.DataFrame({"Upc": ["000000000022"], "PCS": [1], "ASIN": ["A1"], "PK": ["2"], "Price": [1.5],
+                            "suplier": ["41"]})
+    paths = {}
+    for name, df in (("invoice", invoice), ("restock", restock)):
+        paths[name] = str(tmp_path / f"{name}.xlsx")
+        df.to_excel(paths[name], index=False)
+    result = process_shipment_logic(paths["invoice"], [], [paths["restock"]], "DC1", ShipmentSettings(),
+                                    output_format="csv")
+    out = pd.read_csv(result.path, dtype=str)
+    result.cleanup()
+    assert out.loc[0, "DOSYA"] == "Restock"
+    assert out.loc[0, "SKU2"] == f"DC1_{format_upc(np.array([22]))[0]}_2_3.00"
+    assert out.loc[0, "SKU2"] == "DC1_000000000022_2_3.00"
@@ -0,0 +1,63 @@
+import os
+import signal
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from app.schemas import RestockSettings, ShipmentSettings
+from app.services.cache import parse_cache
+from app.services.pool import worker_pool, ping
+from app.services.restock import process_restock_logic
+from app.services.shipment import process_shipment_batch
+from benchmarks.generate import generate_restock, generate_shipment
+
+@pytest.fixture
+def pool():
+    worker_pool.workers = 2
+    worker_pool.start()
+    parse_cache.clear()
+    yield worker_pool
+    worker_pool.shutdown()
+    parse_cache.clear()
+
+def kill_workers():
+    for pid in list(worker_pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+
+def killing_callback(trigger: str):
+    """Progress callback that kills every pool worker the first time a message starts with `trigger`."""
+    fired = []
+    def callback(message, percent):
+        if message.startswith(trigger) and not fired:
+            fired.append(message)
+            kill_workers()
+    return callback, fired
+
+def assert_restarted(pool, before):
+    assert pool._executor is not before
+    assert pool.active == 0
+    assert pool._executor.submit(ping).result(timeout=30)
+
+def test_restock_fails_and_restarts_the_pool_when_a_worker_dies(pool, tmp_path):
+    files = generate_restock(str(tmp_path), suppliers=10, ham_rows=300, master_rows=300, seed=1)
+    callback, fired = killing_callback("Loaded and matched")
+    before = pool._executor
+    with pytest.raises(BrokenProcessPool):
+        process_restock_logic(files["ham_files"], files["ham_filenames"], files["export_files"],
+                              files["export_filenames"], files["restock_file"], RestockSettings(), callback)
+    assert fired
+    assert_restarted(pool, before)
+
+def test_shipment_batch_fails_and_restarts_the_pool_when_a_worker_dies(pool, tmp_path):
+    files = generate_shipment(str(tmp_path), invoice_rows=300, restock_rows=300, order_rows=300, seed=1)
+    invoices = []
+    for i in range(12):  # distinct contents, so each one is parsed in the pool
+        path = str(tmp_path / f"invoice-{i}.xlsx")
+        with open(files["invoice_file"], "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read() + bytes(i))
+        invoices.append(path)
+    callback, fired = killing_callback("Reading")
+    before = pool._executor
+    with pytest.raises(BrokenProcessPool):
+        process_shipment_batch(invoices, [f"DC{i}" for i in range(12)], files["order_files"], files["restock_files"],
+                               ShipmentSettings(), callback)
+    assert fired
+    assert_restarted(pool, before)
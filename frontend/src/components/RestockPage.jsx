@@ -10,6 +10,7 @@ import {
 } from '@heroicons/react/24/outline';
 import { useDropzone } from 'react-dropzone'; // Direct import for the list wrapper
 import DragDropZone from './DragDropZone';    // Our new component for the single file
+import { uploadFiles } from '../uploads';
 
 // Default Configuration
 const DEFAULT_SETTINGS = {
@@ -49,13 +50,20 @@ export default function RestockPage() {
   const [logs, setLogs] = useState([]);
   const [progress, setProgress] = useState(0);
   const logsEndRef = useRef(null);
+  const wsRef = useRef(null);
 
   // --- WEBSOCKET CONNECTION ---
   useEffect(() => {
     const ws = new WebSocket(`ws://localhost:8000/ws/${clientId}`);
+    wsRef.current = ws;
     
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
+        // Server heartbeat: answer so the socket isn't dropped as stale, keep it out of the log
+        if (data.type === "heartbeat") {
+            ws.send("pong");
+            return;
+        }
         setLogs(prev => [...prev, `> ${data.message}`]);
         setProgress(data.percent);
     };
@@ -81,6 +89,11 @@ export default function RestockPage() {
     handleSettingsChange('column_mappings', key, array);
   };
 
+  // Stops the running process on the server (it answers 499 and frees its workers)
+  const handleCancel = () => {
+    wsRef.current?.send(JSON.stringify({ type: "cancel" }));
+  };
+
   const handleSubmit = async () => {
     if (hamFiles.length === 0 || exportFiles.length === 0 || !restockFile) {
       alert("Please upload all required files.");
@@ -91,19 +104,25 @@ export default function RestockPage() {
     setLogs(["> Starting upload..."]); // Reset logs
     setProgress(0);
     setLoading(true);
-    const formData = new FormData();
+    try {
+      // Files the server already has are skipped; the rest go up in resumable chunks
+      const onUpload = (message, percent) => {
+        setProgress(percent);
+        setLogs(prev => prev[prev.length - 1] === `> ${message}` ? prev : [...prev, `> ${message}`]);
+      };
+      const blobs = await uploadFiles([...hamFiles, ...exportFiles, restockFile[0]], onUpload);
 
-    formData.append("client_id", clientId);
+      const formData = new FormData();
+      formData.append("client_id", clientId);
 
-    // Append Files (In the explicit order of the array)
-    hamFiles.forEach(file => formData.append("ham_files", file));
-    exportFiles.forEach(file => formData.append("export_files", file));
-    formData.append("restock_file", restockFile[0]);
+      // Blob references (In the explicit order of the arrays)
+      formData.append("ham_blobs", JSON.stringify(blobs.slice(0, hamFiles.length)));
+      formData.append("export_blobs", JSON.stringify(blobs.slice(hamFiles.length, -1)));
+      formData.append("restock_blob", JSON.stringify(blobs[blobs.length - 1]));
 
-    // Append Settings
-    formData.append("settings_str", JSON.stringify(settings));
+      // Append Settings
+      formData.append("settings_str", JSON.stringify(settings));
 
-    try {
       const response = await axios.post('http://localhost:8000/api/restock', formData, {
         responseType: 'blob', 
       });
@@ -116,6 +135,7 @@ export default function RestockPage() {
       link.click();
       
     } catch (error) {
+      if (error.response?.status === 499) return; // Cancelled on purpose
       console.error("Processing failed", error);
       alert("Error processing files. Check console.");
     } finally {
@@ -213,6 +233,14 @@ export default function RestockPage() {
       >
         {loading ? "Processing..." : "Run Restock Process"}
       </button>
+      {loading && (
+        <button
+          onClick={handleCancel}
+          className="w-full mt-2 py-2 rounded-lg font-bold text-sm bg-red-700 hover:bg-red-600 text-white transition-all"
+        >
+          Cancel
+        </button>
+      )}
       {/* --- LOGGING TERMINAL (NEW) --- */}
       <div className="mb-8 bg-black rounded-lg border border-gray-700 p-4 font-mono text-xs md:text-sm shadow-2xl">
         <div className="flex justify-between items-center mb-2 border-b border-gray-800 pb-2">
@@ -1,7 +1,8 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { CloudArrowUpIcon, Cog6ToothIcon } from '@heroicons/react/24/outline';
 import DragDropZone from './DragDropZone';
+import { uploadFiles } from '../uploads';
 
 // Default Configuration
 const DEFAULT_SETTINGS = {
@@ -16,6 +17,8 @@ const DEFAULT_SETTINGS = {
     }
 };
 
+const generateClientId = () => Math.random().toString(36).substring(7);
+
 export default function ShipmentPage() {
     // --- STATE ---
     const [invoiceFile, setInvoiceFile] = useState(null);
@@ -28,6 +31,35 @@ export default function ShipmentPage() {
     const [showSettings, setShowSettings] = useState(false);
     
     const [loading, setLoading] = useState(false);
+    const [clientId] = useState(generateClientId());
+    const [logs, setLogs] = useState([]);
+    const [progress, setProgress] = useState(0);
+    const logsEndRef = useRef(null);
+    const wsRef = useRef(null);
+
+    // --- WEBSOCKET CONNECTION ---
+    useEffect(() => {
+        const ws = new WebSocket(`ws://localhost:8000/ws/${clientId}`);
+        wsRef.current = ws;
+
+        ws.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            // Server heartbeat: answer so the socket isn't dropped as stale, keep it out of the log
+            if (data.type === "heartbeat") {
+                ws.send("pong");
+                return;
+            }
+            setLogs(prev => [...prev, `> ${data.message}`]);
+            setProgress(data.percent);
+        };
+
+        return () => ws.close();
+    }, [clientId]);
+
+    // Auto-scroll logs
+    useEffect(() => {
+        logsEndRef.current?.scrollIntoView({ behavior: "smooth" });
+    }, [logs]);
 
     // --- HANDLERS ---
     const handleColumnChange = (section, key, valueString) => {
@@ -41,6 +73,11 @@ export default function ShipmentPage() {
         }));
     };
 
+    // Stops the running process on the server (it answers 499 and frees its workers)
+    const handleCancel = () => {
+        wsRef.current?.send(JSON.stringify({ type: "cancel" }));
+    };
+
     const handleSubmit = async () => {
         if (!invoiceFile || !restockFiles || !orderFiles || !dcCode) {
             alert("Please fill all fields (DC Code) and upload all files.");
@@ -48,18 +85,31 @@ export default function ShipmentPage() {
         }
 
         setLoading(true);
-        const formData = new FormData();
-        
-        // Append Files
-        formData.append("invoice_file", invoiceFile[0]);
-        for (let i = 0; i < restockFiles.length; i++) formData.append("restock_files", restockFiles[i]);
-        for (let i = 0; i < orderFiles.length; i++) formData.append("order_files", orderFiles[i]);
-        
-        // Append Data
-        formData.append("dc_code", dcCode);
-        formData.append("settings_str", JSON.stringify(settings));
+        setLogs(["> Starting upload..."]); // Reset logs
+        setProgress(0);
 
         try {
+            // Only files the server doesn't have yet are uploaded (in resumable chunks)
+            const onUpload = (message, percent) => {
+                setProgress(percent);
+                setLogs(prev => prev[prev.length - 1] === `> ${message}` ? prev : [...prev, `> ${message}`]);
+            };
+            const restock = Array.from(restockFiles);
+            const orders = Array.from(orderFiles);
+            const blobs = await uploadFiles([invoiceFile[0], ...restock, ...orders], onUpload);
+
+            const formData = new FormData();
+
+            // Append Blob References
+            formData.append("invoice_blob", JSON.stringify(blobs[0]));
+            formData.append("restock_blobs", JSON.stringify(blobs.slice(1, 1 + restock.length)));
+            formData.append("order_blobs", JSON.stringify(blobs.slice(1 + restock.length)));
+
+            // Append Data
+            formData.append("client_id", clientId);
+            formData.append("dc_code", dcCode);
+            formData.append("settings_str", JSON.stringify(settings));
+
             const response = await axios.post('http://localhost:8000/api/shipment', formData, { 
                 responseType: 'blob' 
             });
@@ -72,6 +122,7 @@ export default function ShipmentPage() {
             document.body.appendChild(link);
             link.click();
         } catch (error) {
+            if (error.response?.status === 499) return; // Cancelled on purpose
             console.error(error);
             alert("Process failed. Check console for details.");
         } finally {
@@ -188,6 +239,39 @@ export default function ShipmentPage() {
             >
                 {loading ? "Processing Manifest..." : "Generate Shipment Manifest"}
             </button>
+            {loading && (
+                <button
+                    onClick={handleCancel}
+                    className="w-full mt-2 py-2 rounded-lg font-bold text-sm bg-red-700 hover:bg-red-600 text-white transition-all"
+                >
+                    Cancel
+                </button>
+            )}
+
+            {/* --- LOGGING TERMINAL --- */}
+            <div className="mt-8 bg-black rounded-lg border border-gray-700 p-4 font-mono text-xs md:text-sm shadow-2xl">
+                <div className="flex justify-between items-center mb-2 border-b border-gray-800 pb-2">
+                    <span className="text-gray-400">Process Terminal</span>
+                    <span className="text-green-500">{progress}%</span>
+                </div>
+
+                {/* Progress Bar */}
+                <div className="w-full bg-gray-800 rounded-full h-2.5 mb-4">
+                    <div
+                        className="bg-green-600 h-2.5 rounded-full transition-all duration-300 ease-out"
+                        style={{ width: `${progress}%` }}
+                    ></div>
+                </div>
+
+                {/* Log Output */}
+                <div className="h-40 overflow-y-auto space-y-1 text-green-400">
+                    {logs.length === 0 && <span className="text-gray-600 opacity-50">Waiting for jobs...</span>}
+                    {logs.map((log, i) => (
+                        <div key={i} className="break-words">{log}</div>
+                    ))}
+                    <div ref={logsEndRef} />
+                </div>
+            </div>
         </div>
     );
 }
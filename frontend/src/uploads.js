@@ -0,0 +1,79 @@
+import axios from 'axios';
+
+// --- CHUNKED UPLOADS ---
+// Files go to the server's content store once (by SHA-256) and are then referenced by id:
+// ask which blobs the server already has, send only the missing ones in chunks (an
+// interrupted upload resumes where it stopped), then pass [{id, name}] to the pipeline.
+
+const API = 'http://localhost:8000';
+const CHUNK_SIZE = 4 * 1024 * 1024;
+const RETRIES = 3;
+
+const toHex = (buffer) => Array.from(new Uint8Array(buffer)).map(b => b.toString(16).padStart(2, '0')).join('');
+
+export const fileId = async (file) => {
+    // crypto.subtle only exists on https:// or localhost pages
+    if (!window.crypto?.subtle) throw new Error('Hashing files needs the app on https:// or localhost');
+    return toHex(await crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+};
+
+const uploadChunks = async (file, id, received, onBytes) => {
+    let offset = received;
+    let failures = 0;
+    // Until the server says so: an empty file still takes one (empty) PUT to complete
+    let complete = false;
+    while (!complete) {
+        const chunk = file.slice(offset, offset + CHUNK_SIZE);
+        try {
+            const response = await axios.put(`${API}/api/blobs/${id}`, chunk, {
+                params: { offset, size: file.size },
+                headers: { 'Content-Type': 'application/octet-stream' },
+            });
+            onBytes(response.data.received - offset);
+            offset = response.data.received;
+            complete = response.data.complete;
+            failures = 0;
+        } catch (error) {
+            const detail = error.response?.data?.detail;
+            if (error.response?.status === 409 && detail?.received !== undefined) {
+                // Server is elsewhere (e.g. an earlier attempt landed): continue from there
+                onBytes(detail.received - offset);
+                offset = detail.received;
+                continue;
+            }
+            if (error.response && error.response.status < 500) throw error;
+            if (++failures > RETRIES) throw error;
+            // Network hiccup: ask where the upload stands and resume
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await axios.get(`${API}/api/blobs/${id}`).catch(() => null);
+            if (status) {
+                onBytes(status.data.received - offset);
+                offset = status.data.received;
+                complete = status.data.complete;
+            }
+        }
+    }
+};
+
+// files: File[] -> [{id, name}] in the same order. onProgress(message, percent)
+export const uploadFiles = async (files, onProgress = () => {}) => {
+    onProgress(`Hashing ${files.length} files...`, 0);
+    const ids = [];
+    for (const file of files) ids.push(await fileId(file));
+
+    const { data } = await axios.post(`${API}/api/blobs/check`, { ids });
+    const missing = Object.fromEntries(data.missing.map(m => [m.id, m.received]));
+    const todo = files.filter((file, i) => ids[i] in missing && ids.indexOf(ids[i]) === i);
+    const total = todo.reduce((sum, file) => sum + file.size, 0);
+    let sent = todo.reduce((sum, file) => sum + missing[ids[files.indexOf(file)]], 0);
+    onProgress(`${files.length - todo.length} files already on the server, uploading ${todo.length}...`, 0);
+
+    for (const file of todo) {
+        const id = ids[files.indexOf(file)];
+        await uploadChunks(file, id, missing[id], (bytes) => {
+            sent += bytes;
+            onProgress(`Uploading ${file.name}...`, total ? Math.round(sent / total * 100) : 100);
+        });
+    }
+    return files.map((file, i) => ({ id: ids[i], name: file.name }));
+};